@@ -0,0 +1,171 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+
+
+class TokenBucket(object):
+    """Allows `rate` requests per second on average and bursts of `burst`."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now):
+        # returns 0 when admitted, otherwise the seconds until a token is free
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ConcurrencyLimit(object):
+    """At most `limit` requests run at once; up to `queue_size` more wait
+    for a slot for at most `timeout` seconds, anything beyond that is
+    refused straight away."""
+
+    def __init__(self, limit, queue_size=0, timeout=1.0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.stats = dict(admitted=0, queued=0, shed_queue_full=0, shed_timeout=0)
+
+    def acquire(self):
+        # returns None when admitted, otherwise why the request was shed
+        with self.condition:
+            # newcomers queue behind existing waiters instead of barging in
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self.stats['admitted'] += 1
+                return None
+            if self.waiting >= self.queue_size:
+                self.stats['shed_queue_full'] += 1
+                return 'queue_full'
+
+            self.waiting += 1
+            self.stats['queued'] += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['shed_timeout'] += 1
+                        return 'timeout'
+                    self.condition.wait(remaining)
+                self.active += 1
+                self.stats['admitted'] += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def metrics(self):
+        data = dict(self.stats)
+        data.update(active=self.active, waiting=self.waiting, limit=self.limit)
+        return data
+
+
+class AdmissionControl(object):
+    """Load shedding for the expensive endpoints listed in ADMISSION_LIMITS.
+
+    Each entry may set a per-client token bucket ('rate' requests per second
+    with bursts of 'burst'; excess requests get 429) and a concurrency limit
+    ('concurrency' running at once, 'queue' waiting for at most 'timeout'
+    seconds; excess requests get 503). Both carry a Retry-After header.
+    Limits apply per process. Clients are told apart by remote address, or
+    by the first address in ADMISSION_CLIENT_HEADER behind a proxy.
+    Clients in ADMISSION_EXEMPT (e.g. a load generator) skip the token
+    bucket but not the concurrency limits, which protect the server.
+    """
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.limits = {}
+        self.rate_limited = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.policies = app.config.get('ADMISSION_LIMITS', {})
+        self.client_header = app.config.get('ADMISSION_CLIENT_HEADER')
+        self.max_clients = app.config.get('ADMISSION_MAX_CLIENTS', 10000)
+        self.exempt = set(app.config.get('ADMISSION_EXEMPT', ()))
+        for endpoint, policy in self.policies.items():
+            if policy.get('concurrency'):
+                self.limits[endpoint] = ConcurrencyLimit(
+                    policy['concurrency'], policy.get('queue', 0), policy.get('timeout', 1.0))
+            self.rate_limited[endpoint] = 0
+        if app.config.get('ADMISSION_ENABLED', True):
+            app.before_request(self.admit)
+            app.teardown_request(self.release)
+
+    def client(self):
+        if self.client_header and request.headers.get(self.client_header):
+            return request.headers[self.client_header].split(',')[0].strip()
+        return request.remote_addr
+
+    def take_token(self, endpoint, policy):
+        key = (endpoint, self.client())
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.pop(key, None)
+            if bucket is None:
+                bucket = TokenBucket(policy['rate'], policy.get('burst', 1), now)
+            # most recently seen last, so the idlest client is evicted first
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+            wait = bucket.take(now)
+            if wait:
+                self.rate_limited[endpoint] += 1
+            return wait
+
+    def reject(self, status, retry_after, message):
+        response = jsonify({"error": message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+        return response
+
+    def admit(self):
+        policy = self.policies.get(request.endpoint)
+        if policy is None:
+            return None
+
+        if policy.get('rate') and self.client() not in self.exempt:
+            wait = self.take_token(request.endpoint, policy)
+            if wait:
+                return self.reject(429, wait, 'too many requests')
+
+        limit = self.limits.get(request.endpoint)
+        if limit is not None:
+            if limit.acquire() is not None:
+                return self.reject(503, policy.get('retry_after', 1), 'server busy, try again shortly')
+            g._admission = limit
+        return None
+
+    def release(self, exc):
+        limit = g.pop('_admission', None)
+        if limit is not None:
+            limit.release()
+
+    def metrics(self):
+        data = {}
+        for endpoint in self.policies:
+            data[endpoint] = self.limits[endpoint].metrics() if endpoint in self.limits else {}
+            data[endpoint]['rate_limited'] = self.rate_limited[endpoint]
+        data['clients'] = len(self.buckets)
+        return data
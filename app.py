@@ -6,17 +6,37 @@ from email.policy import strict
 import json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 import logging
-from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 
 from flask_migrate import Migrate
+from cache import TTLCache
+from tasks import TaskQueue
+from profiling import RequestProfiler
+from request_logging import RequestLogging
+from events import EventHub
+from compression import Compression
+from cache_control import CachePolicy
+from admission import AdmissionControl
+from sharding import PRIMARY, ShardMoving, ShardQuery, ShardRouter
+import os
+import re
+import sqlite3
 import sys
-from datetime import datetime, date
+import unicodedata
+import base64
+import hmac
+import math
+import random
+import time
+import click
+from datetime import datetime, date, timedelta
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -27,8 +47,27 @@ moment = Moment(app)
 app.config.from_object('config')
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(connection, record):
+  # SQLite only enforces foreign keys, and so runs the ON DELETE CASCADEs
+  # that take shows and matches with their venue or artist, when each
+  # connection asks for it
+  if isinstance(connection, sqlite3.Connection):
+    connection.execute('PRAGMA foreign_keys=ON')
+
 migrate = Migrate(app, db)
 
+cache = TTLCache(default_ttl=app.config.get('CACHE_DEFAULT_SECONDS', 60))
+tasks = TaskQueue()
+profiler = RequestProfiler(app)
+request_logging = RequestLogging(app)
+events = EventHub(app)
+# registered first so it runs last, once CachePolicy has set the headers
+compression = Compression(app)
+cache_policy = CachePolicy(app)
+admission = AdmissionControl(app)
+shards = ShardRouter()
+
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
@@ -38,6 +77,7 @@ class Venue(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
+    # searched through ix_Venue_state_city_name_key
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
@@ -49,8 +89,22 @@ class Venue(db.Model):
     website_link = db.Column(db.String(120))
     looking_for_talent = db.Column(db.String)
     seeking_description = db.Column(db.String(500))
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # normalised name used for duplicate detection, see name_key()
+    name_key = db.Column(db.String(255))
+    # maintained by the app, and set to the migration time for older rows
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=db.func.now())
+
+    __table_args__ = (
+      db.Index('ix_Venue_state_city_name_key', 'state', 'city', 'name_key'),
+    )
 
-    shows = db.relationship('Show', backref='venue', lazy=True, cascade = 'all, delete-orphan')
+    shows = db.relationship('Show', backref='venue', lazy=True, cascade = 'all, delete-orphan', passive_deletes=True)
+    archived_shows = db.relationship('ShowArchive', backref='venue', lazy=True, cascade = 'all, delete-orphan', passive_deletes=True)
+    matches = db.relationship('Match', backref='venue', lazy=True, cascade = 'all, delete-orphan', passive_deletes=True)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
       return f'<Venue {self.id} {self.name} {self.city} {self.state}>'
@@ -61,6 +115,7 @@ class Artist(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
+    # searched through ix_Artist_state_city_name_key
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
@@ -71,8 +126,20 @@ class Artist(db.Model):
     website_link = db.Column(db.String(120))
     looking_for_venues = db.Column(db.String(120))
     seeking_description = db.Column(db.String(500))
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    name_key = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=db.func.now())
+
+    __table_args__ = (
+      db.Index('ix_Artist_state_city_name_key', 'state', 'city', 'name_key'),
+    )
 
-    shows = db.relationship('Show', backref='artist', lazy=True, cascade = 'all, delete-orphan')
+    shows = db.relationship('Show', backref='artist', lazy=True, cascade = 'all, delete-orphan', passive_deletes=True)
+    archived_shows = db.relationship('ShowArchive', backref='artist', lazy=True, cascade = 'all, delete-orphan', passive_deletes=True)
+    matches = db.relationship('Match', backref='artist', lazy=True, cascade = 'all, delete-orphan', passive_deletes=True)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
       return f'<Artist {self.id} {self.name} {self.city} {self.state}>'
@@ -82,13 +149,236 @@ class Show(db.Model):
     __tablename__ = 'Show'
 
     id = db.Column(db.Integer, primary_key=True)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    # indexed by the composites below, which lead with these columns
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=db.func.now())
+
+    __table_args__ = (
+      db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+      db.Index('ix_Show_venue_start_time', 'venue_id', 'start_time'),
+      db.Index('ix_Show_artist_start_time', 'artist_id', 'start_time'),
+    )
 
     def __repr__(self):
       return f'<Show {self.id} {self.artist_id} {self.venue_id} {self.start_time}>'
-    
+
+
+class Match(db.Model):
+    __tablename__ = 'Match'
+
+    # Precomputed artist/venue pairings, refreshed whenever either side's
+    # seeking flag, genres or location changes (see refresh_artist_matches).
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    genre_overlap = db.Column(db.Integer, nullable=False, default=0)
+    same_city = db.Column(db.Boolean, nullable=False, default=False)
+    artist_recent_shows = db.Column(db.Integer, nullable=False, default=0)
+    venue_recent_shows = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+      db.Index('ix_Match_artist_score', 'artist_id', 'score'),
+      db.Index('ix_Match_venue_score', 'venue_id', 'score'),
+    )
+
+    def __repr__(self):
+      return f'<Match {self.artist_id} {self.venue_id} {self.score}>'
+
+
+class TrendingRollup(db.Model):
+    __tablename__ = 'TrendingRollup'
+
+    # Number of shows per venue, artist or city per day, keyed by the show's
+    # start date. Maintained incrementally by update_trending().
+    kind = db.Column(db.String(10), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    shows = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+      db.Index('ix_TrendingRollup_kind_day', 'kind', 'day'),
+    )
+
+    def __repr__(self):
+      return f'<TrendingRollup {self.kind} {self.key} {self.day} {self.shows}>'
+
+
+class RollupState(db.Model):
+    __tablename__ = 'RollupState'
+
+    # High-water mark of the last Show.id folded into a rollup
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+      return f'<RollupState {self.name} {self.last_id}>'
+
+
+class ShowArchive(db.Model):
+    __tablename__ = 'ShowArchive'
+
+    # Shows moved out of Show by archive_shows(). On PostgreSQL the table is
+    # partitioned by start_time (see the migration and ensure_archive_partitions).
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    start_time = db.Column(db.DateTime, primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False, index=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False, index=True)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+      return f'<ShowArchive {self.id} {self.artist_id} {self.venue_id} {self.start_time}>'
+
+
+class StalePage(db.Model):
+    __tablename__ = 'StalePage'
+
+    # Pre-rendered pages that need rebuilding, recorded in the same
+    # transaction as the write that affected them (see prerender.py)
+    path = db.Column(db.String(255), primary_key=True)
+    marked_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+      return f'<StalePage {self.path}>'
+
+
+class CatalogueStat(db.Model):
+    __tablename__ = 'CatalogueStat'
+
+    # Venue, artist and show counts per state, city, genre and month.
+    # Maintained incrementally by fold_stats() from StatsDelta rows.
+    dimension = db.Column(db.String(10), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    venues = db.Column(db.Integer, nullable=False, default=0)
+    artists = db.Column(db.Integer, nullable=False, default=0)
+    shows = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+      return f'<CatalogueStat {self.dimension} {self.key} {self.venues} {self.artists} {self.shows}>'
+
+
+class StatsDelta(db.Model):
+    __tablename__ = 'StatsDelta'
+
+    # Count changes appended by the write handlers in the same transaction
+    # as the write; fold_stats() applies and removes them.
+    id = db.Column(db.Integer, primary_key=True)
+    dimension = db.Column(db.String(10), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    venues = db.Column(db.Integer, nullable=False, default=0)
+    artists = db.Column(db.Integer, nullable=False, default=0)
+    shows = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+      return f'<StatsDelta {self.id} {self.dimension} {self.key}>'
+
+
+class Job(db.Model):
+    __tablename__ = 'Job'
+
+    # Durable queue used when TASK_BACKEND = 'database'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(500))
+    run_after = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    # when a worker took the job; see TASK_LEASE_SECONDS
+    claimed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+      db.Index('ix_Job_status_run_after', 'status', 'run_after'),
+    )
+
+    def __repr__(self):
+      return f'<Job {self.id} {self.name} {self.status}>'
+
+
+class ShardMap(db.Model):
+    __tablename__ = 'ShardMap'
+
+    # Which shard holds the venues of a state, when not SHARD_DEFAULT.
+    # 'moving' is set while 'flask move-state' copies the state elsewhere.
+    state = db.Column(db.String(120), primary_key=True)
+    shard = db.Column(db.String(50), nullable=False)
+    moving = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+      return f'<ShardMap {self.state} {self.shard}>'
+
+
+class ShardSequence(db.Model):
+    __tablename__ = 'ShardSequence'
+
+    # Next free id of a sharded table, handed out in blocks (see sharding.py)
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+      return f'<ShardSequence {self.name} {self.next_id}>'
+
+
+class VenueShard(db.Model):
+    __tablename__ = 'VenueShard'
+
+    # Directory of venue ids and their state, i.e. the shard they live on
+    venue_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    state = db.Column(db.String(120), index=True)
+
+    def __repr__(self):
+      return f'<VenueShard {self.venue_id} {self.state}>'
+
+
+class OutboxEntry(db.Model):
+    __tablename__ = 'OutboxEntry'
+
+    # Change log of venues, artists and shows, appended in the same
+    # transaction as each write and read by consumers through /changes.
+    # 'payload' is the row as written (JSON); deletes only carry its id.
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(10), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+      db.Index('ix_OutboxEntry_entity_entity_id', 'entity', 'entity_id', 'id'),
+    )
+
+    def __repr__(self):
+      return f'<OutboxEntry {self.id} {self.action} {self.entity} {self.entity_id}>'
+
+
+class OutboxConsumer(db.Model):
+    __tablename__ = 'OutboxConsumer'
+
+    # Last OutboxEntry.id each downstream consumer has acknowledged
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+      return f'<OutboxConsumer {self.name} {self.last_id}>'
+
+
+tasks.init_app(app, db, Job)
+shards.init_app(app, db, ShardMap, ShardSequence)
+
+def check_outbox(app, shards):
+  # Outbox entries are written through db.session and so commit with the
+  # primary, after the shards (see ShardRouter.commit): with SHARDS a change
+  # could commit without its entry.
+  if app.config.get('OUTBOX_ENABLED', True) and shards.enabled:
+    raise ValueError('The change log needs SHARDS unset; set OUTBOX_ENABLED = False to shard')
+
+check_outbox(app, shards)
+
 
 #----------------------------------------------------------------------------#
 # Filters.
@@ -104,46 +394,1210 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Matching.
+#----------------------------------------------------------------------------#
+
+MATCH_ACTIVITY_DAYS = 90
+
+def genre_set(value):
+  # genres are stored either as a postgres array literal ('{Jazz,Rock}')
+  # or as a plain comma separated string
+  if not value:
+    return set()
+  value = value.strip().strip('{}')
+  return {g.strip().strip('"') for g in value.split(',') if g.strip().strip('"')}
+
+def has_genre(column, genre):
+  # SQL counterpart of genre in genre_set(column): the list without braces,
+  # quotes and spaces after commas, wrapped in commas, so only a whole entry
+  # matches ('Rock' does not match 'Rock n Roll')
+  entries = column
+  for old, new in (('{', ''), ('}', ''), ('"', ''), (', ', ',')):
+    entries = db.func.replace(entries, old, new)
+  entries = db.literal(',', db.String) + db.func.lower(entries) + ','
+  return entries.contains(',' + genre.strip().lower() + ',', autoescape=True)
+
+def is_seeking(value):
+  return str(value).strip().lower() in ('y', 'yes', 'true', 't', 'on', '1')
+
+def match_score(genre_overlap, same_city, artist_recent_shows=0, venue_recent_shows=0):
+  # Shared genres weigh most, then the city. Recent shows count with
+  # diminishing returns: ten of them weigh a little less than one genre, so
+  # an active counterpart outranks an idle one without beating a better fit.
+  return genre_overlap * 3 + (2 if same_city else 0) + 1 + \
+    math.log1p(artist_recent_shows) + math.log1p(venue_recent_shows)
+
+def recent_show_counts(column, ids, shard=None):
+  # summed over every shard unless the shard is given
+  if not ids:
+    return {}
+  since = datetime.now() - timedelta(days=MATCH_ACTIVITY_DAYS)
+  query = db.session.query(column, db.func.count(Show.id)) \
+    .filter(column.in_(ids), Show.start_time >= since) \
+    .group_by(column)
+  counts = {}
+  for id, count in shards.select(query, shard):
+    counts[id] = counts.get(id, 0) + count
+  return counts
+
+def build_matches(shard, artists, venues):
+  # matches are kept on the shard of the venue
+  activity_artist = recent_show_counts(Show.artist_id, [a.id for a in artists])
+  activity_venue = recent_show_counts(Show.venue_id, [v.id for v in venues], shard)
+
+  session = shards.session(shard)
+  for artist in artists:
+    for venue in venues:
+      overlap = len(genre_set(artist.genres) & genre_set(venue.genres))
+      same_city = (venue.city or '').lower() == (artist.city or '').lower()
+      artist_recent_shows = activity_artist.get(artist.id, 0)
+      venue_recent_shows = activity_venue.get(venue.id, 0)
+      session.add(Match(
+        artist_id=artist.id,
+        venue_id=venue.id,
+        score=match_score(overlap, same_city, artist_recent_shows, venue_recent_shows),
+        genre_overlap=overlap,
+        same_city=same_city,
+        artist_recent_shows=artist_recent_shows,
+        venue_recent_shows=venue_recent_shows
+      ))
+
+def refresh_artist_matches(artist_id):
+  # Only counterparts in the same state are considered, so a refresh reads
+  # one indexed slice of the catalogue instead of scanning every venue.
+  for name in shards.names:
+    # 'fetch' evicts the deleted matches from the session, so ones this
+    # refresh adds again (a show refreshes its artist and venue) are new rows
+    shards.session(name).query(Match).filter(Match.artist_id == artist_id).delete(synchronize_session='fetch')
+
+  artist = db.session.query(Artist).get(artist_id)
+  if artist is None or not is_seeking(artist.looking_for_venues):
+    return 0
+
+  shard = shards.for_state(artist.state)
+  venues = [v for v in shards.session(shard).query(Venue).filter(Venue.state == artist.state)
+            if is_seeking(v.looking_for_talent)]
+  build_matches(shard, [artist], venues)
+  return len(venues)
+
+def refresh_venue_matches(venue_id):
+  shard = run_queries(venue_shard(venue_id))
+  if shard is None:
+    return 0
+  session = shards.session(shard)
+  session.query(Match).filter(Match.venue_id == venue_id).delete(synchronize_session='fetch')
+
+  venue = session.query(Venue).get(venue_id)
+  if venue is None or not is_seeking(venue.looking_for_talent):
+    return 0
+
+  artists = [a for a in db.session.query(Artist).filter(Artist.state == venue.state)
+             if is_seeking(a.looking_for_venues)]
+  build_matches(shard, artists, [venue])
+  return len(artists)
+
+def rebuild_state_matches(state):
+  # every match of the venues in one state, on the shard that holds them
+  shard = shards.for_state(state)
+  session = shards.session(shard)
+  venue_ids = session.query(Venue.id).filter(Venue.state == state).statement
+  session.query(Match).filter(Match.venue_id.in_(venue_ids)).delete(synchronize_session=False)
+
+  artists = [a for a in db.session.query(Artist).filter(Artist.state == state)
+             if is_seeking(a.looking_for_venues)]
+  venues = [v for v in session.query(Venue).filter(Venue.state == state)
+            if is_seeking(v.looking_for_talent)]
+  build_matches(shard, artists, venues)
+  return len(artists) * len(venues)
+
+@tasks.task
+def refresh_matches(artist_id=None, venue_id=None):
+  if artist_id is not None:
+    refresh_artist_matches(artist_id)
+  if venue_id is not None:
+    refresh_venue_matches(venue_id)
+  shards.commit()
+
+#----------------------------------------------------------------------------#
+# Trending.
+#----------------------------------------------------------------------------#
+
+def city_key(city, state):
+  return f'{city}, {state}'
+
+@tasks.task
+def update_trending(batch_size=1000):
+  # Folds shows inserted since the last run into TrendingRollup. Only the new
+  # Show rows are read; the rollup itself is updated key by key.
+  # the row lock serialises concurrent runs so no show is counted twice
+  state = db.session.query(RollupState).filter(RollupState.name == 'trending').with_for_update().first()
+  if state is None:
+    state = RollupState(name='trending', last_id=0)
+    db.session.add(state)
+
+  settled = datetime.now() - timedelta(seconds=app.config.get('TRENDING_SETTLE_SECONDS', 5))
+  processed = 0
+  while True:
+    # ids are unique across shards, so the first batch_size of every shard's
+    # batch, merged by id, is the next batch overall
+    query = db.session.query(Show.id, Show.artist_id, Show.venue_id, Show.start_time, Venue.city, Venue.state,
+                             Show.created_at) \
+      .join(Venue, Venue.id == Show.venue_id) \
+      .filter(Show.id > state.last_id) \
+      .order_by(Show.id) \
+      .limit(batch_size)
+    rows = shards.execute(shards.everywhere(query, key=lambda row: row[0], owner=Venue.state))[:batch_size]
+
+    # The mark only moves forward, so a show inserted with a lower id by a
+    # transaction that commits later would be skipped for good. Shows past
+    # an id gap wait until that transaction would have committed, as in
+    # read_changes().
+    last_id = state.last_id
+    for i, row in enumerate(rows):
+      if row[0] != last_id + 1 and row[6] > settled:
+        rows = rows[:i]
+        break
+      last_id = row[0]
+    if not rows:
+      break
+
+    counts = {}
+    for show_id, artist_id, venue_id, start_time, city, venue_state, created_at in rows:
+      day = start_time.date()
+      for kind, key in (('venue', str(venue_id)), ('artist', str(artist_id)), ('city', city_key(city, venue_state))):
+        counts[(kind, key, day)] = counts.get((kind, key, day), 0) + 1
+
+    for (kind, key, day), count in counts.items():
+      rollup = db.session.query(TrendingRollup).get((kind, key, day))
+      if rollup is None:
+        db.session.add(TrendingRollup(kind=kind, key=key, day=day, shows=count))
+      else:
+        rollup.shows += count
+
+    state.last_id = rows[-1][0]
+    db.session.commit()
+    processed += len(rows)
+    if len(rows) < batch_size:
+      break
+
+  if processed:
+    cache.invalidate(prefix='trending:')
+  return processed
+
+def trending_shows(model, *criteria, shard=None):
+  # (id, start_time, artist_id, venue_id, city, state) of shows or archived
+  # shows, the fields update_trending() counts them by
+  query = db.session.query(model.id, model.start_time, model.artist_id, model.venue_id, Venue.city, Venue.state) \
+    .join(Venue, Venue.id == model.venue_id) \
+    .filter(*criteria)
+  return [tuple(row) for row in shards.select(query, shard, owner=Venue.state)]
+
+def adjust_trending(shows, count):
+  # Adds (count 1) or takes back (count -1) what update_trending() counted
+  # for these shows, in the caller's transaction. Shows past its mark are
+  # left for it to count; its row lock keeps a run from folding them in
+  # between.
+  state = db.session.query(RollupState).filter(RollupState.name == 'trending').with_for_update().first()
+  if state is None:
+    return
+  counts = {}
+  for show_id, start_time, artist_id, venue_id, city, venue_state in shows:
+    if show_id > state.last_id:
+      continue
+    day = start_time.date()
+    for kind, key in (('venue', str(venue_id)), ('artist', str(artist_id)), ('city', city_key(city, venue_state))):
+      counts[(kind, key, day)] = counts.get((kind, key, day), 0) + count
+
+  for (kind, key, day), change in counts.items():
+    rollup = db.session.query(TrendingRollup).get((kind, key, day))
+    if rollup is None:
+      if change > 0:
+        db.session.add(TrendingRollup(kind=kind, key=key, day=day, shows=change))
+    elif rollup.shows + change > 0:
+      rollup.shows += change
+    else:
+      db.session.delete(rollup)
+  if counts:
+    cache.invalidate(prefix='trending:')
+
+def trending_for(kind, window, limit=5):
+  today = date.today()
+  played = db.func.sum(db.case([(TrendingRollup.day < today, TrendingRollup.shows)], else_=0))
+  scheduled = db.func.sum(db.case([(TrendingRollup.day >= today, TrendingRollup.shows)], else_=0))
+
+  rows = db.session.query(TrendingRollup.key, played, scheduled) \
+    .filter(TrendingRollup.kind == kind,
+            TrendingRollup.day >= today - timedelta(days=window),
+            TrendingRollup.day <= today + timedelta(days=window)) \
+    .group_by(TrendingRollup.key) \
+    .order_by(db.func.sum(TrendingRollup.shows).desc()) \
+    .limit(limit).all()
+
+  names = {}
+  if kind in ('venue', 'artist') and rows:
+    ids = [int(key) for key, _, _ in rows]
+    if kind == 'venue':
+      query = db.session.query(Venue.id, Venue.name).filter(Venue.id.in_(ids))
+      found = shards.execute(shards.everywhere(query, owner=Venue.state))
+    else:
+      found = db.session.query(Artist.id, Artist.name).filter(Artist.id.in_(ids))
+    names = {str(id): name for id, name in found}
+
+  data = []
+  for key, played_count, scheduled_count in rows:
+    if kind != 'city' and key not in names:
+      continue
+    data.append({
+      "key": key,
+      "name": names.get(key, key),
+      "url": f'/{kind}s/{key}' if kind != 'city' else None,
+      "played": int(played_count or 0),
+      "scheduled": int(scheduled_count or 0)
+    })
+  return data
+
+def trending(window):
+  # The home page is the busiest route, so the (already small) rollup query
+  # is additionally cached for a short while.
+  def compute():
+    return {
+      "window": window,
+      "venues": trending_for('venue', window),
+      "artists": trending_for('artist', window),
+      "cities": trending_for('city', window)
+    }
+  return cache.get_or_set(f'trending:{window}', compute, app.config.get('TRENDING_CACHE_SECONDS', 60))
+
+#----------------------------------------------------------------------------#
+# Archive.
+#----------------------------------------------------------------------------#
+
+def venue_shows(shard, model, venue_id, *criteria):
+  rows = yield shards.on(shard, db.session.query(model.start_time, Artist.id, Artist.name, Artist.image_link) \
+    .join(Artist, Artist.id == model.artist_id) \
+    .filter(model.venue_id == venue_id, *criteria) \
+    .order_by(model.start_time))
+
+  return [{
+    "artist_id": artist_id,
+    "artist_name": name,
+    "artist_image_link": image_link,
+    "start_time": start_time.strftime("%Y/%m/%d %H:%M:%S")
+  } for start_time, artist_id, name, image_link in rows]
+
+def artist_shows(model, artist_id, *criteria):
+  # an artist plays venues on any shard
+  query = db.session.query(model.start_time, Venue.id, Venue.name, Venue.image_link) \
+    .join(Venue, Venue.id == model.venue_id) \
+    .filter(model.artist_id == artist_id, *criteria) \
+    .order_by(model.start_time)
+  rows = yield shards.everywhere(query, key=lambda row: row[0], owner=Venue.state)
+
+  #Referenced link below for date formating
+  #https://stackoverflow.com/questions/63269150/typeerror-parser-must-be-a-string-or-character-stream-not-datetime
+  return [{
+    "venue_id": venue_id,
+    "venue_name": name,
+    "venue_image_link": image_link,
+    "start_time": start_time.strftime("%Y/%m/%d %H:%M:%S")
+  } for start_time, venue_id, name, image_link in rows]
+
+def ensure_archive_partitions(shard, first_year, last_year):
+  # Yearly range partitions of the PostgreSQL ShowArchive table; anything
+  # without a partition lands in ShowArchive_default.
+  if shards.engine(shard).dialect.name != 'postgresql':
+    return
+  for year in range(first_year, last_year + 1):
+    shards.session(shard).execute(
+      f'CREATE TABLE IF NOT EXISTS "ShowArchive_{year}" PARTITION OF "ShowArchive" '
+      f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+    )
+
+@tasks.task
+def archive_shows(days=None):
+  # Moves every show that ended more than ARCHIVE_AFTER_DAYS ago out of Show
+  # with two set-based statements in a single transaction per shard.
+  days = app.config.get('ARCHIVE_AFTER_DAYS', 365) if days is None else days
+  cutoff = datetime.now() - timedelta(days=days)
+
+  count = 0
+  for shard in shards.names:
+    session = shards.session(shard)
+    first, last = session.query(db.func.min(Show.start_time), db.func.max(Show.start_time)) \
+      .filter(Show.start_time < cutoff).one()
+    if first is None:
+      continue
+    ensure_archive_partitions(shard, first.year, last.year)
+
+    archive = ShowArchive.__table__
+    moved = session.query(Show.id, Show.start_time, Show.artist_id, Show.venue_id,
+                          db.literal(datetime.now()).label('archived_at')) \
+      .filter(Show.start_time < cutoff)
+    session.execute(archive.insert().from_select(
+      ['id', 'start_time', 'artist_id', 'venue_id', 'archived_at'], moved))
+    # Only shows found in the archive are deleted: under READ COMMITTED the
+    # DELETE also sees shows committed after the INSERT ran, and those are
+    # left for the next run. The probe is by the archive's primary key.
+    archived = db.exists().where(db.and_(archive.c.id == Show.id, archive.c.start_time == Show.start_time))
+    count += session.query(Show).filter(Show.start_time < cutoff, archived).delete(synchronize_session=False)
+    session.commit()
+  return count
+
+#----------------------------------------------------------------------------#
+# Stale pages.
+#----------------------------------------------------------------------------#
+
+def stale_pages_for(model, ids, related=True):
+  # The listing and detail pages of the given venues/artists and, when their
+  # names or images changed, every page that shows them next to a show.
+  kind = 'venues' if model is Venue else 'artists'
+  paths = {f'/{kind}'} | {f'/{kind}/{id}' for id in ids}
+  if related and ids:
+    if model is Venue:
+      others = shards.select(db.session.query(Show.artist_id).filter(Show.venue_id.in_(ids)).distinct())
+      paths |= {f'/artists/{id}' for (id,) in others}
+    else:
+      others = shards.select(db.session.query(Show.venue_id).filter(Show.artist_id.in_(ids)).distinct())
+      paths |= {f'/venues/{id}' for (id,) in others}
+    paths.add('/shows')
+  return paths
+
+def mark_stale(paths):
+  now = datetime.now()
+  for path in paths:
+    db.session.merge(StalePage(path=path, marked_at=now))
+
+#----------------------------------------------------------------------------#
+# Bulk delete.
+#----------------------------------------------------------------------------#
+
+def bulk_delete(model, ids):
+  # Shows, archived shows and matches go with their venue/artist through the
+  # ON DELETE CASCADE foreign keys, so nothing is loaded into the session.
+  # Dependent rows are counted first so the caller can report them. Venues
+  # are deleted on their shard, artists and their copies on every shard.
+  ids = [int(id) for id in ids]
+  column = 'venue_id' if model is Venue else 'artist_id'
+  placed = venue_shards(ids, write=True) if model is Venue else {name: ids for name in shards.names}
+
+  mark_stale(stale_pages_for(model, ids))
+  record_stats(stats_for_delete(model, ids))
+  for show in (Show, ShowArchive):
+    adjust_trending(trending_shows(show, getattr(show, column).in_(ids)), -1)
+
+  counts = dict.fromkeys(('shows', 'archived_shows', 'matches', 'deleted'), 0)
+  deleted, shows = set(), set()
+  for shard, shard_ids in placed.items():
+    session = shards.session(shard)
+    # records and shows are listed rather than counted, for the change log
+    shows |= {id for (id,) in session.query(Show.id).filter(getattr(Show, column).in_(shard_ids))}
+    for key, dependent in (('archived_shows', ShowArchive), ('matches', Match)):
+      counts[key] += session.query(dependent).filter(getattr(dependent, column).in_(shard_ids)).count()
+    if model is Venue or shard == PRIMARY:
+      deleted |= {id for (id,) in session.query(model.id).filter(model.id.in_(shard_ids))}
+    session.query(model).filter(model.id.in_(shard_ids)).delete(synchronize_session=False)
+  counts['shows'], counts['deleted'] = len(shows), len(deleted)
+  record_change(Show, 'delete', shows)
+  record_change(model, 'delete', deleted)
+  if model is Venue:
+    if shards.enabled:
+      db.session.query(VenueShard).filter(VenueShard.venue_id.in_(ids)).delete(synchronize_session=False)
+    cache.invalidate('venue_areas')
+  return counts
+
+def bulk_delete_response(model):
+  ids = request.form.getlist('ids') or request.args.getlist('ids')
+  if len(ids) == 1 and ',' in ids[0]:
+    ids = ids[0].split(',')
+
+  try:
+    counts = bulk_delete(model, ids)
+    shards.commit()
+    tasks.enqueue(fold_stats)
+  except ValueError:
+    shards.rollback()
+    return jsonify({"error": "ids must be integers"}), 400
+  except ShardMoving as e:
+    shards.rollback()
+    return jsonify({"error": str(e)}), 503
+  except:
+    shards.rollback()
+    app.logger.exception('Bulk delete of %s failed', model.__tablename__)
+    return jsonify({"error": "delete failed"}), 500
+  finally:
+    shards.close()
+
+  return jsonify(counts)
+
+#----------------------------------------------------------------------------#
+# Duplicates.
+#----------------------------------------------------------------------------#
+
+NAME_STOPWORDS = {'the', 'a', 'an', 'and'}
+
+def name_key(name):
+  # 'The Musical Hop' and 'Musical Hop, The' both become 'hop musical'
+  text = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode().lower()
+  words = [word for word in re.findall(r'[a-z0-9]+', text) if word not in NAME_STOPWORDS]
+  return ' '.join(sorted(words))[:255]
+
+def trigrams(text):
+  # padded per word the way pg_trgm does it
+  grams = set()
+  for word in text.split():
+    word = f'  {word} '
+    grams |= {word[i:i + 3] for i in range(len(word) - 2)}
+  return grams
+
+def name_similarity(a, b):
+  a, b = trigrams(a), trigrams(b)
+  if not a or not b:
+    return 0.0
+  return len(a & b) / float(len(a | b))
+
+def find_duplicates(model, name, city, state, exclude_id=None, limit=5):
+  # Candidates are only read from the same city and state through the
+  # (state, city, name_key) index, never compared against the whole table.
+  key = name_key(name)
+  threshold = app.config.get('DUPLICATE_SIMILARITY', 0.6)
+  query = db.session.query(model.id, model.name, model.name_key) \
+    .filter(model.state == state, model.city == city)
+  if exclude_id is not None:
+    query = query.filter(model.id != exclude_id)
+
+  found = []
+  for id, other_name, other_key in shards.select(query, shards.for_state(state) if model is Venue else PRIMARY):
+    other_key = other_key if other_key is not None else name_key(other_name)
+    score = 1.0 if other_key == key else name_similarity(key, other_key)
+    if score >= threshold:
+      found.append({"id": id, "name": other_name, "score": round(score, 2)})
+  found.sort(key=lambda duplicate: -duplicate["score"])
+  return found[:limit]
+
+def duplicate_warning(template, form, model, kind):
+  # Re-shows the create form when the new record looks like an existing one,
+  # unless the user already confirmed it is a different one.
+  if request.form.get('allow_duplicate'):
+    return None
+  duplicates = find_duplicates(model, request.form.get('name'), request.form.get('city'), request.form.get('state'))
+  if not duplicates:
+    return None
+  flash(f"{request.form.get('name')} looks like an existing {kind}: "
+        f"{', '.join(duplicate['name'] for duplicate in duplicates)}.")
+  return render_template(template, form=form, duplicates=duplicates), 409
+
+def merge_records(model, duplicate_id, canonical_id):
+  # Re-points the duplicate's shows and archived shows to the canonical
+  # record with one set-based UPDATE each, then deletes the duplicate (its
+  # matches go with it through ON DELETE CASCADE). Venues must be on the
+  # same shard; an artist's shows are re-pointed on every shard.
+  if duplicate_id == canonical_id:
+    raise ValueError('cannot merge a record into itself')
+  if model is Venue:
+    placed = venue_shards([duplicate_id, canonical_id], write=True)
+    if len(placed) > 1:
+      raise ValueError('cannot merge venues kept on different shards')
+    names = list(placed) or [PRIMARY]
+  else:
+    names = shards.names
+  session = shards.session(names[0])
+  canonical = session.query(model).get(canonical_id)
+  if canonical is None or session.query(model.id).filter(model.id == duplicate_id).first() is None:
+    raise LookupError('no such record')
+  column = 'venue_id' if model is Venue else 'artist_id'
+
+  mark_stale(stale_pages_for(model, [duplicate_id, canonical_id]))
+  # take both records out of the stats and put the merged one back
+  deltas = stats_for_delete(model, [duplicate_id, canonical_id])
+
+  # the duplicate's shows count for the canonical record from now on
+  moving = [row for show in (Show, ShowArchive) for row in trending_shows(show, getattr(show, column) == duplicate_id)]
+  adjust_trending(moving, -1)
+  if model is Venue:
+    moved_rows = [(id, start_time, artist_id, canonical_id, canonical.city, canonical.state)
+                  for id, start_time, artist_id, venue_id, city, state in moving]
+  else:
+    moved_rows = [(id, start_time, canonical_id, venue_id, city, state)
+                  for id, start_time, artist_id, venue_id, city, state in moving]
+  adjust_trending(moved_rows, 1)
+
+  counts = dict.fromkeys(('shows', 'archived_shows'), 0)
+  for name in names:
+    session = shards.session(name)
+    moved = [id for (id,) in session.query(Show.id).filter(getattr(Show, column) == duplicate_id)]
+    for key, show in (('shows', Show), ('archived_shows', ShowArchive)):
+      counts[key] += session.query(show) \
+        .filter(getattr(show, column) == duplicate_id) \
+        .update({column: canonical_id}, synchronize_session=False)
+    session.query(model).filter(model.id == duplicate_id).delete(synchronize_session=False)
+    record_change(Show, 'update', moved, name)
+  record_change(model, 'delete', [duplicate_id])
+  if model is Venue and shards.enabled:
+    db.session.query(VenueShard).filter(VenueShard.venue_id == duplicate_id).delete(synchronize_session=False)
+
+  add_stats(deltas, profile_stat_keys(canonical.city, canonical.state, canonical.genres),
+            'venues' if model is Venue else 'artists')
+  for show in (Show, ShowArchive):
+    add_show_stats(deltas, show, getattr(show, column) == canonical_id)
+  record_stats(deltas)
+  return counts
+
+#----------------------------------------------------------------------------#
+# Edits.
+#----------------------------------------------------------------------------#
+
+VENUE_FIELDS = ('name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link',
+                'genres', 'website_link', 'looking_for_talent', 'seeking_description')
+ARTIST_FIELDS = ('name', 'city', 'state', 'phone', 'genres', 'image_link', 'facebook_link',
+                 'website_link', 'looking_for_venues', 'seeking_description')
+
+# the forms post the seeking checkboxes under the WTForms field names
+FORM_ALIASES = {'looking_for_talent': 'seeking_talent', 'looking_for_venues': 'seeking_venue'}
+
+def run_follow_ups(description, *follow_ups):
+  # Tasks, events and cache invalidation after a write has committed. The
+  # write stands whatever happens to them, so each one that fails is only
+  # logged and the others still run.
+  for follow_up in follow_ups:
+    try:
+      follow_up()
+    except:
+      app.logger.exception('Follow-up of %s failed', description)
+
+def form_value(field):
+  return request.form.get(field, request.form.get(FORM_ALIASES.get(field, field)))
+
+def changed_fields(record, fields):
+  # a blank input means no value, so leaving an unset field blank is no change
+  changes = {}
+  for field in fields:
+    value = form_value(field) or None
+    if value != (getattr(record, field) or None):
+      changes[field] = value
+  return changes
+
+def submitted_version():
+  # The version the editor loaded. Without it the update could not tell a
+  # stale form from a fresh one, so the request is refused.
+  version = request.form.get('version', type=int)
+  if version is None:
+    abort(400, 'The form is missing the record version; reload it and save again.')
+  return version
+
+def update_versioned(model, id, version, changes, shard=PRIMARY):
+  # Optimistic concurrency: a single UPDATE of just the changed columns that
+  # only matches if nobody has saved the record since the editor loaded it.
+  values = dict(changes)
+  values['version'] = model.version + 1
+  return shards.session(shard).query(model) \
+    .filter(model.id == id, model.version == version) \
+    .update(values, synchronize_session=False)
+
+def edit_conflict(template, form, name, model, id, shard=PRIMARY):
+  current = shards.session(shard).query(model).get(id)
+  submitted = {field: request.form.get(field) for field in request.form}
+  conflicts = [field for field in submitted
+               if hasattr(current, field) and field != 'version'
+               and (getattr(current, field) or None) != (submitted[field] or None)]
+  flash(f'{current.name} was changed by someone else while you were editing. '
+        f'Review the current values ({", ".join(conflicts) or "no field differences"}) and save again.')
+  return render_template(template, form=form, **{name: current, 'conflicts': conflicts}), 409
+
+#----------------------------------------------------------------------------#
+# Query steps.
+#----------------------------------------------------------------------------#
+
+# The read-heavy views are written as generators that yield each query they
+# need and are sent its rows back. run_queries() executes them here, and
+# asgi.py runs the very same generators over an async engine. Queries of
+# sharded tables are yielded wrapped in a ShardQuery that says where to run.
+
+def run_queries(steps):
+  rows = None
+  while True:
+    try:
+      query = steps.send(rows)
+    except StopIteration as done:
+      return done.value
+    if isinstance(query, ShardQuery):
+      rows = shards.execute(query)
+    else:
+      rows = db.session.execute(query.statement).fetchall()
+
+#----------------------------------------------------------------------------#
+# Shards.
+#----------------------------------------------------------------------------#
+
+# With SHARDS configured, each venue lives on the shard of its state (see
+# sharding.py) together with its shows, archived shows and matches. Artists
+# are written to the primary and copied to every shard, so that shows can
+# still be joined with their artist there. VenueShard tells which state, and
+# so which shard, a venue id belongs to.
+
+SHARDED_MODELS = (Venue, Artist, Show, ShowArchive, Match)
+
+def venue_shard(venue_id, write=False):
+  # the shard of a venue, or None if there is no such venue
+  if not shards.enabled:
+    return PRIMARY
+  rows = yield db.session.query(VenueShard.state).filter(VenueShard.venue_id == venue_id)
+  if not rows:
+    return None
+  if write:
+    shards.check_writable(rows[0][0])
+  return shards.for_state(rows[0][0])
+
+def venue_shards(ids, write=False):
+  # {shard: [venue ids]} of the venues that exist
+  if not shards.enabled:
+    return {PRIMARY: list(ids)} if ids else {}
+  placed = {}
+  for venue_id, state in db.session.query(VenueShard.venue_id, VenueShard.state).filter(VenueShard.venue_id.in_(ids)):
+    if write:
+      shards.check_writable(state)
+    placed.setdefault(shards.for_state(state), []).append(venue_id)
+  return placed
+
+def place_venue(venue_id, state):
+  if shards.enabled:
+    db.session.merge(VenueShard(venue_id=venue_id, state=state))
+
+def table_rows(session, table, *criteria):
+  return [{column.name: row[column] for column in table.columns}
+          for row in session.execute(table.select().where(db.and_(*criteria)))]
+
+def replicate_artists(ids, names=None):
+  # Copies the primary's rows of these artists to the other shards, or to
+  # the given ones. Existing copies are updated in place: deleting them
+  # would cascade to their shows.
+  ids = list(ids)
+  if not shards.enabled or not ids:
+    return
+  table = Artist.__table__
+  rows = table_rows(db.session, table, table.c.id.in_(ids))
+  for name in names or shards.names[1:]:
+    if name == PRIMARY:
+      continue
+    session = shards.session(name)
+    existing = {id for (id,) in session.execute(db.select([table.c.id]).where(table.c.id.in_(ids)))}
+    for row in rows:
+      if row['id'] in existing:
+        session.execute(table.update().where(table.c.id == row['id']).values(row))
+    missing = [row for row in rows if row['id'] not in existing]
+    if missing:
+      session.execute(table.insert(), missing)
+
+def copy_venues(ids, source, target):
+  # Copies venues with their shows and archived shows; matches are rebuilt
+  # on the target instead (see rebuild_state_matches).
+  source_session, target_session = shards.session(source), shards.session(target)
+  copied = {}
+  for model, column in ((Venue, 'id'), (Show, 'venue_id'), (ShowArchive, 'venue_id')):
+    table = model.__table__
+    copied[model] = table_rows(source_session, table, table.c[column].in_(ids))
+  replicate_artists({row['artist_id'] for model in (Show, ShowArchive) for row in copied[model]}, [target])
+  for model, rows in copied.items():
+    if rows:
+      target_session.execute(model.__table__.insert(), rows)
+  return len(copied[Show])
+
+def purge_venues(ids, shard):
+  # deletes venues and everything of theirs from one shard, without relying
+  # on ON DELETE CASCADE
+  session = shards.session(shard)
+  for model in (Match, ShowArchive, Show):
+    session.query(model).filter(model.venue_id.in_(ids)).delete(synchronize_session=False)
+  session.query(Venue).filter(Venue.id.in_(ids)).delete(synchronize_session=False)
+
+def move_venues(ids, source, target):
+  copy_venues(ids, source, target)
+  purge_venues(ids, source)
+
+#----------------------------------------------------------------------------#
+# Venue areas.
+#----------------------------------------------------------------------------#
+
+def load_venue_areas():
+  # Venues grouped by city and state for /venues, read in one ordered query
+  # and cached; venue writes invalidate it.
+  data = cache.get('venue_areas')
+  if data is None:
+    data=[]
+    rows = yield shards.everywhere(db.session.query(Venue.id, Venue.name, Venue.city, Venue.state)
+                                   .order_by(Venue.state, Venue.city, Venue.name),
+                                   key=lambda row: (row[3] or '', row[2] or '', row[1] or ''), owner=Venue.state)
+
+    for id, name, city, state in rows:
+      if not data or (data[-1]["city"], data[-1]["state"]) != (city, state):
+        data.append({"city": city, "state": state, "venues": []})
+      data[-1]["venues"].append({"id": id, "name": name})
+    cache.set('venue_areas', data, app.config.get('VENUE_AREAS_CACHE_SECONDS', 30))
+  return data
+
+def venue_areas():
+  return run_queries(load_venue_areas())
+
+#----------------------------------------------------------------------------#
+# Catalogue stats.
+#----------------------------------------------------------------------------#
+
+STATS_DIMENSIONS = ('state', 'city', 'genre', 'month')
+STATS_COLUMNS = ('venues', 'artists', 'shows')
+
+def profile_stat_keys(city, state, genres):
+  # venues and artists count towards their location and each of their genres
+  keys = [('state', state or ''), ('city', city_key(city, state))]
+  return keys + [('genre', genre) for genre in sorted(genre_set(genres))]
+
+def show_stat_keys(start_time, city, state, genres):
+  # a show counts towards its venue's location, its artist's genres and the
+  # month it starts in
+  return profile_stat_keys(city, state, genres) + [('month', start_time.strftime('%Y-%m'))]
+
+def add_stats(deltas, keys, column, count=1):
+  for key in keys:
+    counts = deltas.setdefault(key, dict.fromkeys(STATS_COLUMNS, 0))
+    counts[column] += count
+
+def add_show_stats(deltas, model, *criteria, count=1, shard=None):
+  query = db.session.query(model.start_time, Venue.city, Venue.state, Artist.genres) \
+    .join(Venue, Venue.id == model.venue_id) \
+    .join(Artist, Artist.id == model.artist_id) \
+    .filter(*criteria)
+  for row in shards.select(query, shard, owner=Venue.state):
+    add_stats(deltas, show_stat_keys(*row), 'shows', count)
+
+def stats_for_create(model, record, shard=None):
+  deltas = {}
+  if model is Show:
+    add_show_stats(deltas, Show, Show.id == record.id, shard=shard)
+  else:
+    add_stats(deltas, profile_stat_keys(record.city, record.state, record.genres),
+              'venues' if model is Venue else 'artists')
+  return deltas
+
+def stats_for_edit(model, record, changes, shard=None):
+  # Moves the record, and when its location or genres changed the shows
+  # counted under them, from the old keys to the new ones.
+  kind = 'venues' if model is Venue else 'artists'
+  new = {field: changes.get(field, getattr(record, field)) for field in ('city', 'state', 'genres')}
+  old_keys = profile_stat_keys(record.city, record.state, record.genres)
+  new_keys = profile_stat_keys(new['city'], new['state'], new['genres'])
+  deltas = {}
+  if old_keys == new_keys:
+    return deltas
+  add_stats(deltas, old_keys, kind, -1)
+  add_stats(deltas, new_keys, kind, 1)
+
+  # shows take their location from the venue and their genres from the artist
+  if model is Venue:
+    column, old_keys, new_keys = 'venue_id', old_keys[:2], new_keys[:2]
+  else:
+    column, old_keys, new_keys = 'artist_id', old_keys[2:], new_keys[2:]
+  if old_keys != new_keys:
+    shows = sum(count for show in (Show, ShowArchive) for (count,) in shards.select(
+      db.session.query(db.func.count(show.id)).filter(getattr(show, column) == record.id), shard))
+    add_stats(deltas, old_keys, 'shows', -shows)
+    add_stats(deltas, new_keys, 'shows', shows)
+  return deltas
+
+def stats_for_delete(model, ids):
+  kind = 'venues' if model is Venue else 'artists'
+  column = 'venue_id' if model is Venue else 'artist_id'
+  deltas = {}
+  query = db.session.query(model.city, model.state, model.genres).filter(model.id.in_(ids))
+  rows = shards.select(query, owner=Venue.state) if model is Venue else query
+  for city, state, genres in rows:
+    add_stats(deltas, profile_stat_keys(city, state, genres), kind, -1)
+  for show in (Show, ShowArchive):
+    add_show_stats(deltas, show, getattr(show, column).in_(ids), count=-1)
+  return deltas
+
+def record_stats(deltas):
+  # Appended in the caller's transaction. Inserts never contend with each
+  # other, so busy keys do not serialise writers; fold_stats() sums them up.
+  for (dimension, key), counts in deltas.items():
+    if any(counts.values()):
+      db.session.add(StatsDelta(dimension=dimension, key=key[:255], **counts))
+
+@tasks.task
+def fold_stats(batch_size=1000):
+  folded = 0
+  while True:
+    # the row lock serialises concurrent folds so no delta is applied twice
+    state = db.session.query(RollupState).filter(RollupState.name == 'stats').with_for_update().first()
+    if state is None:
+      state = RollupState(name='stats', last_id=0)
+      db.session.add(state)
+
+    deltas = db.session.query(StatsDelta).order_by(StatsDelta.id).limit(batch_size).all()
+    if not deltas:
+      db.session.commit()
+      break
+
+    totals = {}
+    for delta in deltas:
+      for column in STATS_COLUMNS:
+        add_stats(totals, [(delta.dimension, delta.key)], column, getattr(delta, column))
+    for (dimension, key), counts in totals.items():
+      stat = db.session.query(CatalogueStat).get((dimension, key))
+      if stat is None:
+        db.session.add(CatalogueStat(dimension=dimension, key=key, **counts))
+      else:
+        for column, count in counts.items():
+          setattr(stat, column, getattr(stat, column) + count)
+
+    # by id, not by range: a lower id may still be in an open transaction
+    ids = [delta.id for delta in deltas]
+    db.session.query(StatsDelta).filter(StatsDelta.id.in_(ids)).delete(synchronize_session=False)
+    state.last_id = ids[-1]
+    db.session.commit()
+    folded += len(deltas)
+
+  if folded:
+    cache.invalidate('catalogue_stats')
+  return folded
+
+def rebuild_stats():
+  # Recounts everything from the base tables, for a fresh rollup or after
+  # rows were changed outside the app.
+  db.session.query(RollupState).filter(RollupState.name == 'stats').with_for_update().first()
+  db.session.query(StatsDelta).delete(synchronize_session=False)
+  db.session.query(CatalogueStat).delete(synchronize_session=False)
+
+  totals = {}
+  venues = shards.select(db.session.query(Venue.city, Venue.state, Venue.genres), owner=Venue.state)
+  for city, state, genres in venues:
+    add_stats(totals, profile_stat_keys(city, state, genres), 'venues')
+  for city, state, genres in db.session.query(Artist.city, Artist.state, Artist.genres).yield_per(1000):
+    add_stats(totals, profile_stat_keys(city, state, genres), 'artists')
+  for show in (Show, ShowArchive):
+    add_show_stats(totals, show)
+
+  for (dimension, key), counts in totals.items():
+    db.session.add(CatalogueStat(dimension=dimension, key=key[:255], **counts))
+  db.session.commit()
+  cache.invalidate('catalogue_stats')
+  return len(totals)
+
+def catalogue_stats():
+  # Reads only the rollup, whose size depends on the number of distinct
+  # states, cities, genres and months rather than on the catalogue.
+  def compute():
+    data = {dimension: [] for dimension in STATS_DIMENSIONS}
+    rows = db.session.query(CatalogueStat) \
+      .filter(db.or_(CatalogueStat.venues != 0, CatalogueStat.artists != 0, CatalogueStat.shows != 0)) \
+      .order_by(CatalogueStat.dimension, CatalogueStat.key)
+    for stat in rows:
+      data.setdefault(stat.dimension, []).append({
+        "key": stat.key,
+        "venues": stat.venues,
+        "artists": stat.artists,
+        "shows": stat.shows
+      })
+    # every record has exactly one state, so the state rows add up to the totals
+    data["totals"] = {column: sum(row[column] for row in data['state']) for column in STATS_COLUMNS}
+    return data
+  return cache.get_or_set('catalogue_stats', compute, app.config.get('STATS_CACHE_SECONDS', 30))
+
+#----------------------------------------------------------------------------#
+# Change log.
+#----------------------------------------------------------------------------#
+
+# Every create, edit and delete of a venue, artist or show appends an
+# OutboxEntry to the primary in the same commit as the write. Consumers
+# (caches, search indexes, partner syncs) page through it by id with
+# /changes or 'flask changes' and apply entries as upserts and deletes,
+# so they only ever process what changed.
+
+CHANGE_ENTITIES = {Venue: 'venue', Artist: 'artist', Show: 'show'}
+CHANGE_BATCH = 500
+
+def change_payload(row):
+  row = {key: value for key, value in row.items() if key != 'name_key'}
+  return json.dumps(row, sort_keys=True, default=lambda value: value.isoformat())
+
+def record_change(model, action, ids, shard=PRIMARY):
+  # The rows are read back through the session that wrote them, so each
+  # entry holds exactly what is being committed.
+  if not app.config.get('OUTBOX_ENABLED', True):
+    return
+  ids = sorted(set(ids))
+  table = model.__table__
+  now = datetime.now()
+  entries = []
+  for i in range(0, len(ids), CHANGE_BATCH):
+    batch = ids[i:i + CHANGE_BATCH]
+    if action == 'delete':
+      rows = [{'id': id} for id in batch]
+    else:
+      rows = sorted(table_rows(shards.session(shard), table, table.c.id.in_(batch)), key=lambda row: row['id'])
+    entries += [dict(entity=CHANGE_ENTITIES[model], entity_id=row['id'], action=action,
+                     payload=change_payload(row), created_at=now) for row in rows]
+  if entries:
+    db.session.bulk_insert_mappings(OutboxEntry, entries)
+
+def change_json(entry):
+  return {
+    "id": entry.id,
+    "entity": entry.entity,
+    "entity_id": entry.entity_id,
+    "action": entry.action,
+    "recorded_at": entry.created_at.isoformat(),
+    "data": json.loads(entry.payload)
+  }
+
+def outbox_watermark():
+  # the highest id removed after OUTBOX_RETENTION_DAYS
+  return db.session.query(RollupState.last_id).filter(RollupState.name == 'outbox').scalar() or 0
+
+def read_changes(cursor, limit):
+  """Returns (entries, next cursor, reset). `reset` means entries after
+  `cursor` were already dropped: the consumer has to copy the catalogue
+  again and carry on from the cursor returned."""
+  watermark = outbox_watermark()
+  if cursor < watermark:
+    head = db.session.query(db.func.max(OutboxEntry.id)).scalar()
+    return [], max(head or 0, watermark), True
+
+  settled = datetime.now() - timedelta(seconds=app.config.get('OUTBOX_SETTLE_SECONDS', 5))
+  entries = []
+  for entry in db.session.query(OutboxEntry).filter(OutboxEntry.id > cursor).order_by(OutboxEntry.id).limit(limit):
+    # Ids are taken when a row is inserted, not when it commits, so a gap
+    # may be a transaction still in flight. Entries past a gap are held back
+    # until that transaction would have committed, or they could be read
+    # before it and the cursor would move past it for good.
+    if entry.id != cursor + 1 and entry.created_at > settled:
+      break
+    entries.append(entry)
+    cursor = entry.id
+  return entries, cursor, False
+
+def consumer_offset(name):
+  consumer = db.session.query(OutboxConsumer).get(name)
+  return consumer.last_id if consumer is not None else 0
+
+def store_offset(name, cursor):
+  db.session.merge(OutboxConsumer(name=name, last_id=cursor, updated_at=datetime.now()))
+  db.session.commit()
+
+@tasks.task
+def compact_changes(hours=None, days=None):
+  # Entries superseded by a later one of the same record are dropped after
+  # OUTBOX_COMPACT_HOURS: the later one carries the whole row. Everything
+  # goes after OUTBOX_RETENTION_DAYS, and consumers still behind that point
+  # are told to reset by read_changes().
+  hours = app.config.get('OUTBOX_COMPACT_HOURS', 24) if hours is None else hours
+  days = app.config.get('OUTBOX_RETENTION_DAYS', 30) if days is None else days
+  now = datetime.now()
+
+  # the row lock serialises concurrent compactions
+  state = db.session.query(RollupState).filter(RollupState.name == 'outbox').with_for_update().first()
+  if state is None:
+    state = RollupState(name='outbox', last_id=0)
+    db.session.add(state)
+
+  table = OutboxEntry.__table__
+  later = table.alias('later')
+  superseded = db.session.execute(table.delete().where(db.and_(
+    table.c.created_at < now - timedelta(hours=hours),
+    db.exists().where(db.and_(later.c.entity == table.c.entity,
+                              later.c.entity_id == table.c.entity_id,
+                              later.c.id > table.c.id))))).rowcount
+
+  expired = 0
+  last_id = db.session.query(db.func.max(OutboxEntry.id)) \
+    .filter(OutboxEntry.created_at < now - timedelta(days=days)).scalar()
+  if last_id is not None:
+    expired = db.session.query(OutboxEntry).filter(OutboxEntry.id <= last_id).delete(synchronize_session=False)
+    state.last_id = max(state.last_id, last_id)
+  db.session.commit()
+  return {"superseded": superseded, "expired": expired}
+
+def outbox_metrics():
+  head = db.session.query(db.func.max(OutboxEntry.id)).scalar() or 0
+  consumers = {}
+  for consumer in db.session.query(OutboxConsumer).order_by(OutboxConsumer.name):
+    consumers[consumer.name] = {
+      "cursor": consumer.last_id,
+      "behind": db.session.query(db.func.count(OutboxEntry.id)).filter(OutboxEntry.id > consumer.last_id).scalar(),
+      "acked_at": consumer.updated_at.isoformat()
+    }
+  return {"head": head, "watermark": outbox_watermark(), "consumers": consumers}
+
+#----------------------------------------------------------------------------#
+# Readiness.
+#----------------------------------------------------------------------------#
+
+ready = False
+
+def warm_pool():
+  for shard in shards.names:
+    connections = [shards.engine(shard).connect() for i in range(app.config.get('WARM_UP_CONNECTIONS', 1))]
+    for connection in connections:
+      connection.execute(db.text('SELECT 1'))
+      connection.close()
+
+def warm_up():
+  # Pays the first-request costs up front: template compilation, mapper
+  # configuration, opening database connections and priming hot caches.
+  # Run from the gunicorn master with preload_app (see gunicorn.conf.py) the
+  # compiled templates and mappers are shared copy-on-write with workers.
+  global ready
+  started = datetime.now()
+  try:
+    with app.app_context():
+      templates = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+      for name in templates:
+        app.jinja_env.get_template(name)
+      db.configure_mappers()
+      warm_pool()
+      venue_areas()
+      for window in app.config.get('TRENDING_WINDOWS', (7, 30, 90)):
+        trending(window)
+  except Exception:
+    app.logger.exception('Warm-up failed, readiness stays down')
+    return False
+
+  ready = True
+  app.logger.info('Warm-up finished: %d templates in %s', len(templates), datetime.now() - started)
+  return True
+
+#----------------------------------------------------------------------------#
+# Show search.
+#----------------------------------------------------------------------------#
+
+def encode_cursor(start_time, id):
+  return base64.urlsafe_b64encode(f'{start_time.isoformat()}|{id}'.encode()).decode()
+
+def decode_cursor(cursor):
+  start_time, id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+  return datetime.fromisoformat(start_time), int(id)
+
+def parse_day(value, end=False):
+  if not value:
+    return None
+  day = dateutil.parser.parse(value)
+  if end and len(value) <= 10:
+    # a bare date as upper bound includes the whole day
+    day += timedelta(days=1)
+  return day
+
+def search_shows_query(filters, cursor=None, limit=20):
+  # One query over Show joined with its venue and artist. Ordering and the
+  # keyset cursor follow (start_time, id) so each page is an index range scan.
+  # A search within a state or venue reads one shard; any other reads the
+  # first limit + 1 of every shard, in parallel, and merges them.
+  query = db.session.query(Show.id, Show.start_time,
+                           Venue.id, Venue.name, Venue.city, Venue.state,
+                           Artist.id, Artist.name, Artist.image_link) \
+    .join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id)
+
+  if filters.get('from'):
+    query = query.filter(Show.start_time >= filters['from'])
+  if filters.get('to'):
+    query = query.filter(Show.start_time < filters['to'])
+  if filters.get('state'):
+    query = query.filter(Venue.state == filters['state'])
+  if filters.get('city'):
+    query = query.filter(Venue.city == filters['city'])
+  if filters.get('venue_id'):
+    query = query.filter(Show.venue_id == filters['venue_id'])
+  if filters.get('artist_id'):
+    query = query.filter(Show.artist_id == filters['artist_id'])
+  if filters.get('genre'):
+    # not indexed: checked on the rows the other filters leave
+    query = query.filter(db.or_(has_genre(Venue.genres, filters['genre']), has_genre(Artist.genres, filters['genre'])))
+  if cursor:
+    start_time, id = cursor
+    query = query.filter(db.or_(Show.start_time > start_time,
+                                db.and_(Show.start_time == start_time, Show.id > id)))
+
+  query = query.order_by(Show.start_time, Show.id).limit(limit + 1)
+  if filters.get('state'):
+    step = shards.on(shards.for_state(filters['state']), query)
+  elif filters.get('venue_id'):
+    shard = yield from venue_shard(filters['venue_id'])
+    if shard is None:
+      return [], None
+    step = shards.on(shard, query)
+  else:
+    step = shards.everywhere(query, key=lambda row: (row[1], row[0]), owner=Venue.state)
+  rows = yield step
+
+  data = [{
+    "id": show_id,
+    "start_time": start_time.strftime("%Y/%m/%d %H:%M:%S"),
+    "venue_id": venue_id,
+    "venue_name": venue_name,
+    "city": city,
+    "state": state,
+    "artist_id": artist_id,
+    "artist_name": artist_name,
+    "artist_image_link": artist_image_link
+  } for show_id, start_time, venue_id, venue_name, city, state, artist_id, artist_name, artist_image_link in rows[:limit]]
+
+  next_cursor = None
+  if len(rows) > limit:
+    next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0])
+  return data, next_cursor
+
+#----------------------------------------------------------------------------#
+# Live shows.
+#----------------------------------------------------------------------------#
+
+def show_event(show_id, shard=PRIMARY):
+  # what /shows/stream sends for a newly listed show
+  show, venue, artist = shards.session(shard).query(Show, Venue, Artist) \
+    .join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id) \
+    .filter(Show.id == show_id).one()
+  return {
+    "id": show.id,
+    "start_time": show.start_time.isoformat(),
+    "venue_id": venue.id,
+    "venue_name": venue.name,
+    "venue_city": venue.city,
+    "venue_state": venue.state,
+    "artist_id": artist.id,
+    "artist_name": artist.name,
+    "artist_image_link": artist.image_link
+  }
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 @app.route('/')
 def index():
-  return render_template('pages/home.html')
+  windows = app.config.get('TRENDING_WINDOWS', (7, 30, 90))
+  window = request.args.get('window', windows[0], type=int)
+  if window not in windows:
+    window = windows[0]
+  return render_template('pages/home.html', trending=trending(window), windows=windows)
 
 
 #  Venues
 #  ----------------------------------------------------------------
 
+def venues_page():
+  return render_template('pages/venues.html', areas=(yield from load_venue_areas()))
+
 @app.route('/venues')
 def venues():
-  
-  data=[]
+  return run_queries(venues_page())
 
-  venues = db.session.query(Venue)
-
-  for venue in venues:
-      
-    show_venue = db.session.query(Venue.id, Venue.name).filter(Venue.city == venue.city and Venue.state == venue.state)
-      
-    data.append({
-      "city": venue.city,
-      "state": venue.state,
-      "venues": show_venue
-    })
-    
-  return render_template('pages/venues.html', areas=data)
-
-@app.route('/venues/search', methods=['POST'])
-def search_venues():
+def search_venues_page():
   
   response=[]
   data=[]
   
   search_term=request.form.get('search_term', '')
   
-  venues = db.session.query(Venue).filter(Venue.name.ilike('%' + search_term + '%')).all()
+  venues = yield shards.everywhere(db.session.query(Venue.id, Venue.name, Venue.state, Venue.city)
+                                   .filter(Venue.name.ilike('%' + search_term + '%')), owner=Venue.state)
  
 
   for venue in venues:
@@ -161,32 +1615,33 @@ def search_venues():
 
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/venues/<int:venue_id>')
-def show_venue(venue_id):
+@app.route('/venues/search', methods=['POST'])
+def search_venues():
+  return run_queries(search_venues_page())
+
+def show_venue_page(venue_id):
   
   data=[]
-  upcoming_shows=[]
-  past_shows=[]
-  
-  current_time = datetime.now()
-
-  venue = db.session.query(Venue).get(venue_id)
-  shows = db.session.query(Show).filter(Show.venue_id == venue_id)
+  archived_shows=None
 
-  for show in shows:
-    artist = db.session.query(Artist).get(show.artist_id)
+  current_time = datetime.now()
 
-    artist_details = {
-      "artist_id": show.artist.id,
-      "artist_name": show.artist.name,
-      "artist_image_link": artist.image_link,
-      "start_time": show.start_time.strftime("%Y/%m/%d %H:%M:%S")
-    }
-
-    if (show.start_time > current_time):
-      upcoming_shows.append(artist_details)
-    else:
-      past_shows.append(artist_details)
+  shard = yield from venue_shard(venue_id)
+  if shard is None:
+    abort(404)
+  venues = yield shards.on(shard, db.session.query(
+    Venue.id, Venue.name, Venue.genres, Venue.address, Venue.city, Venue.state,
+    Venue.phone, Venue.website_link, Venue.facebook_link, Venue.looking_for_talent,
+    Venue.seeking_description).filter(Venue.id == venue_id))
+  if not venues:
+    abort(404)
+  venue = venues[0]
+
+  # Show only holds recent and upcoming rows; archived history is read on request
+  upcoming_shows = yield from venue_shows(shard, Show, venue_id, Show.start_time > current_time)
+  past_shows = yield from venue_shows(shard, Show, venue_id, Show.start_time <= current_time)
+  if request.args.get('archived'):
+    archived_shows = yield from venue_shows(shard, ShowArchive, venue_id)
 
   data = ({
     "id": venue.id,
@@ -205,10 +1660,46 @@ def show_venue(venue_id):
     "upcoming_shows": upcoming_shows,
     "past_shows_count": len(past_shows),
     "upcoming_shows_count": len(upcoming_shows),
+    "archived_shows": archived_shows,
   })
   
   return render_template('pages/show_venue.html', venue=data)
 
+@app.route('/venues/<int:venue_id>')
+def show_venue(venue_id):
+  return run_queries(show_venue_page(venue_id))
+
+@app.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+  
+  data=[]
+
+  limit = request.args.get('limit', 20, type=int)
+
+  shard = run_queries(venue_shard(venue_id))
+  if shard is None:
+    return jsonify({"venue_id": venue_id, "count": 0, "matches": []})
+
+  matches = shards.session(shard).query(Match, Artist.name, Artist.city, Artist.state) \
+    .join(Artist, Artist.id == Match.artist_id) \
+    .filter(Match.venue_id == venue_id) \
+    .order_by(Match.score.desc(), Match.artist_recent_shows.desc()) \
+    .limit(limit)
+
+  for match, name, city, state in matches:
+    data.append({
+      "artist_id": match.artist_id,
+      "artist_name": name,
+      "city": city,
+      "state": state,
+      "score": match.score,
+      "genre_overlap": match.genre_overlap,
+      "same_city": match.same_city,
+      "recent_shows": match.artist_recent_shows
+    })
+
+  return jsonify({"venue_id": venue_id, "count": len(data), "matches": data})
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -220,11 +1711,18 @@ def create_venue_form():
 @app.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   
+  duplicate = duplicate_warning('forms/new_venue.html', VenueForm(), Venue, 'venue')
+  if duplicate:
+    return duplicate
+
   error = False
 
   try:
+    shards.check_writable(request.form.get('state'))
     new_venue = Venue(
+      id = shards.next_id(Venue),
       name = request.form.get('name'),
+      name_key = name_key(request.form.get('name')),
       city = request.form.get('city'),
       state = request.form.get('state'),
       address = request.form.get('address'),
@@ -233,57 +1731,76 @@ def create_venue_submission():
       facebook_link = request.form.get('facebook_link'),
       genres = request.form.get('genres'),
       website_link = request.form.get('website_link'),
-      looking_for_talent = request.form.get('looking_for_talent'),
+      looking_for_talent = form_value('looking_for_talent'),
       seeking_description = request.form.get('seeking_description')
     )
 
-    db.session.add(new_venue)
-    db.session.commit()
-  # on successful db insert, flash success
-    flash('Venue ' + request.form['name'] + ' was successfully listed!')
-  
+    shard = shards.for_state(new_venue.state)
+    session = shards.session(shard)
+    session.add(new_venue)
+    session.flush()
+    place_venue(new_venue.id, new_venue.state)
+    record_change(Venue, 'create', [new_venue.id], shard)
+    mark_stale(stale_pages_for(Venue, [new_venue.id], related=False))
+    record_stats(stats_for_create(Venue, new_venue))
+    shards.commit()
+    venue_id = new_venue.id
   
   except:
     error = True
-    db.session.rollback()
+    shards.rollback()
     flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
-    print(sys.exc_info())
+    app.logger.exception('Creating venue failed')
   
   finally:
-    db.session.close()
+    shards.close()
+
+  if not error:
+    # on successful db insert, flash success
+    flash('Venue ' + request.form['name'] + ' was successfully listed!')
+    run_follow_ups('creating venue %s' % venue_id,
+                   lambda: cache.invalidate('venue_areas'),
+                   lambda: tasks.enqueue(refresh_matches, venue_id=venue_id),
+                   lambda: tasks.enqueue(fold_stats))
   
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>/delete', methods=['GET']) 
+@app.route('/venues/<int:venue_id>/delete', methods=['GET']) 
 def delete_venue(venue_id):
 
   error = False
 
   try:
-    #Note to self: recheck this
-    venue = db.session.query(Venue).get(venue_id)
-    db.session.delete(venue)
-    db.session.commit()
-    flash('Venue ' + ' ' + ' was successfully deleted!')
+    counts = bulk_delete(Venue, [venue_id])
+    shards.commit()
+    tasks.enqueue(fold_stats)
+    if counts['deleted']:
+      flash(f"Venue was successfully deleted along with {counts['shows']} shows!")
+    else:
+      flash('Venue ' + str(venue_id) + ' does not exist.')
   
   except:
     error = True
-    db.session.rollback()
-    flash('Venue ' + venue['name'] + ' could not be deleted!')
+    shards.rollback()
+    flash('Venue ' + str(venue_id) + ' could not be deleted!')
+    app.logger.exception('Deleting venue %s failed', venue_id)
   
   finally:
-    db.session.close()
+    shards.close()
 
   return redirect(url_for('index'))
 
+@app.route('/venues/delete', methods=['POST'])
+def bulk_delete_venues():
+  return bulk_delete_response(Venue)
+
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
-def artists():
+def artists_page():
   
   data=[]
 
-  artists = db.session.query(Artist.id, Artist.name).all()
+  artists = yield db.session.query(Artist.id, Artist.name)
 
   for artist in artists:
     data.append({
@@ -293,15 +1810,19 @@ def artists():
 
   return render_template('pages/artists.html', artists=data)
 
-@app.route('/artists/search', methods=['POST'])
-def search_artists():
+@app.route('/artists')
+def artists():
+  return run_queries(artists_page())
+
+def search_artists_page():
   
   response=[]
   data=[]
   
   search_term=request.form.get('search_term', '')
   
-  artists = db.session.query(Artist).filter(Artist.name.ilike('%' + search_term + '%')).all()
+  artists = yield db.session.query(Artist.id, Artist.name, Artist.state, Artist.city) \
+    .filter(Artist.name.ilike('%' + search_term + '%'))
 
   for artist in artists:
     data.append ({
@@ -327,34 +1848,28 @@ def search_artists():
   #}
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/artists/<int:artist_id>')
-def show_artist(artist_id):
+@app.route('/artists/search', methods=['POST'])
+def search_artists():
+  return run_queries(search_artists_page())
+
+def show_artist_page(artist_id):
   
   data=[]
-  upcoming_shows=[]
-  past_shows=[]
+  archived_shows=None
 
   current_time = datetime.now()
   
-  artist = db.session.query(Artist).get(artist_id)
-  shows = db.session.query(Show).filter(Show.artist_id == artist_id)
-
-  for show in shows:
-    venue = db.session.query(Venue).get(show.venue_id)
-
-    venue_details = {
-      "venue_id": show.venue.id,
-      "venue_name": show.venue.name,
-      "venue_image_link": venue.image_link,
-      "start_time": show.start_time.strftime("%Y/%m/%d %H:%M:%S")
-    }  
-    #Referenced link below for date formating
-    #https://stackoverflow.com/questions/63269150/typeerror-parser-must-be-a-string-or-character-stream-not-datetime
-
-    if (show.start_time > current_time):
-      upcoming_shows.append(venue_details)
-    else:
-      past_shows.append(venue_details)
+  artists = yield db.session.query(Artist.id, Artist.name, Artist.genres, Artist.city, Artist.state, Artist.phone,
+                                   Artist.website_link, Artist.facebook_link, Artist.looking_for_venues,
+                                   Artist.seeking_description, Artist.image_link).filter(Artist.id == artist_id)
+  if not artists:
+    abort(404)
+  artist = artists[0]
+
+  upcoming_shows = yield from artist_shows(Show, artist_id, Show.start_time > current_time)
+  past_shows = yield from artist_shows(Show, artist_id, Show.start_time <= current_time)
+  if request.args.get('archived'):
+    archived_shows = yield from artist_shows(ShowArchive, artist_id)
 
   data = ({
     "id": artist.id,
@@ -372,10 +1887,51 @@ def show_artist(artist_id):
     "upcoming_shows": upcoming_shows,
     "past_shows_count": len(past_shows),
     "upcoming_shows_count": len(upcoming_shows),
+    "archived_shows": archived_shows,
   })
   
   return render_template('pages/show_artist.html', artist=data)
 
+@app.route('/artists/<int:artist_id>')
+def show_artist(artist_id):
+  return run_queries(show_artist_page(artist_id))
+
+@app.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+  
+  data=[]
+
+  limit = request.args.get('limit', 20, type=int)
+
+  # an artist is matched with venues in their own state, so on that shard
+  shard = PRIMARY
+  if shards.enabled:
+    shard = shards.for_state(db.session.query(Artist.state).filter(Artist.id == artist_id).scalar())
+
+  matches = shards.session(shard).query(Match, Venue.name, Venue.city, Venue.state) \
+    .join(Venue, Venue.id == Match.venue_id) \
+    .filter(Match.artist_id == artist_id) \
+    .order_by(Match.score.desc(), Match.venue_recent_shows.desc()) \
+    .limit(limit)
+
+  for match, name, city, state in matches:
+    data.append({
+      "venue_id": match.venue_id,
+      "venue_name": name,
+      "city": city,
+      "state": state,
+      "score": match.score,
+      "genre_overlap": match.genre_overlap,
+      "same_city": match.same_city,
+      "recent_shows": match.venue_recent_shows
+    })
+
+  return jsonify({"artist_id": artist_id, "count": len(data), "matches": data})
+
+@app.route('/artists/delete', methods=['POST'])
+def bulk_delete_artists():
+  return bulk_delete_response(Artist)
+
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
@@ -404,38 +1960,38 @@ def edit_artist(artist_id):
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   
-  artist = db.session.query(Artist)
-
-  error = False
+  artist = db.session.query(Artist).get(artist_id)
+  if artist is None:
+    abort(404)
+  version = submitted_version()
 
   try:
-    artist = db.session.query(Artist).get(artist_id)
-
-    artist.name = request.form.get('name'),
-    artist.city = request.form.get('city'),
-    artist.state = request.form.get('state'),
-    artist.phone = request.form.get('phone'),
-    artist.genres = request.form.get('genres'),
-    artist.image_link = request.form.get('image_link'),
-    artist.facebook_link = request.form.get('facebook_link'),
-    artist.website_link = request.form.get('website_link'),
-    artist.looking_for_venues = request.form.get('looking_for_venues'),
-    artist.seeking_description = request.form.get('seeking_description')
-
-    db.session.add(artist)
-    db.session.commit()
+    changes = changed_fields(artist, ARTIST_FIELDS)
+    if 'name' in changes:
+      changes['name_key'] = name_key(changes['name'])
+    if changes and not update_versioned(Artist, artist_id, version, changes):
+      shards.rollback()
+      return edit_conflict('forms/edit_artist.html', ArtistForm(), 'artist', Artist, artist_id)
+
+    if changes:
+      replicate_artists([artist_id])
+      record_change(Artist, 'update', [artist_id])
+      mark_stale(stale_pages_for(Artist, [artist_id]))
+      record_stats(stats_for_edit(Artist, artist, changes))
+    shards.commit()
   # on successful db insert, flash success
     flash('Artist ' + request.form['name'] + ' was successfully updated!')
-  
+    if changes:
+      tasks.enqueue(refresh_matches, artist_id=artist_id)
+      tasks.enqueue(fold_stats)
   
   except:
-    error = True
-    db.session.rollback()
+    shards.rollback()
     flash('An error occurred. Artist ' + request.form['name'] + ' could not be updated.')
-    print(sys.exc_info())
+    app.logger.exception('Updating artist %s failed', artist_id)
   
   finally:
-    db.session.close()
+    shards.close()
 
   return redirect(url_for('show_artist', artist_id=artist_id))
 
@@ -443,7 +1999,8 @@ def edit_artist_submission(artist_id):
 def edit_venue(venue_id):
   form = VenueForm()
 
-  venue = db.session.query(Venue).get(venue_id)
+  shard = run_queries(venue_shard(venue_id))
+  venue = shards.session(shard).query(Venue).get(venue_id) if shard else None
 
   #venue={
   #  "id": venue.id,
@@ -466,39 +2023,55 @@ def edit_venue(venue_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   
-  venue = db.session.query(Venue)
-
-  error = False
+  shard = run_queries(venue_shard(venue_id))
+  venue = shards.session(shard).query(Venue).get(venue_id) if shard else None
+  if venue is None:
+    abort(404)
+  version = submitted_version()
 
   try:
-    venue = db.session.query(Venue).get(venue_id)
-
-    venue.name = request.form.get('name'),
-    venue.city = request.form.get('city'),
-    venue.state = request.form.get('state'),
-    venue.address = request.form.get('address'),
-    venue.phone = request.form.get('phone'),
-    venue.image_link = request.form.get('image_link'),
-    venue.facebook_link = request.form.get('facebook_link'),
-    venue.genres = request.form.get('genres'),
-    venue.website_link = request.form.get('website_link'),
-    venue.looking_for_talent = request.form.get('looking_for_talent'),
-    venue.seeking_description = request.form.get('seeking_description')
-
-    db.session.add(venue)
-    db.session.commit()
+    shards.check_writable(venue.state)
+    changes = changed_fields(venue, VENUE_FIELDS)
+    if 'name' in changes:
+      changes['name_key'] = name_key(changes['name'])
+    if changes and not update_versioned(Venue, venue_id, version, changes, shard):
+      shards.rollback()
+      return edit_conflict('forms/edit_venue.html', VenueForm(), 'venue', Venue, venue_id, shard)
+
+    if changes:
+      mark_stale(stale_pages_for(Venue, [venue_id]))
+      record_stats(stats_for_edit(Venue, venue, changes, shard))
+    if 'city' in changes or 'state' in changes:
+      # the venue's shows count for its new city
+      shows = [row for show in (Show, ShowArchive)
+               for row in trending_shows(show, show.venue_id == venue_id, shard=shard)]
+      adjust_trending([row[:4] + (venue.city, venue.state) for row in shows], -1)
+      adjust_trending([row[:4] + (changes.get('city', venue.city), changes.get('state', venue.state))
+                       for row in shows], 1)
+    if 'state' in changes:
+      # a venue moving to a state kept on another shard goes with its shows
+      shards.check_writable(changes['state'])
+      place_venue(venue_id, changes['state'])
+      if shards.for_state(changes['state']) != shard:
+        move_venues([venue_id], shard, shards.for_state(changes['state']))
+        shard = shards.for_state(changes['state'])
+    if changes:
+      record_change(Venue, 'update', [venue_id], shard)
+    shards.commit()
   # on successful db insert, flash success
     flash('Venue ' + request.form['name'] + ' was successfully updated!')
-  
+    if changes:
+      cache.invalidate('venue_areas')
+      tasks.enqueue(refresh_matches, venue_id=venue_id)
+      tasks.enqueue(fold_stats)
   
   except:
-    error = True
-    db.session.rollback()
+    shards.rollback()
     flash('An error occurred. Venue ' + request.form['name'] + ' could not be updated.')
-    print(sys.exc_info())
+    app.logger.exception('Updating venue %s failed', venue_id)
   
   finally:
-    db.session.close()
+    shards.close()
   return redirect(url_for('show_venue', venue_id=venue_id))
 
 #  Create Artist
@@ -512,11 +2085,16 @@ def create_artist_form():
 @app.route('/artists/create', methods=['POST'])
 def create_artist_submission():
 
+  duplicate = duplicate_warning('forms/new_artist.html', ArtistForm(), Artist, 'artist')
+  if duplicate:
+    return duplicate
+
   error = False
 
   try:
     new_artist = Artist(
       name = request.form.get('name'),
+      name_key = name_key(request.form.get('name')),
       city = request.form.get('city'),
       state = request.form.get('state'),
       phone = request.form.get('phone'),
@@ -524,23 +2102,34 @@ def create_artist_submission():
       image_link = request.form.get('image_link'),
       facebook_link = request.form.get('facebook_link'),
       website_link = request.form.get('website_link'),
-      looking_for_venues = request.form.get('looking_for_venues'),
+      looking_for_venues = form_value('looking_for_venues'),
       seeking_description = request.form.get('seeking_description')
     )
 
     db.session.add(new_artist)
-    db.session.commit()
-  # on successful db insert, flash success
-    flash('Artist ' + request.form['name'] + ' was successfully listed!')
+    db.session.flush()
+    replicate_artists([new_artist.id])
+    record_change(Artist, 'create', [new_artist.id])
+    mark_stale(stale_pages_for(Artist, [new_artist.id], related=False))
+    record_stats(stats_for_create(Artist, new_artist))
+    shards.commit()
+    artist_id = new_artist.id
   
   except:
     error = True
-    db.session.rollback()
+    shards.rollback()
     flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
-    print(sys.exc_info())
+    app.logger.exception('Creating artist failed')
   
   finally:
-    db.session.close()
+    shards.close()
+
+  if not error:
+    # on successful db insert, flash success
+    flash('Artist ' + request.form['name'] + ' was successfully listed!')
+    run_follow_ups('creating artist %s' % artist_id,
+                   lambda: tasks.enqueue(refresh_matches, artist_id=artist_id),
+                   lambda: tasks.enqueue(fold_stats))
 
   return render_template('pages/home.html')
 
@@ -548,24 +2137,132 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
-def shows():
+def shows_page():
   
   data=[]
   
-  shows = db.session.query(Show)
-
-  for show in shows:
+  # one join instead of loading each show's venue and artist separately
+  shows = yield shards.everywhere(
+    db.session.query(Show.id, Show.venue_id, Venue.name, Show.artist_id, Artist.name, Artist.image_link, Show.start_time)
+    .join(Venue, Venue.id == Show.venue_id)
+    .join(Artist, Artist.id == Show.artist_id), owner=Venue.state)
+
+  last_id = 0
+  for show_id, venue_id, venue_name, artist_id, artist_name, artist_image_link, start_time in shows:
+    last_id = max(last_id, show_id)
     data.append ({
-    "venue_id": show.venue_id,
-    "venue_name": show.venue.name,
-    "artist_id": show.artist_id,
-    "artist_name": show.artist.name,
-    "artist_image_link": show.artist.image_link,
-    "start_time": str(show.start_time)
+    "venue_id": venue_id,
+    "venue_name": venue_name,
+    "artist_id": artist_id,
+    "artist_name": artist_name,
+    "artist_image_link": artist_image_link,
+    "start_time": str(start_time)
     })
 
-  return render_template('pages/shows.html', shows=data)
+  # where the page polls for newer shows when it cannot stream them
+  return render_template('pages/shows.html', shows=data, last_id=last_id,
+                         poll_seconds=app.config.get('EVENTS_POLL_SECONDS', 30))
+
+@app.route('/shows')
+def shows():
+  return run_queries(shows_page())
+
+def stream_filters():
+  filters = {}
+  if request.args.get('city'):
+    filters['venue_city'] = request.args.get('city')
+  for key in ('venue_id', 'artist_id'):
+    if request.args.get(key, type=int) is not None:
+      filters[key] = request.args.get(key, type=int)
+  return filters
+
+@app.route('/shows/stream')
+def shows_stream():
+  # Server-Sent Events of newly listed shows, optionally only those in a
+  # city or for one venue or artist. Holds a worker thread per listener, so
+  # past the listener cap clients are sent to poll /shows/latest instead.
+  subscription = events.subscribe('show', **stream_filters())
+  if subscription is None:
+    poll_seconds = app.config.get('EVENTS_POLL_SECONDS', 30)
+    response = jsonify({"error": "too many listeners, poll instead",
+                        "poll": url_for('latest_shows', **request.args),
+                        "poll_seconds": poll_seconds})
+    response.headers['Retry-After'] = str(poll_seconds)
+    return response, 503
+  return Response(events.stream(subscription), mimetype='text/event-stream',
+                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def latest_shows_page():
+  # The polling counterpart of /shows/stream: shows listed after the id in
+  # ?after=, oldest first, in the same format as the stream's events.
+  after = request.args.get('after', 0, type=int)
+  limit = min(request.args.get('limit', 50, type=int), 200)
+  query = db.session.query(Show.id, Show.start_time, Venue.id, Venue.name, Venue.city, Venue.state,
+                           Artist.id, Artist.name, Artist.image_link) \
+    .join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id) \
+    .filter(Show.id > after)
+  filters = stream_filters()
+  if 'venue_city' in filters:
+    query = query.filter(db.func.lower(Venue.city) == filters['venue_city'].lower())
+  if 'venue_id' in filters:
+    query = query.filter(Show.venue_id == filters['venue_id'])
+  if 'artist_id' in filters:
+    query = query.filter(Show.artist_id == filters['artist_id'])
+  rows = yield shards.everywhere(query.order_by(Show.id).limit(limit), key=lambda row: row[0], owner=Venue.state)
+
+  data = [{
+    "id": show_id,
+    "start_time": start_time.isoformat(),
+    "venue_id": venue_id,
+    "venue_name": venue_name,
+    "venue_city": venue_city,
+    "venue_state": venue_state,
+    "artist_id": artist_id,
+    "artist_name": artist_name,
+    "artist_image_link": artist_image_link
+  } for show_id, start_time, venue_id, venue_name, venue_city, venue_state, artist_id, artist_name, artist_image_link in rows[:limit]]
+  last_id = data[-1]["id"] if data else after
+  return jsonify({"data": data, "last_id": last_id, "poll_seconds": app.config.get('EVENTS_POLL_SECONDS', 30)})
+
+@app.route('/shows/latest')
+def latest_shows():
+  return run_queries(latest_shows_page())
+
+def search_shows_page():
+
+  args = request.args
+  limit = min(max(args.get('limit', 20, type=int), 1), 100)
+
+  try:
+    filters = {
+      "from": parse_day(args.get('from')) or (None if args.get('to') else datetime.now()),
+      "to": parse_day(args.get('to'), end=True),
+      "city": args.get('city'),
+      "state": args.get('state'),
+      "venue_id": args.get('venue_id', type=int),
+      "artist_id": args.get('artist_id', type=int),
+      "genre": args.get('genre')
+    }
+    cursor = decode_cursor(args['cursor']) if args.get('cursor') else None
+  except (ValueError, OverflowError):
+    abort(400)
+
+  shows, next_cursor = yield from search_shows_query(filters, cursor, limit)
+
+  if args.get('format') == 'json':
+    return jsonify({"count": len(shows), "data": shows, "next_cursor": next_cursor})
+
+  next_url = None
+  if next_cursor:
+    next_url = url_for('search_shows', **dict(args.items(), cursor=next_cursor))
+  return render_template('pages/search_shows.html', shows=shows, next_url=next_url,
+                         search=args, genres=[choice for choice, label in VenueForm.genres.kwargs['choices']],
+                         states=[choice for choice, label in VenueForm.state.kwargs['choices']])
+
+@app.route('/shows/search')
+def search_shows():
+  return run_queries(search_shows_page())
 
 @app.route('/shows/create')
 def create_shows():
@@ -579,28 +2276,153 @@ def create_show_submission():
   error = False
 
   try:
+    # a show is kept with its venue
+    shard = run_queries(venue_shard(request.form.get('venue_id', type=int), write=True))
+    if shard is None:
+      raise LookupError('no such venue')
     new_show = Show(
+      id = shards.next_id(Show),
       artist_id = request.form.get('artist_id'),
       venue_id = request.form.get('venue_id'),
-      start_time = request.form.get('start_time')
+      # the form posts text; SQLite's DateTime only takes a datetime
+      start_time = dateutil.parser.parse(request.form.get('start_time'))
     )
 
-    db.session.add(new_show)
-    db.session.commit()
-    # on successful db insert, flash success
-    flash('Show was successfully listed!')
+    session = shards.session(shard)
+    session.add(new_show)
+    session.flush()
+    record_change(Show, 'create', [new_show.id], shard)
+    record_stats(stats_for_create(Show, new_show, shard))
+    mark_stale({'/shows', f'/venues/{new_show.venue_id}', f'/artists/{new_show.artist_id}'})
+    shards.commit()
+    show = dict(id=new_show.id, artist_id=new_show.artist_id, venue_id=new_show.venue_id)
   
   except:
     error = True
-    db.session.rollback()
+    shards.rollback()
     flash('An error occurred. Show could not be listed.')
-    print(sys.exc_info())
+    app.logger.exception('Creating a show failed')
   
   finally:
-    db.session.close()
+    shards.close()
+
+  if not error:
+    # on successful db insert, flash success
+    flash('Show was successfully listed!')
+    run_follow_ups('creating show %s' % show['id'],
+                   lambda: tasks.enqueue(refresh_matches, artist_id=show['artist_id'], venue_id=show['venue_id']),
+                   lambda: tasks.enqueue(update_trending),
+                   lambda: tasks.enqueue(fold_stats),
+                   lambda: events.publish('show', show_event(show['id'], shard), id=show['id']))
   
   return render_template('pages/home.html')
 
+#  Stats
+#  ----------------------------------------------------------------
+
+@app.route('/stats')
+def stats():
+  return render_template('pages/stats.html', stats=catalogue_stats())
+
+@app.route('/stats.json')
+def stats_json():
+  return jsonify(catalogue_stats())
+
+#  Changes
+#  ----------------------------------------------------------------
+
+def changes_allowed():
+  # with CHANGES_TOKEN set, consumers send 'Authorization: Bearer <token>'
+  token = app.config.get('CHANGES_TOKEN')
+  if not token:
+    return True
+  value = request.headers.get('Authorization', '')
+  return hmac.compare_digest(value.encode(), f'Bearer {token}'.encode())
+
+@app.route('/changes')
+def list_changes():
+  # ?consumer=NAME reads on from that consumer's acknowledged offset,
+  # ?cursor=ID from any point
+  if not app.config.get('OUTBOX_ENABLED', True):
+    return jsonify({"error": "the change log is disabled"}), 404
+  if not changes_allowed():
+    return jsonify({"error": "unauthorized"}), 401
+  consumer = request.args.get('consumer')
+  cursor = request.args.get('cursor', type=int)
+  if cursor is None:
+    cursor = consumer_offset(consumer) if consumer else 0
+  limit = request.args.get('limit', app.config.get('OUTBOX_PAGE_SIZE', 100), type=int)
+  limit = max(1, min(limit, app.config.get('OUTBOX_PAGE_MAX', 1000)))
+
+  entries, next_cursor, reset = read_changes(cursor, limit)
+  return jsonify({
+    "changes": [change_json(entry) for entry in entries],
+    "next_cursor": next_cursor,
+    "reset": reset
+  })
+
+@app.route('/changes/<consumer>/ack', methods=['POST'])
+def ack_changes(consumer):
+  # consumers acknowledge a next_cursor once they have applied the changes
+  # before it, so a consumer that crashes reads them again
+  if not app.config.get('OUTBOX_ENABLED', True):
+    return jsonify({"error": "the change log is disabled"}), 404
+  if not changes_allowed():
+    return jsonify({"error": "unauthorized"}), 401
+  cursor = request.form.get('cursor', request.args.get('cursor'), type=int)
+  if cursor is None or cursor < 0 or len(consumer) > 50:
+    return jsonify({"error": "cursor must be a non-negative integer"}), 400
+  try:
+    store_offset(consumer, cursor)
+  except:
+    db.session.rollback()
+    app.logger.exception('Storing the offset of %s failed', consumer)
+    return jsonify({"error": "could not store the offset"}), 500
+  finally:
+    db.session.close()
+  return jsonify({"consumer": consumer, "cursor": cursor})
+
+#  Health
+#  ----------------------------------------------------------------
+
+@app.route('/healthz')
+def healthz():
+  return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+  # a worker that failed to warm up retries on the next probe
+  if not ready and not warm_up():
+    return jsonify({"status": "warming up"}), 503
+  return jsonify({"status": "ready"})
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+@app.route('/metrics')
+def metrics():
+  return jsonify({
+    "tasks": tasks.metrics(),
+    "logging": request_logging.metrics(),
+    "events": events.metrics(),
+    "admission": admission.metrics(),
+    "shards": shards.metrics(),
+    "outbox": outbox_metrics()
+  })
+
+# endpoints that asgi.py serves as coroutines, with the generator behind each
+ASYNC_PAGES = {
+  'venues': venues_page,
+  'search_venues': search_venues_page,
+  'show_venue': show_venue_page,
+  'artists': artists_page,
+  'search_artists': search_artists_page,
+  'show_artist': show_artist_page,
+  'shows': shows_page,
+  'search_shows': search_shows_page,
+  'latest_shows': latest_shows_page,
+}
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -610,15 +2432,337 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('rebuild-matches')
+def rebuild_matches_command():
+  """Recompute every artist/venue match, one state at a time."""
+  for shard in shards.names:
+    shards.session(shard).query(Match).delete(synchronize_session=False)
+  shards.commit()
+
+  states = sorted({state for (state,) in shards.select(db.session.query(Venue.state).distinct())}, key=str)
+  total = 0
+  for state in states:
+    total += rebuild_state_matches(state)
+    shards.commit()
+
+  click.echo(f'{total} matches across {len(states)} states')
+
+@app.cli.command('run-jobs')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty.')
+@click.option('--interval', default=1.0, help='Seconds to wait when the queue is empty.')
+def run_jobs_command(burst, interval):
+  """Work the durable job queue (TASK_BACKEND = 'database')."""
+  if tasks.backend.name != 'database':
+    raise click.UsageError("run-jobs needs TASK_BACKEND = 'database'")
+  tasks.backend.work(poll_interval=interval, burst=burst)
+
+@app.cli.command('archive-shows')
+@click.option('--days', type=int, default=None, help='Archive shows older than this (default ARCHIVE_AFTER_DAYS).')
+def archive_shows_command(days):
+  """Move long-finished shows into ShowArchive. Meant to run from cron."""
+  click.echo(f'{archive_shows(days)} shows archived')
+
+@app.cli.command('delete-venues')
+@click.argument('ids', nargs=-1, type=int, required=True)
+def delete_venues_command(ids):
+  """Delete venues and everything that references them in one transaction."""
+  counts = bulk_delete(Venue, ids)
+  shards.commit()
+  fold_stats()
+  click.echo(', '.join(f'{key}: {value}' for key, value in counts.items()))
+
+@app.cli.command('delete-artists')
+@click.argument('ids', nargs=-1, type=int, required=True)
+def delete_artists_command(ids):
+  """Delete artists and everything that references them in one transaction."""
+  counts = bulk_delete(Artist, ids)
+  shards.commit()
+  fold_stats()
+  click.echo(', '.join(f'{key}: {value}' for key, value in counts.items()))
+
+def merge_command(model, duplicate_id, canonical_id):
+  try:
+    counts = merge_records(model, duplicate_id, canonical_id)
+    shards.commit()
+  except (ValueError, LookupError, ShardMoving) as e:
+    shards.rollback()
+    raise click.ClickException(str(e))
+  if model is Venue:
+    cache.invalidate('venue_areas')
+    refresh_matches(venue_id=canonical_id)
+  else:
+    refresh_matches(artist_id=canonical_id)
+  fold_stats()
+  click.echo(', '.join(f'{key} moved: {value}' for key, value in counts.items()))
+
+@app.cli.command('merge-venues')
+@click.argument('duplicate_id', type=int)
+@click.argument('canonical_id', type=int)
+def merge_venues_command(duplicate_id, canonical_id):
+  """Move a duplicate venue's shows to the canonical venue and delete it."""
+  merge_command(Venue, duplicate_id, canonical_id)
+
+@app.cli.command('merge-artists')
+@click.argument('duplicate_id', type=int)
+@click.argument('canonical_id', type=int)
+def merge_artists_command(duplicate_id, canonical_id):
+  """Move a duplicate artist's shows to the canonical artist and delete it."""
+  merge_command(Artist, duplicate_id, canonical_id)
+
+@app.cli.command('find-duplicates')
+@click.argument('kind', type=click.Choice(['venues', 'artists']))
+def find_duplicates_command(kind):
+  """List likely duplicates, comparing records within each city only."""
+  model = Venue if kind == 'venues' else Artist
+
+  # venues are compared on each shard, where a city's venues all are
+  missing, found = 0, 0
+  for shard in (shards.names if model is Venue else [PRIMARY]):
+    session = shards.session(shard)
+
+    # records saved before name_key existed, or imported without it
+    rows = session.query(model.id, model.name).filter(model.name_key.is_(None)).all()
+    for id, name in rows:
+      session.query(model).filter(model.id == id).update({'name_key': name_key(name)}, synchronize_session=False)
+    session.commit()
+    missing += len(rows)
+
+    for state, city in session.query(model.state, model.city).distinct().order_by(model.state, model.city):
+      if model is Venue and shards.for_state(state) != shard:
+        continue
+      records = session.query(model.id, model.name, model.name_key) \
+        .filter(model.state == state, model.city == city).order_by(model.id).all()
+      for i, (id, name, key) in enumerate(records):
+        for other_id, other_name, other_key in records[i + 1:]:
+          score = 1.0 if key == other_key else name_similarity(key, other_key)
+          if score >= app.config.get('DUPLICATE_SIMILARITY', 0.6):
+            found += 1
+            click.echo(f'{city}, {state}: {other_id} "{other_name}" ~ {id} "{name}" ({score:.2f})  '
+                       f'flask merge-{kind} {other_id} {id}')
+  click.echo(f'{found} likely duplicates, {missing} name keys filled in')
+
+@app.cli.command('prerender')
+@click.option('--out', default=None, help='Output directory (default PRERENDER_DIR).')
+@click.option('--full', is_flag=True, help='Render every page, not only the stale ones.')
+@click.option('--workers', default=None, type=int, help='Render processes (default: CPU count).')
+def prerender_command(out, full, workers):
+  """Write static copies of the venue, artist and show pages."""
+  import prerender
+  out = out or os.path.join(app.root_path, app.config.get('PRERENDER_DIR', 'build'))
+  result = prerender.build(out, full=full, workers=workers)
+  click.echo(f"{result['rendered']} pages rendered, {result['removed']} removed, "
+             f"{result['failed']} failed in {result['seconds']:.1f}s")
+
+@app.cli.command('profile-report')
+@click.option('--endpoint', default=None, help='Only report this endpoint.')
+@click.option('--top', default=20, help='Functions to list per endpoint.')
+@click.option('--sort', default='cumulative', help='pstats sort key (cumulative, tottime, calls).')
+def profile_report_command(endpoint, top, sort):
+  """Summarise request profiles captured under PROFILE_DIR, per route."""
+  click.echo(profiler.report(endpoint=endpoint, top=top, sort=sort))
+
+@app.cli.command('seed')
+@click.option('--venues', default=200, help='Venues to create.')
+@click.option('--artists', default=500, help='Artists to create.')
+@click.option('--shows', default=5000, help='Shows to create.')
+@click.option('--create-tables', is_flag=True, help='Create missing tables first (scratch databases).')
+@click.option('--random-seed', default=1, help='Seed for reproducible data.')
+def seed_command(venues, artists, shows, create_tables, random_seed):
+  """Fill the database with generated venues, artists and shows."""
+  rng = random.Random(random_seed)
+  if create_tables:
+    db.create_all()
+    for shard in shards.names[1:]:
+      db.Model.metadata.create_all(shards.engine(shard), tables=[model.__table__ for model in SHARDED_MODELS])
+
+  cities = [('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('New York', 'NY'), ('Brooklyn', 'NY'),
+            ('Austin', 'TX'), ('Houston', 'TX'), ('Chicago', 'IL'), ('Seattle', 'WA'), ('Denver', 'CO')]
+  genres = [choice for choice, label in VenueForm.genres.kwargs['choices']]
+  words = ['Blue', 'Velvet', 'Hop', 'Room', 'Square', 'Lounge', 'Cellar', 'Petals', 'Guns', 'Wild', 'Sax', 'Band']
+
+  def listing(kind):
+    city, state = rng.choice(cities)
+    name = ' '.join(rng.sample(words, 2)) + f' {kind} {rng.randint(1, 99999)}'
+    return dict(
+      name=name,
+      name_key=name_key(name),
+      city=city,
+      state=state,
+      phone='326-123-5000',
+      genres=','.join(rng.sample(genres, rng.randint(1, 3))),
+      image_link='https://images.unsplash.com/photo-1543900694-133f37abaaa5',
+      facebook_link='https://www.facebook.com/fyyur',
+      seeking_description='Looking for a great match',
+      version=1
     )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+
+  # Sharded venues and shows need ids that are unique across shards, so
+  # they are reserved up front. Otherwise the database numbers them, on from
+  # the current maximum.
+  first_venue = (db.session.query(db.func.max(Venue.id)).scalar() or 0) + 1
+  first_artist = (db.session.query(db.func.max(Artist.id)).scalar() or 0) + 1
+  first_show = (db.session.query(db.func.max(Show.id)).scalar() or 0) + 1
+  if shards.enabled:
+    first_venue = shards.reserve(Venue, venues)[0]
+    first_show = shards.reserve(Show, shows)[0]
+  venue_rows = [dict(listing('Venue'), address='1015 Folsom Street',
+                     looking_for_talent=rng.choice(['y', None])) for i in range(venues)]
+  artist_rows = [dict(listing('Artist'), looking_for_venues=rng.choice(['y', None])) for i in range(artists)]
+
+  placed = {}
+  for i, row in enumerate(venue_rows):
+    if shards.enabled:
+      row['id'] = first_venue + i
+    placed.setdefault(shards.for_state(row['state']), dict(venues=[], shows=[]))['venues'].append(row)
+  now = datetime.now()
+  for i in range(shows if venues and artists else 0):
+    venue = rng.randrange(venues)
+    placed[shards.for_state(venue_rows[venue]['state'])]['shows'].append(dict(
+      id=first_show + i if shards.enabled else None,
+      venue_id=first_venue + venue,
+      artist_id=rng.randrange(first_artist, first_artist + artists),
+      start_time=now + timedelta(days=rng.randint(-400, 180), hours=rng.randint(0, 23))
+    ))
+  db.session.bulk_insert_mappings(Artist, artist_rows)
+  replicate_artists(range(first_artist, first_artist + artists))
+  for shard, rows in placed.items():
+    shards.session(shard).bulk_insert_mappings(Venue, rows['venues'])
+    shards.session(shard).bulk_insert_mappings(Show, rows['shows'])
+  if shards.enabled:
+    db.session.bulk_insert_mappings(VenueShard, [dict(venue_id=row['id'], state=row['state']) for row in venue_rows])
+  record_change(Artist, 'create', range(first_artist, first_artist + artists))
+  for shard in placed:
+    record_change(Venue, 'create', range(first_venue, first_venue + venues), shard)
+    record_change(Show, 'create', range(first_show, first_show + shows), shard)
+  shards.commit()
+  click.echo(f'{venues} venues, {artists} artists, {shows} shows')
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+  """Recount the catalogue statistics from the venue, artist and show tables."""
+  click.echo(f'{rebuild_stats()} stat rows rebuilt')
+
+@app.cli.command('changes')
+@click.argument('consumer')
+@click.option('--limit', default=1000, help='Most changes to print.')
+@click.option('--cursor', type=int, default=None, help="Read on from this cursor instead of the consumer's offset.")
+@click.option('--peek', is_flag=True, help='Leave the consumer offset where it is.')
+def changes_command(consumer, limit, cursor, peek):
+  """Print the changes a consumer has not seen yet, one JSON object per line."""
+  if not app.config.get('OUTBOX_ENABLED', True):
+    raise click.UsageError('the change log is disabled (OUTBOX_ENABLED = False)')
+  start = consumer_offset(consumer) if cursor is None else cursor
+  entries, next_cursor, reset = read_changes(start, limit)
+  if reset:
+    raise click.ClickException(f'{consumer} is behind the retained change log: copy the catalogue again '
+                               f'and carry on with --cursor {next_cursor}')
+  for entry in entries:
+    click.echo(json.dumps(change_json(entry), sort_keys=True))
+  if not peek:
+    store_offset(consumer, next_cursor)
+
+@app.cli.command('compact-changes')
+@click.option('--hours', type=int, default=None, help='Drop superseded entries older than this (default OUTBOX_COMPACT_HOURS).')
+@click.option('--days', type=int, default=None, help='Drop every entry older than this (default OUTBOX_RETENTION_DAYS).')
+def compact_changes_command(hours, days):
+  """Remove superseded and expired change log entries. Meant to run from cron."""
+  result = compact_changes(hours, days)
+  click.echo(f"{result['superseded']} superseded and {result['expired']} expired entries removed")
+
+@app.cli.command('update-trending')
+@click.option('--rebuild', is_flag=True, help='Discard the rollup and recount every show.')
+def update_trending_command(rebuild):
+  """Fold newly inserted shows into the trending rollup."""
+  if rebuild:
+    db.session.query(TrendingRollup).delete(synchronize_session=False)
+    db.session.query(RollupState).filter(RollupState.name == 'trending').delete(synchronize_session=False)
+    db.session.commit()
+  click.echo(f'{update_trending()} shows processed')
+
+@app.cli.command('move-state')
+@click.argument('state')
+@click.argument('shard')
+@click.option('--batch-size', default=200, help='Venues copied per transaction.')
+def move_state_command(state, shard, batch_size):
+  """Move the venues of a state, with their shows, to another shard."""
+  if shard not in shards.names:
+    raise click.UsageError(f"{shard} is not one of the shards ({', '.join(shards.names)})")
+  source = shards.for_state(state)
+  if source == shard:
+    raise click.ClickException(f'{state} is already on {shard}')
+
+  def assign(target, moving):
+    db.session.merge(ShardMap(state=state, shard=target, moving=moving, updated_at=datetime.now()))
+    db.session.commit()
+    shards.refresh()
+
+  def settle():
+    # every process re-reads the shard map within SHARD_MAP_SECONDS
+    time.sleep(shards.map_seconds + 1)
+
+  def batches(ids):
+    return [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+  # Writes to the state are refused while it moves. Reads keep going to the
+  # source until the copy is complete and then switch to the target, so the
+  # old rows are only deleted once nobody reads them any more.
+  assign(source, True)
+  settle()
+  ids = [id for (id,) in shards.session(source).query(Venue.id).filter(Venue.state == state).order_by(Venue.id)]
+  try:
+    shows = 0
+    for batch in batches(ids):
+      shows += copy_venues(batch, source, shard)
+      shards.commit()
+    assign(shard, True)
+    rebuild_state_matches(state)
+    shards.commit()
+  except:
+    shards.rollback()
+    for batch in batches(ids):
+      purge_venues(batch, shard)
+      shards.commit()
+    assign(source, False)
+    raise
+  click.echo(f'{len(ids)} venues and {shows} shows copied from {source} to {shard}')
+
+  settle()
+  for batch in batches(ids):
+    purge_venues(batch, source)
+    shards.commit()
+  assign(shard, False)
+  cache.invalidate('venue_areas')
+  click.echo(f'{state} is now on {shard}')
+
+@app.cli.command('shards')
+@click.option('--rebuild-directory', is_flag=True, help='Re-create the venue directory from the shards.')
+def shards_command(rebuild_directory):
+  """List each shard with the venues it holds per state."""
+  if not shards.enabled:
+    click.echo('Sharding is off, SHARDS is empty')
+    return
+  moving = {state for state, (shard, moving) in shards.assignments().items() if moving}
+  for shard in shards.names:
+    session = shards.session(shard)
+    states = session.query(Venue.state, db.func.count(Venue.id)).group_by(Venue.state).order_by(Venue.state).all()
+    click.echo(f'{shard}: {sum(count for state, count in states)} venues, '
+               f'{session.query(db.func.count(Show.id)).scalar()} shows')
+    for state, count in states:
+      notes = ' (moving)' if state in moving else ''
+      if shards.for_state(state) != shard:
+        notes += f' (belongs on {shards.for_state(state)})'
+      click.echo(f'  {state}: {count}{notes}')
+
+  if rebuild_directory:
+    db.session.query(VenueShard).delete(synchronize_session=False)
+    rows = shards.select(db.session.query(Venue.id, Venue.state), owner=Venue.state)
+    db.session.bulk_insert_mappings(VenueShard, [dict(venue_id=id, state=state) for id, state in rows])
+    shards.commit()
+    click.echo(f'{len(rows)} venues in the directory')
 
 #----------------------------------------------------------------------------#
 # Launch.
@@ -626,6 +2770,7 @@ if not app.debug:
 
 # Default port:
 if __name__ == '__main__':
+    warm_up()
     app.run()
 
 # Or specify port manually:
@@ -0,0 +1,272 @@
+# Entry point for ASGI servers, e.g.
+#   uvicorn asgi:application --workers 4
+# Needs SQLAlchemy 1.4+ and an async driver, see requirements-async.txt.
+#
+# The read views listed in app.ASYNC_PAGES run as coroutines: their page
+# generators yield queries, which are awaited on an async engine (asyncpg,
+# or aiosqlite for local testing), so a request waiting on the database
+# holds no thread. Every other request (forms, writes, the event stream,
+# static files) is handed to the WSGI app on a pool of ASYNC_WSGI_THREADS.
+# With SHARDS configured every shard gets an async engine of its own too.
+
+import asyncio
+import contextvars
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from flask import request, request_started
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app import ASYNC_PAGES, admission, app, events, shards, warm_up
+from sharding import PRIMARY, ShardQuery, merge_rows
+
+DRIVERS = {
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+DONE = object()
+
+
+def async_url(url):
+    """The async flavour of a SQLAlchemy URL, e.g. postgresql+asyncpg://."""
+    scheme, sep, rest = url.partition('://')
+    return DRIVERS.get(scheme.split('+')[0], scheme) + sep + rest
+
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope['http_version'],
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        if key in environ:
+            value = environ[key] + ',' + value
+        environ[key] = value
+    return environ
+
+
+class FyyurASGI(object):
+    """ASGI application wrapping the Flask app.
+
+    The async engine reads ASYNC_DATABASE_URL, or SQLALCHEMY_DATABASE_URI
+    with its driver swapped for the async one. Without an engine (the
+    'lifespan' startup never ran) everything goes through the WSGI app.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.engine = None
+        self.engines = {}
+        self.executor = ThreadPoolExecutor(app.config.get('ASYNC_WSGI_THREADS', 32), 'fyyur-wsgi')
+        # event streams run on the same pool
+        events.fit_threads(app.config.get('ASYNC_WSGI_THREADS', 32))
+
+    def create_engine(self, url=None):
+        config = self.app.config
+        url = url or config.get('ASYNC_DATABASE_URL') or async_url(config['SQLALCHEMY_DATABASE_URI'])
+        options = {}
+        if not url.startswith('sqlite'):
+            options.update(pool_size=config.get('ASYNC_POOL_SIZE', 20),
+                           max_overflow=config.get('ASYNC_MAX_OVERFLOW', 10))
+        return create_async_engine(url, **options)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise RuntimeError('Unsupported ASGI scope %r' % scope['type'])
+
+    async def lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await loop.run_in_executor(self.executor, warm_up)
+                    self.engine = self.create_engine()
+                    self.engines = {PRIMARY: self.engine}
+                    for name in shards.names[1:]:
+                        self.engines[name] = self.create_engine(async_url(self.app.config['SQLALCHEMY_BINDS'][name]))
+                    for engine in self.engines.values():
+                        async with engine.connect() as connection:
+                            await connection.exec_driver_sql('SELECT 1')
+                except Exception as e:
+                    self.app.logger.exception('ASGI startup failed')
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for engine in self.engines.values():
+                    await engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        environ = build_environ(scope, b''.join(chunks))
+
+        page = None
+        if self.engine is not None:
+            try:
+                endpoint, args = self.app.url_map.bind_to_environ(
+                    environ, server_name=self.app.config['SERVER_NAME']).match()
+                page = ASYNC_PAGES.get(endpoint)
+            except HTTPException:
+                pass
+        if page is None:
+            await self.call_wsgi(environ, receive, send)
+        else:
+            await self.call_page(page, environ, send)
+
+    async def call_page(self, page, environ, send):
+        # Flask.wsgi_app and full_dispatch_request, with the view awaited
+        ctx = self.app.request_context(environ)
+        error = None
+        try:
+            try:
+                ctx.push()
+                response = await self.dispatch(page)
+            except Exception as e:
+                error = e
+                response = self.app.handle_exception(e)
+            except:
+                error = sys.exc_info()[1]
+                raise
+            await self.send_response(response, environ, send)
+        finally:
+            if self.app.should_ignore_error(error):
+                error = None
+            ctx.auto_pop(error)
+
+    async def dispatch(self, page):
+        self.app.try_trigger_before_first_request_functions()
+        try:
+            request_started.send(self.app)
+            if request.endpoint in admission.limits:
+                # waiting for a concurrency slot blocks, so not on the loop
+                rv = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, contextvars.copy_context().run, self.app.preprocess_request)
+            else:
+                rv = self.app.preprocess_request()
+            if rv is None:
+                rv = await self.run_queries(page(**request.view_args))
+        except Exception as e:
+            rv = self.app.handle_user_exception(e)
+        return self.app.finalize_request(rv)
+
+    async def run_queries(self, steps):
+        # app.run_queries, awaiting each query on one pooled connection and
+        # those of several shards on one connection each, concurrently
+        rows = None
+        async with self.engine.connect() as connection:
+            while True:
+                try:
+                    query = steps.send(rows)
+                except StopIteration as done:
+                    return done.value
+                if isinstance(query, ShardQuery):
+                    results = await asyncio.gather(*(self.fetch(query, name) for name in query.shards))
+                    rows = merge_rows(results, query.key)
+                else:
+                    result = await connection.execute(query.statement)
+                    rows = result.fetchall()
+
+    async def fetch(self, step, name):
+        # the shard map behind the statement is re-read, synchronously, at
+        # most every SHARD_MAP_SECONDS
+        async with self.engines[name].connect() as connection:
+            result = await connection.execute(shards.statement(step, name))
+            return result.fetchall()
+
+    async def send_response(self, response, environ, send):
+        body, status, headers = response.get_wsgi_response(environ)
+        await self.start_response(send, status, headers)
+        try:
+            for chunk in body:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    async def start_response(self, send, status, headers):
+        await send({
+            'type': 'http.response.start',
+            'status': int(str(status).split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+        })
+
+    async def call_wsgi(self, environ, receive, send):
+        # Every call for one request runs in the same context, so Flask's
+        # context locals follow a streamed body from one pool thread to the next.
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started.update(status=status, headers=headers)
+
+        def run(fn, *args):
+            return loop.run_in_executor(self.executor, context.run, fn, *args)
+
+        body = await run(self.app, environ, start_response)
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            await self.start_response(send, started['status'], started['headers'])
+            chunks = iter(body)
+            while not disconnected.done():
+                chunk = await run(next, chunks, DONE)
+                if chunk is DONE:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            if hasattr(body, 'close'):
+                await run(body.close)
+
+    async def wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+
+application = FyyurASGI(app)
@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class TTLCache(object):
+    """A small thread-safe in-process cache with per-entry expiry."""
+
+    def __init__(self, default_ttl=60):
+        self.default_ttl = default_ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+
+    def get_or_set(self, key, compute, ttl=None):
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key=None, prefix=None):
+        with self._lock:
+            if key is not None:
+                self._data.pop(key, None)
+            if prefix is not None:
+                for k in [k for k in self._data if str(k).startswith(prefix)]:
+                    del self._data[k]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,41 @@
+from flask import request, session
+
+
+class CachePolicy(object):
+    """Sets Cache-Control on every response that does not set its own.
+
+    Successful GET/HEAD responses get the policy configured for their
+    endpoint in CACHE_CONTROL, or CACHE_CONTROL_DEFAULT. Public responses
+    also get a weak ETag so that clients revalidating a cached copy receive
+    a 304. Everything else (writes, redirects, errors, and responses that
+    update the visitor's session, e.g. by showing a flashed message) is
+    marked no-store so a shared cache never keeps it.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.policies = app.config.get('CACHE_CONTROL', {})
+        self.default = app.config.get('CACHE_CONTROL_DEFAULT', 'no-cache')
+        app.after_request(self.apply)
+
+    def policy(self, response):
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return 'no-store'
+        # the session cookie is only written after this hook, so look at the
+        # session itself rather than for a Set-Cookie header
+        if session.modified:
+            return 'private, no-store'
+        return self.policies.get(request.endpoint, self.default)
+
+    def apply(self, response):
+        if 'Cache-Control' in response.headers:
+            return response
+        policy = self.policy(response)
+        response.headers['Cache-Control'] = policy
+        if policy.startswith('public') and not response.is_streamed and not response.direct_passthrough:
+            response.add_etag(weak=True)
+            response.make_conditional(request)
+        return response
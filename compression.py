@@ -0,0 +1,110 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class GzipEncoder(object):
+    name = 'gzip'
+
+    def __init__(self, level):
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder(object):
+    name = 'br'
+
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class Compression(object):
+    """Compresses responses with brotli (when the brotli package is
+    installed) or gzip, whichever the client prefers.
+
+    Only COMPRESS_MIMETYPES are compressed, and buffered bodies smaller than
+    COMPRESS_MIN_SIZE are sent as they are. Streamed bodies are compressed
+    chunk by chunk and flushed after each one so nothing is held back.
+    Event streams, file responses and bodies that already carry a
+    Content-Encoding are left alone.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+        self.level = app.config.get('COMPRESS_LEVEL', 6)
+        self.quality = app.config.get('COMPRESS_BROTLI_QUALITY', 4)
+        self.mimetypes = set(app.config.get('COMPRESS_MIMETYPES', ['text/html']))
+        self.mimetypes.discard('text/event-stream')
+        app.after_request(self.compress)
+
+    def encoder(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br'] and accepted['br'] >= accepted['gzip']:
+            return BrotliEncoder(self.quality)
+        if accepted['gzip']:
+            return GzipEncoder(self.level)
+        return None
+
+    def compress(self, response):
+        if response.mimetype not in self.mimetypes:
+            return response
+        # the choice below depends on the request's Accept-Encoding
+        response.vary.add('Accept-Encoding')
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.cache_control.no_transform):
+            return response
+        if not response.is_streamed and len(response.get_data()) < self.min_size:
+            return response
+
+        encoder = self.encoder()
+        if encoder is None:
+            return response
+        if response.is_streamed:
+            response.response = self.stream(response.response, encoder, response.charset)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(encoder.compress(response.get_data()) + encoder.finish())
+        response.headers['Content-Encoding'] = encoder.name
+        return response
+
+    def stream(self, chunks, encoder, charset):
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode(charset)
+                data = encoder.compress(chunk) + encoder.flush()
+                if data:
+                    yield data
+            yield encoder.finish()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
@@ -9,4 +9,185 @@ DEBUG = True
 # Connect to the database
 
 
-SQLALCHEMY_DATABASE_URI = 'postgresql:///fyyur2db'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql:///fyyur2db')
+
+# ASGI mode (asgi.py): read views run over an async engine. By default the
+# URL above with its driver swapped (postgresql+asyncpg, sqlite+aiosqlite).
+# Everything else runs on a pool of ASYNC_WSGI_THREADS threads.
+ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+ASYNC_POOL_SIZE = 20
+ASYNC_MAX_OVERFLOW = 10
+ASYNC_WSGI_THREADS = 32
+
+# Regional sharding (sharding.py): SHARDS names binds in SQLALCHEMY_BINDS
+# that hold venues with their shows and matches, placed by state. States
+# go to SHARD_DEFAULT unless 'flask move-state' put them elsewhere; the
+# primary database is the shard called 'default'. Leave SHARDS empty to
+# keep everything in one database.
+SQLALCHEMY_BINDS = {}
+SHARDS = []
+SHARD_DEFAULT = 'default'
+SHARD_MAP_SECONDS = 5
+# Venue and show ids reserved per process at a time. Larger blocks save a
+# round trip to the primary per insert, but shows are then saved out of id
+# order and 'flask update-trending', which folds shows by id, can miss some
+# until it is run with --rebuild.
+SHARD_ID_BLOCK = 1
+SHARD_WORKERS = 8
+
+# Home page trending windows (days) and how long a computed ranking is cached
+TRENDING_WINDOWS = (7, 30, 90)
+TRENDING_CACHE_SECONDS = 60
+# Shows saved after a gap in Show.id are folded into the rollup only once
+# they are this old, as the missing id may belong to a write still
+# committing; keep it above the longest write transaction. Shows held back
+# are picked up by the next run.
+TRENDING_SETTLE_SECONDS = 5
+
+# Background tasks: 'thread' (in-process pool), 'database' (durable Job
+# table worked by 'flask run-jobs') or 'inline'
+TASK_BACKEND = 'thread'
+TASK_WORKERS = 2
+TASK_QUEUE_SIZE = 1000
+TASK_MAX_RETRIES = 3
+TASK_RETRY_DELAY = 1.0
+# What to do when the queue is full: 'inline' runs the task in the request
+TASK_ON_FULL = 'inline'
+# A 'database' job still running this long after it was claimed is assumed
+# to belong to a dead worker and is run again; keep it above the longest task.
+TASK_LEASE_SECONDS = 300
+
+# Shows that started more than this many days ago are moved to ShowArchive
+# by 'flask archive-shows'
+ARCHIVE_AFTER_DAYS = 365
+
+# Request profiling: send PROFILE_HEADER with PROFILE_TOKEN to profile one
+# request, or set PROFILE_SAMPLE_RATE (0.0 - 1.0) to sample. Captures are kept
+# per endpoint under PROFILE_DIR; 'flask profile-report' summarises them.
+PROFILE_DIR = 'profiles'
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN = os.environ.get('FYYUR_PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_KEEP = 50
+
+# Logging. Records are queued and written by a background thread as JSON
+# lines: application errors to LOG_FILE, one record per request to
+# REQUEST_LOG_FILE, and requests slower than SLOW_REQUEST_MS or issuing more
+# than SLOW_REQUEST_QUERIES queries to SLOW_REQUEST_LOG_FILE.
+LOG_FILE = 'error.log'
+REQUEST_LOG_FILE = 'requests.log'
+SLOW_REQUEST_LOG_FILE = 'slow.log'
+LOG_QUEUE_SIZE = 10000
+SLOW_REQUEST_MS = 500
+SLOW_REQUEST_QUERIES = 50
+
+# Warm-up (see warm_up in app.py): connections opened per process and how
+# long the /venues area listing is cached
+WARM_UP_CONNECTIONS = 1
+VENUE_AREAS_CACHE_SECONDS = 30
+
+# Where 'flask prerender' writes static copies of the catalogue pages
+PRERENDER_DIR = 'build'
+
+# How long /stats serves the catalogue statistics rollup from memory
+STATS_CACHE_SECONDS = 30
+
+# Change log (GET /changes, 'flask changes'). Entries past an id gap are
+# held back until OUTBOX_SETTLE_SECONDS old, since the missing id may belong
+# to a write still committing: keep it above the longest write transaction.
+# 'flask compact-changes' drops entries superseded by a newer one of the same
+# record after OUTBOX_COMPACT_HOURS and all entries after
+# OUTBOX_RETENTION_DAYS; consumers further behind are told to resync.
+# With FYYUR_CHANGES_TOKEN set, consumers must send it as a Bearer token.
+# Entries commit with the primary database, so a change and its entry are
+# only atomic without SHARDS: the app refuses to start with both, and a
+# sharded deployment sets OUTBOX_ENABLED = False.
+OUTBOX_ENABLED = True
+CHANGES_TOKEN = os.environ.get('FYYUR_CHANGES_TOKEN')
+OUTBOX_SETTLE_SECONDS = 5
+OUTBOX_COMPACT_HOURS = 24
+OUTBOX_RETENTION_DAYS = 30
+OUTBOX_PAGE_SIZE = 100
+OUTBOX_PAGE_MAX = 1000
+
+# Trigram similarity (0.0 - 1.0) of normalised names above which a new venue
+# or artist in the same city is reported as a likely duplicate
+DUPLICATE_SIMILARITY = 0.6
+
+# Server-Sent Events (/shows/stream). Each listener buffers at most
+# EVENTS_QUEUE_SIZE events and is disconnected when it falls that far behind.
+# EVENTS_BROKER = 'module:ClassName' fans events out across worker processes
+# (see events.Broker); 'local' only reaches listeners of the same process,
+# so gunicorn.conf.py then runs a single worker.
+EVENTS_BROKER = 'local'
+EVENTS_QUEUE_SIZE = 100
+EVENTS_MAX_SUBSCRIBERS = 200
+EVENTS_HEARTBEAT_SECONDS = 15
+# Listeners per process are also capped at half of gunicorn's threads (or
+# of ASYNC_WSGI_THREADS). Past the cap /shows/stream answers 503 and the
+# page polls /shows/latest every EVENTS_POLL_SECONDS instead.
+EVENTS_POLL_SECONDS = 30
+
+# Response compression (compression.py): brotli when the brotli package is
+# installed and the client accepts it, gzip otherwise. Bodies smaller than
+# COMPRESS_MIN_SIZE bytes are not worth compressing.
+COMPRESS_MIN_SIZE = 500
+COMPRESS_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 4
+COMPRESS_MIMETYPES = ['text/html', 'text/css', 'text/plain', 'text/javascript',
+                      'application/javascript', 'application/json', 'image/svg+xml']
+
+# Cache-Control per endpoint for successful GETs (cache_control.py). Pages
+# anyone may see are cached by shared caches (s-maxage) while browsers
+# revalidate (max-age=0), so editors see their own changes at once. Forms
+# carry CSRF tokens and record versions and are never stored.
+CACHE_CONTROL_DEFAULT = 'no-cache'
+LISTING_CACHE = 'public, max-age=0, s-maxage=60, stale-while-revalidate=30'
+CACHE_CONTROL = {
+    'index': LISTING_CACHE,
+    'venues': LISTING_CACHE,
+    'artists': LISTING_CACHE,
+    'shows': LISTING_CACHE,
+    'show_venue': LISTING_CACHE,
+    'show_artist': LISTING_CACHE,
+    'search_shows': LISTING_CACHE,
+    'venue_matches': LISTING_CACHE,
+    'artist_matches': LISTING_CACHE,
+    'stats': LISTING_CACHE,
+    'stats_json': LISTING_CACHE,
+    'create_venue_form': 'no-store',
+    'create_artist_form': 'no-store',
+    'create_shows': 'no-store',
+    'edit_venue': 'no-store',
+    'edit_artist': 'no-store',
+    'metrics': 'no-store',
+    'healthz': 'no-store',
+    'readyz': 'no-store',
+    'list_changes': 'no-store',
+}
+
+# Admission control (admission.py). Per endpoint: 'concurrency' requests run
+# at once and 'queue' more wait up to 'timeout' seconds before being shed
+# with 503; 'rate'/'burst' is a token bucket per client, answered with 429.
+# The venue and artist searches are unindexed ILIKE scans, so they get the
+# tightest limits. Limits are per process.
+ADMISSION_ENABLED = True
+ADMISSION_CLIENT_HEADER = None  # e.g. 'X-Forwarded-For' behind a trusted proxy
+ADMISSION_MAX_CLIENTS = 10000
+# Clients that are not rate limited, as told apart above; loadtest.py
+# --start-app exempts loopback, since all its clients share one address.
+ADMISSION_EXEMPT = [client for client in os.environ.get('ADMISSION_EXEMPT', '').split(',') if client]
+SEARCH_ADMISSION = {'concurrency': 4, 'queue': 8, 'timeout': 2.0, 'rate': 1.0, 'burst': 10}
+WRITE_ADMISSION = {'concurrency': 8, 'queue': 16, 'timeout': 5.0, 'rate': 0.5, 'burst': 20}
+ADMISSION_LIMITS = {
+    'search_venues': SEARCH_ADMISSION,
+    'search_artists': SEARCH_ADMISSION,
+    'search_shows': {'concurrency': 8, 'queue': 16, 'timeout': 2.0, 'rate': 5.0, 'burst': 20},
+    'create_venue_submission': WRITE_ADMISSION,
+    'create_artist_submission': WRITE_ADMISSION,
+    'create_show_submission': WRITE_ADMISSION,
+    'edit_venue_submission': WRITE_ADMISSION,
+    'edit_artist_submission': WRITE_ADMISSION,
+    'bulk_delete_venues': WRITE_ADMISSION,
+    'bulk_delete_artists': WRITE_ADMISSION,
+}
@@ -0,0 +1,162 @@
+import json
+import queue
+import threading
+from importlib import import_module
+
+
+class Broker(object):
+    """Carries published events between processes.
+
+    publish() hands over one serialised event; the broker calls the deliver
+    callback given to start() in every process that should see it, the
+    publishing one included. Subclass it on Redis pub/sub, PostgreSQL
+    LISTEN/NOTIFY or similar to fan out across workers, and point
+    EVENTS_BROKER at it as 'module:ClassName'.
+    """
+
+    def start(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, message):
+        raise NotImplementedError
+
+
+class LocalBroker(Broker):
+    """Delivers to the publishing process only: enough for a single worker
+    and for development."""
+
+    def publish(self, message):
+        self.deliver(message)
+
+
+class Subscription(object):
+    """One listening connection. Events wait in a bounded queue; a consumer
+    that lets it fill up is dropped rather than buffered without limit."""
+
+    def __init__(self, channel, filters, size):
+        self.channel = channel
+        self.filters = filters
+        self.queue = queue.Queue(maxsize=size)
+        self.dropped = False
+
+    def matches(self, channel, data):
+        if channel != self.channel:
+            return False
+        for key, value in self.filters.items():
+            actual = data.get(key)
+            if isinstance(value, str) and isinstance(actual, str):
+                if value.lower() != actual.lower():
+                    return False
+            elif value != actual:
+                return False
+        return True
+
+
+class EventHub(object):
+    """In-process pub/sub fan-out of application events to Server-Sent
+    Events streams.
+
+    publish() goes through the broker chosen with EVENTS_BROKER ('local' or
+    'module:ClassName'), which calls deliver() in each process; deliver()
+    copies the event into the queue of every matching subscription.
+    """
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        self.stats = dict(published=0, delivered=0, dropped=0, rejected=0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.queue_size = app.config.get('EVENTS_QUEUE_SIZE', 100)
+        self.max_subscribers = app.config.get('EVENTS_MAX_SUBSCRIBERS', 200)
+        self.heartbeat = app.config.get('EVENTS_HEARTBEAT_SECONDS', 15)
+        name = app.config.get('EVENTS_BROKER', 'local')
+        if name == 'local':
+            self.broker = LocalBroker()
+        else:
+            module, _, cls = name.partition(':')
+            self.broker = getattr(import_module(module), cls)()
+        self.broker.start(self.deliver)
+
+    def fit_threads(self, threads):
+        """Caps listeners at half the threads the server has for requests,
+        so streams cannot take every thread of the process; with one thread
+        (a sync worker) every listener is turned away to poll instead."""
+        self.max_subscribers = min(self.max_subscribers, threads // 2)
+
+    def subscribe(self, channel, **filters):
+        with self.lock:
+            if len(self.subscriptions) >= self.max_subscribers:
+                self.stats['rejected'] += 1
+                return None
+            subscription = Subscription(channel, filters, self.queue_size)
+            self.subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, channel, data, id=None):
+        self.stats['published'] += 1
+        self.broker.publish(json.dumps({'channel': channel, 'id': id, 'data': data}, default=str))
+
+    def deliver(self, message):
+        event = json.loads(message)
+        with self.lock:
+            subscriptions = [s for s in self.subscriptions if s.matches(event['channel'], event['data'])]
+        for subscription in subscriptions:
+            if subscription.dropped:
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+                self.stats['delivered'] += 1
+            except queue.Full:
+                self.drop(subscription)
+
+    def drop(self, subscription):
+        # discard what the slow consumer has not read and leave it only the
+        # marker that ends its stream; the client reconnects from scratch
+        self.unsubscribe(subscription)
+        subscription.dropped = True
+        self.stats['dropped'] += 1
+        while True:
+            try:
+                subscription.queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            subscription.queue.put_nowait(None)
+        except queue.Full:
+            # a deliver() that listed the subscription before it was removed
+            # refilled the queue; stream() ends on the dropped flag as well
+            pass
+
+    def stream(self, subscription):
+        """The text/event-stream body for one subscription."""
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = subscription.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # also how a disconnected client is noticed
+                    yield ': keepalive\n\n'
+                    continue
+                if event is None or subscription.dropped:
+                    yield 'event: dropped\ndata: {}\n\n'
+                    return
+                frame = 'event: %s\ndata: %s\n\n' % (event['channel'], json.dumps(event['data']))
+                if event.get('id') is not None:
+                    frame = 'id: %s\n' % event['id'] + frame
+                yield frame
+        finally:
+            self.unsubscribe(subscription)
+
+    def metrics(self):
+        data = dict(self.stats)
+        data['subscribers'] = len(self.subscriptions)
+        data['broker'] = type(self.broker).__name__
+        return data
@@ -0,0 +1,31 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+
+import config
+
+bind = '0.0.0.0:5000'
+# With the local events broker a new show only reaches the /shows/stream
+# listeners of the worker that listed it, so there is one worker until
+# EVENTS_BROKER fans events out across processes.
+workers = 1 if config.EVENTS_BROKER == 'local' else 4
+# listeners each hold a thread for as long as they are connected (at most
+# half of them, see EventHub.fit_threads); a sync worker would be taken out
+# by the first one
+worker_class = 'gthread'
+threads = 32
+
+# Import (and warm up) the app once in the master so compiled templates,
+# configured mappers and primed caches are shared copy-on-write by workers.
+preload_app = True
+
+
+def post_fork(server, worker):
+    from app import app, db, events, request_logging, shards, warm_pool
+
+    # connections and threads opened in the master must not be shared
+    with app.app_context():
+        db.engine.dispose()
+        shards.after_fork()
+        warm_pool()
+    request_logging.after_fork()
+    if worker.cfg.worker_class_str in ('sync', 'gthread'):
+        events.fit_threads(worker.cfg.threads)
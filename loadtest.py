@@ -0,0 +1,369 @@
+"""Load generator for Fyyur.
+
+Replays a weighted mix of requests from a scenario file against a running
+server with a fixed number of concurrent keep-alive clients, and reports
+throughput, latency percentiles and error rate per interval and overall.
+Every response outside 2xx/3xx is an error, and so is a response lacking
+the text a request lists under "expect" (e.g. the success message of a form
+that reports failures with a 200 page).
+
+    # against a server that is already running
+    python loadtest.py loadtest_scenarios/mixed.json --url http://127.0.0.1:5000
+
+    # start a local app on a freshly seeded SQLite database first
+    python loadtest.py loadtest_scenarios/mixed.json --start-app
+
+    # compare servers one after another on the same seeded database
+    python loadtest.py loadtest_scenarios/reads.json --start-app --server gunicorn,uvicorn
+
+Only the standard library is used so the harness runs anywhere the app does.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+class Window(object):
+    """Latencies and outcomes collected over one reporting interval."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.unexpected = 0
+        self.statuses = {}
+
+    def add(self, latency, status, expected=True):
+        # status 0 is a connection error or timeout
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not 200 <= status < 400:
+            self.errors += 1
+        elif not expected:
+            self.errors += 1
+            self.unexpected += 1
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        self.unexpected += other.unexpected
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+    def summary(self, seconds):
+        count = len(self.latencies)
+        return {
+            'requests': count,
+            'rps': round(count / seconds, 1) if seconds else 0.0,
+            'p50_ms': round(percentile(self.latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(self.latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(self.latencies, 99) * 1000, 2),
+            'max_ms': round(max(self.latencies) * 1000, 2) if count else 0.0,
+            'error_rate': round(self.errors / float(count), 4) if count else 0.0,
+            'unexpected': self.unexpected,
+            'statuses': dict(sorted(self.statuses.items())),
+        }
+
+
+def breakdown(summary):
+    # e.g. '200: 950, 429: 48, 0: 2, 200 without expected text: 10'
+    parts = ['%s: %d' % (status, count) for status, count in summary['statuses'].items()]
+    if summary['unexpected']:
+        parts.append('2xx/3xx without expected text: %d' % summary['unexpected'])
+    return ', '.join(parts)
+
+
+class Scenario(object):
+
+    def __init__(self, data):
+        self.name = data.get('name', 'scenario')
+        self.concurrency = data.get('concurrency', 10)
+        self.duration = data.get('duration', 30)
+        self.requests = data['requests']
+        self.params = data.get('params', {})
+        self.weights = [r.get('weight', 1) for r in self.requests]
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def fill(self, template, rng):
+        # {name} placeholders are replaced by a random value of params[name]:
+        # a [low, high] integer range or a list of choices
+        def value(match):
+            spec = self.params[match.group(1)]
+            if isinstance(spec, list) and len(spec) == 2 and all(isinstance(v, int) for v in spec):
+                return str(rng.randint(spec[0], spec[1]))
+            return str(rng.choice(spec))
+        return re.sub(r'\{(\w+)\}', value, template)
+
+    def pick(self, rng):
+        request = rng.choices(self.requests, weights=self.weights)[0]
+        path = self.fill(request['path'], rng)
+        form = {key: self.fill(str(value), rng) for key, value in request.get('form', {}).items()}
+        return request.get('method', 'GET'), path, form, request.get('expect')
+
+
+class Client(object):
+    """A minimal HTTP/1.1 keep-alive client on asyncio streams."""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def request(self, method, path, form=None):
+        body = urllib.parse.urlencode(form).encode() if form else b''
+        head = '%s %s HTTP/1.1\r\nHost: %s:%d\r\nConnection: keep-alive\r\n' % (method, path, self.host, self.port)
+        if method != 'GET':
+            head += 'Content-Type: application/x-www-form-urlencoded\r\nContent-Length: %d\r\n' % len(body)
+        message = head.encode() + b'\r\n' + body
+
+        reused = self.writer is not None
+        try:
+            return await self.send(message)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            if not reused:
+                raise
+            # the server closed the idle connection; retry once on a new one
+            self.close()
+            return await self.send(message)
+
+    async def send(self, message):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(message)
+        await self.writer.drain()
+        return await asyncio.wait_for(self.read_response(), self.timeout)
+
+    async def read_response(self):
+        # returns (status, body)
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        version, status = status_line.split()[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        chunks = []
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                chunks.append((await self.reader.readexactly(size + 2))[:size])
+                if size == 0:
+                    break
+        elif 'content-length' in headers:
+            chunks.append(await self.reader.readexactly(int(headers['content-length'])))
+        else:
+            chunks.append(await self.reader.read())
+            self.close()
+        connection = headers.get('connection', '').lower()
+        if connection == 'close' or (version == b'HTTP/1.0' and connection != 'keep-alive'):
+            self.close()
+        return status, b''.join(chunks)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def user(scenario, url, deadline, windows, seed, timeout):
+    rng = random.Random(seed)
+    client = Client(url.hostname, url.port or 80, timeout)
+    while time.monotonic() < deadline:
+        method, path, form, expect = scenario.pick(rng)
+        started = time.monotonic()
+        body = b''
+        try:
+            status, body = await client.request(method, path, form)
+        except (OSError, asyncio.TimeoutError, ValueError, asyncio.IncompleteReadError):
+            status = 0
+            client.close()
+        expected = expect is None or expect.encode() in body
+        windows[-1].add(time.monotonic() - started, status, expected)
+    client.close()
+
+
+async def run(scenario, url, concurrency, duration, interval, timeout, report):
+    windows = [Window()]
+    total = Window()
+    started = time.monotonic()
+    deadline = started + duration
+    users = [asyncio.ensure_future(user(scenario, url, deadline, windows, i, timeout))
+             for i in range(concurrency)]
+
+    elapsed = 0
+    while elapsed < duration:
+        step = min(interval, duration - elapsed)
+        await asyncio.sleep(step)
+        elapsed += step
+        window = windows[-1]
+        windows.append(Window())
+        total.merge(window)
+        report(dict(window.summary(step), t=round(elapsed, 1)))
+
+    await asyncio.gather(*users)
+    # requests that were in flight when the last interval closed
+    total.merge(windows[-1])
+    return total.summary(time.monotonic() - started)
+
+
+def wait_until_ready(base, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base + '/readyz', timeout=2) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('app did not become ready at %s' % base)
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVERS = ('flask', 'gunicorn', 'uvicorn')
+
+
+def seed_database(args):
+    """Seed a scratch SQLite database; returns the environment pointing at it."""
+    database = os.path.join(tempfile.mkdtemp(prefix='fyyur-loadtest-'), 'fyyur.db')
+    # every client connects from loopback, which would share one rate limit
+    env = dict(os.environ, FLASK_APP='app.py', DATABASE_URL='sqlite:///' + database,
+               ADMISSION_EXEMPT='127.0.0.1,::1')
+    subprocess.check_call([sys.executable, '-m', 'flask', 'seed', '--create-tables',
+                           '--venues', str(args.venues), '--artists', str(args.artists),
+                           '--shows', str(args.shows)], cwd=HERE, env=env)
+    for command in ('update-trending', 'rebuild-matches', 'rebuild-stats'):
+        subprocess.check_call([sys.executable, '-m', 'flask', command], cwd=HERE, env=env)
+    return env
+
+
+def start_app(args, env, server):
+    """Start the app with the given server against the seeded database."""
+    port = str(args.port)
+    if server == 'gunicorn':
+        command = ['gunicorn', '-c', 'gunicorn.conf.py', '-b', '127.0.0.1:' + port,
+                   '-w', str(args.workers), '-k', 'gthread', '--threads', '8', 'wsgi:app']
+    elif server == 'uvicorn':
+        # asgi.py: read views as coroutines over the async engine
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+                   '--port', port, '--workers', str(args.workers), '--no-access-log', '--log-level', 'warning']
+    else:
+        command = [sys.executable, '-m', 'flask', 'run', '--port', port, '--no-reload', '--with-threads']
+    process = subprocess.Popen(command, cwd=HERE, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = 'http://127.0.0.1:' + port
+    try:
+        wait_until_ready(base)
+    except Exception:
+        process.terminate()
+        raise
+    return process, base
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', help='scenario JSON file (see loadtest_scenarios/)')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='server to load (default %(default)s)')
+    parser.add_argument('--concurrency', type=int, help='concurrent clients (overrides the scenario)')
+    parser.add_argument('--duration', type=float, help='seconds to run (overrides the scenario)')
+    parser.add_argument('--interval', type=float, default=5, help='seconds per progress report')
+    parser.add_argument('--timeout', type=float, default=30, help='per-request timeout in seconds')
+    parser.add_argument('--json', dest='json_out', help='also write the reports to this file')
+    parser.add_argument('--start-app', action='store_true', help='seed a scratch database and start the app')
+    parser.add_argument('--server', default='flask',
+                        help='with --start-app: %s, or several separated by commas to compare them' % ', '.join(SERVERS))
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers with --start-app')
+    parser.add_argument('--port', type=int, default=5055, help='port for --start-app')
+    parser.add_argument('--venues', type=int, default=200)
+    parser.add_argument('--artists', type=int, default=500)
+    parser.add_argument('--shows', type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    scenario = Scenario.load(args.scenario)
+    servers = args.server.split(',') if args.start_app else [None]
+    for server in servers:
+        if server is not None and server not in SERVERS:
+            parser.error('unknown server %r' % server)
+    env = seed_database(args) if args.start_app else None
+
+    concurrency = args.concurrency or scenario.concurrency
+    duration = args.duration or scenario.duration
+    runs = []
+
+    for server in servers:
+        reports = []
+
+        def report(window):
+            reports.append(window)
+            print('t=%(t)6.1fs  %(rps)8.1f req/s  p50 %(p50_ms)7.2fms  p95 %(p95_ms)7.2fms  '
+                  'p99 %(p99_ms)7.2fms  errors %(error_rate).2f%%' % dict(window, error_rate=window['error_rate'] * 100)
+                  + ('  (%s)' % breakdown(window) if window['error_rate'] else ''))
+
+        process = None
+        url = args.url
+        if server is not None:
+            process, url = start_app(args, env, server)
+
+        print('%s: %d clients for %ss against %s%s' % (scenario.name, concurrency, duration, url,
+                                                     ' (%s)' % server if server else ''))
+        try:
+            summary = asyncio.run(run(scenario, urllib.parse.urlparse(url), concurrency, duration,
+                                      args.interval, args.timeout, report))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+        print('total: %(requests)d requests, %(rps).1f req/s, p50 %(p50_ms).2fms, p95 %(p95_ms).2fms, '
+              'p99 %(p99_ms).2fms, max %(max_ms).2fms, error rate %(error_rate).4f' % summary)
+        print('statuses: %s' % breakdown(summary))
+        runs.append({'server': server, 'url': url, 'intervals': reports, 'summary': summary})
+
+    if len(runs) > 1:
+        print('\n%-10s %10s %10s %10s %10s %8s' % ('server', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+        for result in runs:
+            print('%(server)-10s %(rps)10.1f %(p50_ms)10.2f %(p95_ms)10.2f %(p99_ms)10.2f %(error_rate)8.4f'
+                  % dict(result['summary'], server=result['server']))
+
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            if len(runs) == 1:
+                json.dump({'scenario': scenario.name, 'url': runs[0]['url'], 'concurrency': concurrency,
+                           'duration': duration, 'intervals': runs[0]['intervals'],
+                           'summary': runs[0]['summary']}, f, indent=2)
+            else:
+                json.dump({'scenario': scenario.name, 'concurrency': concurrency,
+                           'duration': duration, 'runs': runs}, f, indent=2)
+    return 0 if all(result['summary']['requests'] for result in runs) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
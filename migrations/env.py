@@ -74,6 +74,11 @@ def run_migrations_online():
     connectable = current_app.extensions['migrate'].db.get_engine()
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # the app turns foreign keys on for every SQLite connection, but
+            # batch mode rebuilds tables by dropping them, which must not
+            # cascade into the rows that reference them
+            connection.execute('PRAGMA foreign_keys=OFF')
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
@@ -0,0 +1,28 @@
+"""add stale page table for incremental pre-rendering
+
+Revision ID: 0b5d8e3f6c17
+Revises: f1c6a2d94b70
+Create Date: 2026-10-19 17:58:40.731552
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b5d8e3f6c17'
+down_revision = 'f1c6a2d94b70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('StalePage',
+    sa.Column('path', sa.String(length=255), nullable=False),
+    sa.Column('marked_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('path')
+    )
+
+
+def downgrade():
+    op.drop_table('StalePage')
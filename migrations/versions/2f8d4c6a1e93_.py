@@ -0,0 +1,42 @@
+"""add catalogue stats rollup and delta tables
+
+Revision ID: 2f8d4c6a1e93
+Revises: 0b5d8e3f6c17
+Create Date: 2026-10-19 19:12:05.318406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f8d4c6a1e93'
+down_revision = '0b5d8e3f6c17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('CatalogueStat',
+    sa.Column('dimension', sa.String(length=10), nullable=False),
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('venues', sa.Integer(), nullable=False),
+    sa.Column('artists', sa.Integer(), nullable=False),
+    sa.Column('shows', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('dimension', 'key')
+    )
+    op.create_table('StatsDelta',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('dimension', sa.String(length=10), nullable=False),
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('venues', sa.Integer(), nullable=False),
+    sa.Column('artists', sa.Integer(), nullable=False),
+    sa.Column('shows', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # existing rows are counted by 'flask rebuild-stats' after upgrading
+
+
+def downgrade():
+    op.drop_table('StatsDelta')
+    op.drop_table('CatalogueStat')
@@ -0,0 +1,60 @@
+"""add record timestamps and the change log outbox
+
+Revision ID: 4c7e1f9a2d58
+Revises: 9a2c5e7f1b36
+Create Date: 2026-10-19 23:41:09.362815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c7e1f9a2d58'
+down_revision = '9a2c5e7f1b36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows get the time of the upgrade. SQLite cannot add a column
+    # with a non-constant default, so the columns are added empty, filled in
+    # and only then given their default and NOT NULL (batch mode rebuilds
+    # the table on SQLite and alters it in place elsewhere).
+    for table in ('Venue', 'Artist', 'Show'):
+        op.add_column(table, sa.Column('created_at', sa.DateTime(), nullable=True))
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        rows = sa.table(table, sa.column('created_at'), sa.column('updated_at'))
+        op.execute(rows.update().values(created_at=sa.func.now(), updated_at=sa.func.now()))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False,
+                                  server_default=sa.text('CURRENT_TIMESTAMP'))
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False,
+                                  server_default=sa.text('CURRENT_TIMESTAMP'))
+    op.create_table('OutboxEntry',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(length=10), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('action', sa.String(length=10), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_OutboxEntry_created_at'), 'OutboxEntry', ['created_at'], unique=False)
+    op.create_index('ix_OutboxEntry_entity_entity_id', 'OutboxEntry', ['entity', 'entity_id', 'id'], unique=False)
+    op.create_table('OutboxConsumer',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('OutboxConsumer')
+    op.drop_index('ix_OutboxEntry_entity_entity_id', table_name='OutboxEntry')
+    op.drop_index(op.f('ix_OutboxEntry_created_at'), table_name='OutboxEntry')
+    op.drop_table('OutboxEntry')
+    for table in ('Show', 'Artist', 'Venue'):
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'created_at')
@@ -0,0 +1,47 @@
+"""add match candidates table
+
+Revision ID: 5d1f0c8a7e21
+Revises: 3b6a9955b36b
+Create Date: 2026-10-19 09:12:44.301275
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1f0c8a7e21'
+down_revision = '3b6a9955b36b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Match',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('genre_overlap', sa.Integer(), nullable=False),
+    sa.Column('same_city', sa.Boolean(), nullable=False),
+    sa.Column('artist_recent_shows', sa.Integer(), nullable=False),
+    sa.Column('venue_recent_shows', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ),
+    sa.PrimaryKeyConstraint('artist_id', 'venue_id')
+    )
+    op.create_index('ix_Match_artist_score', 'Match', ['artist_id', 'score'], unique=False)
+    op.create_index('ix_Match_venue_score', 'Match', ['venue_id', 'score'], unique=False)
+    op.create_index(op.f('ix_Artist_city'), 'Artist', ['city'], unique=False)
+    op.create_index(op.f('ix_Artist_state'), 'Artist', ['state'], unique=False)
+    op.create_index(op.f('ix_Venue_city'), 'Venue', ['city'], unique=False)
+    op.create_index(op.f('ix_Venue_state'), 'Venue', ['state'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Venue_state'), table_name='Venue')
+    op.drop_index(op.f('ix_Venue_city'), table_name='Venue')
+    op.drop_index(op.f('ix_Artist_state'), table_name='Artist')
+    op.drop_index(op.f('ix_Artist_city'), table_name='Artist')
+    op.drop_index('ix_Match_venue_score', table_name='Match')
+    op.drop_index('ix_Match_artist_score', table_name='Match')
+    op.drop_table('Match')
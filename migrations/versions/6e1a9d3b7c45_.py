@@ -0,0 +1,40 @@
+"""add normalised name keys for duplicate detection
+
+Revision ID: 6e1a9d3b7c45
+Revises: 2f8d4c6a1e93
+Create Date: 2026-10-19 19:48:22.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e1a9d3b7c45'
+down_revision = '2f8d4c6a1e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('name_key', sa.String(length=255), nullable=True))
+    op.create_index('ix_Venue_state_city_name_key', 'Venue', ['state', 'city', 'name_key'], unique=False)
+    op.add_column('Artist', sa.Column('name_key', sa.String(length=255), nullable=True))
+    op.create_index('ix_Artist_state_city_name_key', 'Artist', ['state', 'city', 'name_key'], unique=False)
+    # location lookups go through the indexes above
+    op.drop_index('ix_Venue_state_city', table_name='Venue')
+    op.drop_index('ix_Venue_city', table_name='Venue')
+    op.drop_index('ix_Artist_state', table_name='Artist')
+    op.drop_index('ix_Artist_city', table_name='Artist')
+    # existing rows get their key from 'flask find-duplicates venues|artists'
+
+
+def downgrade():
+    op.create_index('ix_Artist_city', 'Artist', ['city'], unique=False)
+    op.create_index('ix_Artist_state', 'Artist', ['state'], unique=False)
+    op.create_index('ix_Venue_city', 'Venue', ['city'], unique=False)
+    op.create_index('ix_Venue_state_city', 'Venue', ['state', 'city'], unique=False)
+    op.drop_index('ix_Artist_state_city_name_key', table_name='Artist')
+    op.drop_column('Artist', 'name_key')
+    op.drop_index('ix_Venue_state_city_name_key', table_name='Venue')
+    op.drop_column('Venue', 'name_key')
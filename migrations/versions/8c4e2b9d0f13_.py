@@ -0,0 +1,38 @@
+"""add trending rollup tables
+
+Revision ID: 8c4e2b9d0f13
+Revises: 5d1f0c8a7e21
+Create Date: 2026-10-19 10:02:17.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e2b9d0f13'
+down_revision = '5d1f0c8a7e21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('TrendingRollup',
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('shows', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'key', 'day')
+    )
+    op.create_index('ix_TrendingRollup_kind_day', 'TrendingRollup', ['kind', 'day'], unique=False)
+    op.create_table('RollupState',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('RollupState')
+    op.drop_index('ix_TrendingRollup_kind_day', table_name='TrendingRollup')
+    op.drop_table('TrendingRollup')
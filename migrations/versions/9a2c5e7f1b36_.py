@@ -0,0 +1,46 @@
+"""add shard map, id sequences and the venue directory
+
+Revision ID: 9a2c5e7f1b36
+Revises: 6e1a9d3b7c45
+Create Date: 2026-10-19 22:14:37.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a2c5e7f1b36'
+down_revision = '6e1a9d3b7c45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ShardMap',
+    sa.Column('state', sa.String(length=120), nullable=False),
+    sa.Column('shard', sa.String(length=50), nullable=False),
+    sa.Column('moving', sa.Boolean(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('state')
+    )
+    op.create_table('ShardSequence',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('next_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('VenueShard',
+    sa.Column('venue_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('state', sa.String(length=120), nullable=True),
+    sa.PrimaryKeyConstraint('venue_id')
+    )
+    op.create_index(op.f('ix_VenueShard_state'), 'VenueShard', ['state'], unique=False)
+    # every existing venue is on the primary database
+    op.execute('INSERT INTO "VenueShard" (venue_id, state) SELECT id, state FROM "Venue"')
+
+
+def downgrade():
+    op.drop_index(op.f('ix_VenueShard_state'), table_name='VenueShard')
+    op.drop_table('VenueShard')
+    op.drop_table('ShardSequence')
+    op.drop_table('ShardMap')
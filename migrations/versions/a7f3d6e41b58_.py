@@ -0,0 +1,37 @@
+"""add job queue table
+
+Revision ID: a7f3d6e41b58
+Revises: 8c4e2b9d0f13
+Create Date: 2026-10-19 11:40:05.622931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7f3d6e41b58'
+down_revision = '8c4e2b9d0f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(length=500), nullable=True),
+    sa.Column('run_after', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_Job_status_run_after', 'Job', ['status', 'run_after'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Job_status_run_after', table_name='Job')
+    op.drop_table('Job')
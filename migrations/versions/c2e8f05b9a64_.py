@@ -0,0 +1,54 @@
+"""add show archive table
+
+Revision ID: c2e8f05b9a64
+Revises: a7f3d6e41b58
+Create Date: 2026-10-19 12:55:31.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e8f05b9a64'
+down_revision = 'a7f3d6e41b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # declarative range partitioning on start_time; yearly partitions are
+        # added by the archive job, the default partition catches the rest
+        op.execute('''
+            CREATE TABLE "ShowArchive" (
+                id INTEGER NOT NULL,
+                start_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                artist_id INTEGER NOT NULL REFERENCES "Artist" (id),
+                venue_id INTEGER NOT NULL REFERENCES "Venue" (id),
+                archived_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                PRIMARY KEY (id, start_time)
+            ) PARTITION BY RANGE (start_time)
+        ''')
+        op.execute('CREATE TABLE "ShowArchive_default" PARTITION OF "ShowArchive" DEFAULT')
+    else:
+        op.create_table('ShowArchive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('start_time', sa.DateTime(), nullable=False),
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ),
+        sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ),
+        sa.PrimaryKeyConstraint('id', 'start_time')
+        )
+    op.create_index(op.f('ix_ShowArchive_artist_id'), 'ShowArchive', ['artist_id'], unique=False)
+    op.create_index(op.f('ix_ShowArchive_venue_id'), 'ShowArchive', ['venue_id'], unique=False)
+    op.create_index(op.f('ix_Show_start_time'), 'Show', ['start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Show_start_time'), table_name='Show')
+    op.drop_index(op.f('ix_ShowArchive_venue_id'), table_name='ShowArchive')
+    op.drop_index(op.f('ix_ShowArchive_artist_id'), table_name='ShowArchive')
+    op.drop_table('ShowArchive')
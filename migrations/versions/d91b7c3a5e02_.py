@@ -0,0 +1,60 @@
+"""cascade deletes from venues and artists at the database level
+
+Revision ID: d91b7c3a5e02
+Revises: c2e8f05b9a64
+Create Date: 2026-10-19 14:08:52.371640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd91b7c3a5e02'
+down_revision = 'c2e8f05b9a64'
+branch_labels = None
+depends_on = None
+
+
+# (table, column, referenced table) for every foreign key to Venue/Artist
+FOREIGN_KEYS = [
+    ('Show', 'artist_id', 'Artist'),
+    ('Show', 'venue_id', 'Venue'),
+    ('ShowArchive', 'artist_id', 'Artist'),
+    ('ShowArchive', 'venue_id', 'Venue'),
+    ('Match', 'artist_id', 'Artist'),
+    ('Match', 'venue_id', 'Venue'),
+]
+
+# names the unnamed constraints SQLite reflects like PostgreSQL does
+NAMING_CONVENTION = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+
+def replace_foreign_keys(ondelete):
+    if op.get_bind().dialect.name == 'postgresql':
+        for table, column, referent in FOREIGN_KEYS:
+            name = '%s_%s_fkey' % (table, column)
+            op.drop_constraint(name, table, type_='foreignkey')
+            op.create_foreign_key(name, table, referent, [column], ['id'], ondelete=ondelete)
+        return
+    # SQLite cannot alter constraints, so batch mode rebuilds each table
+    for table in sorted({table for table, column, referent in FOREIGN_KEYS}):
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            for fk_table, column, referent in FOREIGN_KEYS:
+                if fk_table == table:
+                    name = '%s_%s_fkey' % (table, column)
+                    batch_op.drop_constraint(name, type_='foreignkey')
+                    batch_op.create_foreign_key(name, referent, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    replace_foreign_keys('CASCADE')
+    # the cascades look rows up by these columns
+    op.create_index(op.f('ix_Show_artist_id'), 'Show', ['artist_id'], unique=False)
+    op.create_index(op.f('ix_Show_venue_id'), 'Show', ['venue_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Show_venue_id'), table_name='Show')
+    op.drop_index(op.f('ix_Show_artist_id'), table_name='Show')
+    replace_foreign_keys(None)
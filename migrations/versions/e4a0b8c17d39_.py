@@ -0,0 +1,26 @@
+"""add version columns for optimistic concurrency
+
+Revision ID: e4a0b8c17d39
+Revises: d91b7c3a5e02
+Create Date: 2026-10-19 15:21:09.455803
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a0b8c17d39'
+down_revision = 'd91b7c3a5e02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Artist', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('Venue', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('Venue', 'version')
+    op.drop_column('Artist', 'version')
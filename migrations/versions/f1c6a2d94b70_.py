@@ -0,0 +1,39 @@
+"""index shows for discovery search
+
+Revision ID: f1c6a2d94b70
+Revises: e4a0b8c17d39
+Create Date: 2026-10-19 16:47:26.019384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c6a2d94b70'
+down_revision = 'e4a0b8c17d39'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+    op.create_index('ix_Show_venue_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_artist_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_Venue_state_city', 'Venue', ['state', 'city'], unique=False)
+    # the composites above lead with these columns
+    op.drop_index('ix_Show_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_id', table_name='Show')
+    op.drop_index('ix_Show_artist_id', table_name='Show')
+    op.drop_index('ix_Venue_state', table_name='Venue')
+
+
+def downgrade():
+    op.create_index('ix_Venue_state', 'Venue', ['state'], unique=False)
+    op.create_index('ix_Show_artist_id', 'Show', ['artist_id'], unique=False)
+    op.create_index('ix_Show_venue_id', 'Show', ['venue_id'], unique=False)
+    op.create_index('ix_Show_start_time', 'Show', ['start_time'], unique=False)
+    op.drop_index('ix_Venue_state_city', table_name='Venue')
+    op.drop_index('ix_Show_artist_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_start_time', table_name='Show')
+    op.drop_index('ix_Show_start_time_id', table_name='Show')
@@ -0,0 +1,122 @@
+"""Static snapshots of the catalogue pages.
+
+'flask prerender --full' renders /venues, /artists, /shows and every venue
+and artist page into a directory that a plain file server or CDN can serve
+(each page is written to <path>/index.html). Without --full only the pages
+recorded in StalePage by the write handlers are rebuilt, and pages of
+deleted records are removed. Rendering is spread over a process pool, with
+each process running the real app through its test client.
+"""
+
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+_client = None
+_out = None
+
+
+def output_file(out, path):
+    return os.path.join(out, path.strip('/'), 'index.html')
+
+
+def all_paths():
+    from app import db, shards, Venue, Artist
+
+    paths = ['/venues', '/artists', '/shows']
+    venue_ids = shards.select(db.session.query(Venue.id), owner=Venue.state)
+    paths += ['/venues/%d' % id for id in sorted(id for (id,) in venue_ids)]
+    paths += ['/artists/%d' % id for (id,) in db.session.query(Artist.id).order_by(Artist.id)]
+    return paths
+
+
+def init_worker(out):
+    global _client, _out
+    from app import app, db, request_logging, shards
+
+    # never reuse database connections inherited from the parent process
+    with app.app_context():
+        db.engine.dispose()
+        shards.after_fork()
+    # nor the log writer thread, which does not survive the fork
+    request_logging.after_fork()
+    _client = app.test_client()
+    _out = out
+
+
+def render(paths):
+    rendered, removed, failed = [], [], []
+    for path in paths:
+        try:
+            response = _client.get(path)
+        except Exception:
+            # a page that raises is left stale for the next run
+            logging.getLogger('fyyur.prerender').exception('Pre-rendering %s failed', path)
+            failed.append(path)
+            continue
+        target = output_file(_out, path)
+        if response.status_code == 200:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # write then rename so a file server never sees half a page
+            with open(target + '.tmp', 'wb') as f:
+                f.write(response.get_data())
+            os.replace(target + '.tmp', target)
+            rendered.append(path)
+        elif response.status_code == 404:
+            if os.path.exists(target):
+                os.remove(target)
+            removed.append(path)
+        else:
+            failed.append(path)
+    return rendered, removed, failed
+
+
+def build(out, full=False, workers=None, chunk_size=200):
+    from app import app, db, shards, StalePage
+
+    started = time.time()
+    snapshot = datetime.now()
+    if full:
+        paths = all_paths()
+        shutil.copytree(app.static_folder, os.path.join(out, 'static'), dirs_exist_ok=True)
+    else:
+        paths = [path for (path,) in db.session.query(StalePage.path).filter(StalePage.marked_at <= snapshot)]
+    db.session.remove()
+    shards.remove()
+    db.engine.dispose()
+
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    rendered, removed, failed = [], [], []
+    if workers == 1:
+        init_worker(out)
+        results = map(render, chunks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(out,))
+        results = pool.map(render, chunks)
+    for done, gone, errors in results:
+        rendered += done
+        removed += gone
+        failed += errors
+    if workers != 1:
+        pool.shutdown()
+
+    # Clear only marks that existed before the build started; anything marked
+    # while rendering is picked up by the next run. Failed pages stay marked.
+    finished = rendered + removed
+    stale = db.session.query(StalePage).filter(StalePage.marked_at <= snapshot)
+    if not full:
+        for i in range(0, len(finished), 500):
+            stale.filter(StalePage.path.in_(finished[i:i + 500])).delete(synchronize_session=False)
+    else:
+        stale.filter(~StalePage.path.in_(failed)).delete(synchronize_session=False)
+    db.session.commit()
+
+    return {
+        'rendered': len(rendered),
+        'removed': len(removed),
+        'failed': len(failed),
+        'seconds': time.time() - started,
+    }
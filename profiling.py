@@ -0,0 +1,101 @@
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from flask import g, request
+
+
+class RequestProfiler(object):
+    """Opt-in cProfile capture of whole requests: view, template rendering
+    and database calls.
+
+    A request is profiled when it carries PROFILE_HEADER with a value equal to
+    PROFILE_TOKEN, or at random with probability PROFILE_SAMPLE_RATE. Each
+    capture is written to PROFILE_DIR/<endpoint>/ and only the newest
+    PROFILE_KEEP captures per endpoint are kept. Only one request is profiled
+    at a time so sampling never stacks profilers under load.
+    """
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = os.path.join(app.root_path, app.config.get('PROFILE_DIR', 'profiles'))
+        self.token = app.config.get('PROFILE_TOKEN')
+        self.header = app.config.get('PROFILE_HEADER', 'X-Profile')
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+        self.keep = app.config.get('PROFILE_KEEP', 50)
+        app.before_request(self.start)
+        app.after_request(self.stop)
+        app.teardown_request(self.abandon)
+
+    def wanted(self):
+        value = request.headers.get(self.header)
+        if value and self.token and hmac.compare_digest(value, self.token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        if not self.wanted() or not self.lock.acquire(blocking=False):
+            return
+        g._profile = cProfile.Profile()
+        g._profile_started = time.time()
+        g._profile.enable()
+
+    def stop(self, response):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return response
+        profile.disable()
+        try:
+            path = self.save(profile, request.endpoint or 'unknown')
+            response.headers['X-Profile-Capture'] = os.path.relpath(path, self.directory)
+        finally:
+            self.lock.release()
+        return response
+
+    def abandon(self, exc):
+        # the view raised, so after_request never ran
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            profile.disable()
+            self.lock.release()
+
+    def save(self, profile, endpoint):
+        folder = os.path.join(self.directory, re.sub(r'[^\w.-]', '_', endpoint))
+        os.makedirs(folder, exist_ok=True)
+        name = '%s-%06d-%d.prof' % (time.strftime('%Y%m%dT%H%M%S'), int(time.time() * 1e6) % 1000000, os.getpid())
+        path = os.path.join(folder, name)
+        profile.dump_stats(path)
+
+        captures = sorted(f for f in os.listdir(folder) if f.endswith('.prof'))
+        for old in captures[:-self.keep]:
+            os.remove(os.path.join(folder, old))
+        return path
+
+    def report(self, endpoint=None, top=20, sort='cumulative'):
+        """Aggregate the captures of each endpoint into one pstats listing."""
+        out = io.StringIO()
+        if not os.path.isdir(self.directory):
+            return 'No captures in %s\n' % self.directory
+        for folder in sorted(os.listdir(self.directory)):
+            if endpoint and folder != endpoint:
+                continue
+            files = [os.path.join(self.directory, folder, f)
+                     for f in sorted(os.listdir(os.path.join(self.directory, folder))) if f.endswith('.prof')]
+            if not files:
+                continue
+            stats = pstats.Stats(*files, stream=out)
+            out.write('=' * 78 + '\n')
+            out.write('%s: %d captures, %.3fs total, %.1fms per request\n' % (
+                folder, len(files), stats.total_tt, stats.total_tt * 1000 / len(files)))
+            stats.strip_dirs().sort_stats(sort).print_stats(top)
+        return out.getvalue()
@@ -0,0 +1,147 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line. Anything passed as extra={'fields': {...}}
+    is merged into the record."""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the background writer without ever blocking; when
+    the queue is full the record is dropped and counted instead."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # format the exception here, the traceback cannot cross threads safely
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+class NameFilter(logging.Filter):
+
+    def __init__(self, include=None, exclude=()):
+        self.include = include
+        self.exclude = exclude
+
+    def filter(self, record):
+        if self.include and not record.name.startswith(self.include):
+            return False
+        return not any(record.name.startswith(name) for name in self.exclude)
+
+
+class RequestLogging(object):
+    """Structured, non-blocking logging for the app.
+
+    Request threads only put records on a bounded queue; a QueueListener
+    thread writes them to LOG_FILE (application errors), REQUEST_LOG_FILE
+    (one record per request with endpoint, status, latency and query count)
+    and SLOW_REQUEST_LOG_FILE (requests over SLOW_REQUEST_MS or
+    SLOW_REQUEST_QUERIES).
+    """
+
+    def __init__(self, app=None):
+        self.listener = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.slow_ms = app.config.get('SLOW_REQUEST_MS', 500)
+        self.slow_queries = app.config.get('SLOW_REQUEST_QUERIES', 50)
+        self.requests = logging.getLogger('fyyur.requests')
+        self.slow = logging.getLogger('fyyur.slow')
+
+        def file_handler(setting, default):
+            path = os.path.join(app.root_path, app.config.get(setting, default))
+            handler = RotatingFileHandler(path, maxBytes=app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+                                          backupCount=app.config.get('LOG_BACKUPS', 5))
+            handler.setFormatter(JSONFormatter())
+            return handler
+
+        errors = file_handler('LOG_FILE', 'error.log')
+        errors.addFilter(NameFilter(exclude=('fyyur.requests', 'fyyur.slow')))
+        access = file_handler('REQUEST_LOG_FILE', 'requests.log')
+        access.addFilter(NameFilter(include='fyyur.requests'))
+        slow = file_handler('SLOW_REQUEST_LOG_FILE', 'slow.log')
+        slow.addFilter(NameFilter(include='fyyur.slow'))
+
+        records = queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000))
+        self.listener = QueueListener(records, errors, access, slow)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+        for logger in (app.logger, self.requests, self.slow):
+            logger.addHandler(DroppingQueueHandler(records))
+            logger.setLevel(logging.INFO)
+            logger.propagate = logger is app.logger
+
+        event.listen(Engine, 'before_cursor_execute', self.count_query)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def after_fork(self):
+        # threads do not survive fork(); give the child its own writer
+        # (a spawned process has already started one on import)
+        thread = getattr(self.listener, '_thread', None)
+        if self.listener is not None and not (thread is not None and thread.is_alive()):
+            self.listener = QueueListener(self.listener.queue, *self.listener.handlers)
+            self.listener.start()
+            atexit.register(self.listener.stop)
+
+    def count_query(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g._log_queries = g.get('_log_queries', 0) + 1
+
+    def start(self):
+        g._log_started = time.perf_counter()
+        g._log_queries = 0
+
+    def finish(self, response):
+        latency = (time.perf_counter() - g.pop('_log_started', time.perf_counter())) * 1000
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'latency_ms': round(latency, 2),
+            'queries': g.get('_log_queries', 0),
+        }
+        self.requests.info('request', extra={'fields': fields})
+        if latency >= self.slow_ms or fields['queries'] >= self.slow_queries:
+            self.slow.warning('slow request', extra={'fields': fields})
+        return response
+
+    def metrics(self):
+        return {'dropped': DroppingQueueHandler.dropped}
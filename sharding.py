@@ -0,0 +1,245 @@
+import heapq
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import false, or_, orm
+from sqlalchemy.exc import IntegrityError
+
+PRIMARY = 'default'
+
+
+class ShardMoving(Exception):
+    """Raised on a write to a state that is being moved to another shard."""
+
+
+class ShardQuery(namedtuple('ShardQuery', 'query shards key owner')):
+    """A query step (see app.run_queries) to run on the given shards.
+
+    Rows from several shards are merged in `key` order when one is given,
+    or simply concatenated. With `owner`, a state column, each shard only
+    returns rows of the states assigned to it, so a state that is half
+    copied to another shard is never listed twice.
+    """
+
+
+def merge_rows(results, key=None):
+    if len(results) == 1:
+        return list(results[0])
+    if key is None:
+        return [row for rows in results for row in rows]
+    return list(heapq.merge(*results, key=key))
+
+
+class ShardRouter(object):
+    """Routes venues, their shows and matches to database binds by state.
+
+    SHARDS names binds from SQLALCHEMY_BINDS that hold catalogue shards; the
+    primary database is the PRIMARY shard and keeps every other table. A
+    state lives on the shard it is assigned to in the ShardMap table (see
+    'flask move-state'), or else on SHARD_DEFAULT. Assignments are re-read
+    every SHARD_MAP_SECONDS, so a change reaches every process within that
+    time. With no SHARDS everything is on the primary and every call below
+    comes down to db.session.
+
+    Venue and show ids are handed out from ShardSequence, SHARD_ID_BLOCK at
+    a time per process, so that they stay unique across shards.
+    """
+
+    def __init__(self, app=None, db=None, map_model=None, sequence_model=None):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.sessions = {}
+        self.blocks = {}
+        self.assigned = None
+        self.loaded = 0
+        if app is not None:
+            self.init_app(app, db, map_model, sequence_model)
+
+    def init_app(self, app, db, map_model, sequence_model):
+        self.app = app
+        self.db = db
+        self.map_model = map_model
+        self.sequence_model = sequence_model
+        self.names = [PRIMARY] + [name for name in app.config.get('SHARDS', []) if name != PRIMARY]
+        self.enabled = len(self.names) > 1
+        self.default = app.config.get('SHARD_DEFAULT', PRIMARY)
+        self.map_seconds = app.config.get('SHARD_MAP_SECONDS', 5)
+        self.block_size = app.config.get('SHARD_ID_BLOCK', 100)
+        self.workers = app.config.get('SHARD_WORKERS', 8)
+        self.executor = None
+        if self.enabled:
+            self.executor = ThreadPoolExecutor(self.workers, 'fyyur-shard')
+        self.stats = dict(routed=0, scattered=0, writes_refused=0)
+        app.teardown_appcontext(self.remove)
+
+    def engine(self, name):
+        return self.db.get_engine(self.app, bind=None if name == PRIMARY else name)
+
+    def session(self, name):
+        if name == PRIMARY:
+            return self.db.session
+        with self.lock:
+            if name not in self.sessions:
+                self.sessions[name] = orm.scoped_session(orm.sessionmaker(bind=self.engine(name)))
+        self.used().add(name)
+        return self.sessions[name]
+
+    def used(self):
+        if not hasattr(self.local, 'used'):
+            self.local.used = set()
+        return self.local.used
+
+    # Shard sessions opened by this thread are finished together with
+    # db.session. Shards commit first: what the primary records about a
+    # write (directory, stats deltas, stale pages) can be rebuilt if its
+    # own commit then fails.
+
+    def commit(self):
+        for name in sorted(self.used()):
+            self.sessions[name].commit()
+        self.db.session.commit()
+
+    def rollback(self):
+        for name in self.used():
+            self.sessions[name].rollback()
+        self.db.session.rollback()
+
+    def close(self):
+        for name in self.used():
+            self.sessions[name].close()
+        self.db.session.close()
+
+    def remove(self, exc=None):
+        for name in self.used():
+            self.sessions[name].remove()
+        self.used().clear()
+
+    def after_fork(self):
+        # pooled connections, reserved id blocks and the scatter threads of
+        # the parent must not be shared
+        self.blocks = {}
+        self.sessions = {}
+        self.local = threading.local()
+        if self.enabled:
+            self.executor = ThreadPoolExecutor(self.workers, 'fyyur-shard')
+        for name in self.names[1:]:
+            self.engine(name).dispose()
+
+    def assignments(self):
+        # {state: (shard, moving)}, cached for SHARD_MAP_SECONDS
+        if not self.enabled:
+            return {}
+        if self.assigned is not None and time.monotonic() - self.loaded < self.map_seconds:
+            return self.assigned
+        table = self.map_model.__table__
+        with self.engine(PRIMARY).connect() as connection:
+            rows = connection.execute(table.select()).fetchall()
+        self.assigned = {row.state: (row.shard, bool(row.moving)) for row in rows}
+        self.loaded = time.monotonic()
+        return self.assigned
+
+    def refresh(self):
+        self.assigned = None
+
+    def for_state(self, state):
+        if not self.enabled:
+            return PRIMARY
+        return self.assignments().get(state, (self.default, False))[0]
+
+    def check_writable(self, state):
+        if self.assignments().get(state, (None, False))[1]:
+            self.stats['writes_refused'] += 1
+            raise ShardMoving(f'{state} is being moved to another shard, try again shortly')
+
+    def owned(self, name, column):
+        # the condition that limits `column` to the states on shard `name`
+        assigned = self.assignments()
+        if name == self.default:
+            elsewhere = [state for state, (shard, moving) in assigned.items() if shard != name]
+            return or_(column.is_(None), column.notin_(elsewhere)) if elsewhere else None
+        states = [state for state, (shard, moving) in assigned.items() if shard == name]
+        return column.in_(states) if states else false()
+
+    def on(self, name, query):
+        return ShardQuery(query, (name,), None, None)
+
+    def everywhere(self, query, key=None, owner=None):
+        return ShardQuery(query, tuple(self.names), key, owner)
+
+    def statement(self, step, name):
+        statement = step.query.statement
+        if step.owner is not None and len(step.shards) > 1:
+            condition = self.owned(name, step.owner)
+            if condition is not None:
+                statement = statement.where(condition)
+        return statement
+
+    def fetch(self, step, name):
+        with self.engine(name).connect() as connection:
+            return connection.execute(self.statement(step, name)).fetchall()
+
+    def execute(self, step):
+        """Rows of a ShardQuery, querying several shards in parallel. Each
+        shard is read on its own connection, outside this thread's sessions."""
+        if len(step.shards) == 1:
+            self.stats['routed'] += 1
+            return self.session(step.shards[0]).execute(step.query.statement).fetchall()
+        self.stats['scattered'] += 1
+        futures = [self.executor.submit(self.fetch, step, name) for name in step.shards]
+        return merge_rows([future.result() for future in futures], step.key)
+
+    def select(self, query, name=None, owner=None):
+        """Rows of a query from one shard, or from every shard in turn, read
+        through this thread's sessions so its own pending writes are seen."""
+        step = ShardQuery(query, (name,) if name is not None else tuple(self.names), None, owner)
+        return [row for name in step.shards
+                for row in self.session(name).execute(self.statement(step, name))]
+
+    def next_id(self, model):
+        """A cluster-wide unique id for a new row of a sharded model, or None
+        when sharding is off and the database assigns ids as usual."""
+        if not self.enabled:
+            return None
+        name = model.__tablename__
+        with self.lock:
+            first, end = self.blocks.get(name, (0, 0))
+            if first >= end:
+                first, end = self.reserve(model, self.block_size)
+            self.blocks[name] = (first + 1, end)
+            return first
+
+    def reserve(self, model, count):
+        """Reserves `count` consecutive ids, returned as (first, end)."""
+        table = self.sequence_model.__table__
+        name = model.__tablename__
+        for attempt in range(3):
+            try:
+                # a short transaction of its own, so the row lock is not held
+                # for the rest of the request; ids of rolled back writes are
+                # simply skipped
+                with self.engine(PRIMARY).begin() as connection:
+                    row = connection.execute(table.select().where(table.c.name == name).with_for_update()).first()
+                    if row is None:
+                        first = 1 + max(self.fetch(self.everywhere(
+                            self.db.session.query(self.db.func.max(model.id))), shard)[0][0] or 0
+                            for shard in self.names)
+                        connection.execute(table.insert().values(name=name, next_id=first + count))
+                    else:
+                        first = row.next_id
+                        connection.execute(table.update().where(table.c.name == name)
+                                           .values(next_id=first + count))
+                return first, first + count
+            except IntegrityError:
+                # another process created the sequence at the same moment
+                continue
+        raise RuntimeError(f'could not reserve {name} ids')
+
+    def metrics(self):
+        assigned = self.assignments()
+        data = dict(self.stats)
+        data['shards'] = self.names
+        data['states'] = {state: shard for state, (shard, moving) in sorted(assigned.items())}
+        data['moving'] = sorted(state for state, (shard, moving) in assigned.items() if moving)
+        return data
@@ -0,0 +1,288 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import has_app_context
+
+
+class QueueFull(Exception):
+    pass
+
+
+class TaskQueue(object):
+    """Defers follow-up work (cache invalidation, rollups, index updates)
+    out of the request. Tasks are plain functions registered with @task and
+    called with JSON-serialisable arguments.
+
+    The backend is chosen with the TASK_BACKEND setting:
+
+    * 'thread'   - bounded in-memory queue drained by a pool of threads (default)
+    * 'database' - durable Job table drained by 'flask run-jobs' workers
+    * 'inline'   - run immediately in the calling thread (tests, scripts)
+    """
+
+    def __init__(self, app=None, db=None, job_model=None):
+        self.registry = {}
+        self.backend = None
+        self.db = None
+        if app is not None:
+            self.init_app(app, db, job_model)
+
+    def init_app(self, app, db=None, job_model=None):
+        self.app = app
+        self.db = db
+        self.on_full = app.config.get('TASK_ON_FULL', 'inline')
+        name = app.config.get('TASK_BACKEND', 'thread')
+        options = dict(
+            max_retries=app.config.get('TASK_MAX_RETRIES', 3),
+            retry_delay=app.config.get('TASK_RETRY_DELAY', 1.0),
+            queue_size=app.config.get('TASK_QUEUE_SIZE', 1000),
+        )
+        if name == 'thread':
+            self.backend = ThreadPoolBackend(
+                self, workers=app.config.get('TASK_WORKERS', 2),
+                put_timeout=app.config.get('TASK_PUT_TIMEOUT', 0.05), **options)
+        elif name == 'database':
+            self.backend = DatabaseBackend(self, db, job_model,
+                                           lease=app.config.get('TASK_LEASE_SECONDS', 300), **options)
+        elif name == 'inline':
+            self.backend = InlineBackend(self, **options)
+        else:
+            raise ValueError('Unknown TASK_BACKEND %r' % name)
+
+    def task(self, fn):
+        self.registry[fn.__name__] = fn
+        return fn
+
+    def enqueue(self, fn, **kwargs):
+        name = fn if isinstance(fn, str) else fn.__name__
+        if name not in self.registry:
+            raise KeyError('Task %r is not registered' % name)
+        try:
+            self.backend.submit(name, kwargs)
+        except QueueFull:
+            # backpressure: either push the cost back onto the caller by
+            # running the task here, or let the caller decide
+            if self.on_full != 'inline':
+                raise
+            self.backend.stats['inline_fallbacks'] += 1
+            try:
+                self.run(name, kwargs)
+            except Exception:
+                # the caller's own write has already committed
+                self.app.logger.exception('Task %s failed (run inline, queue full)', name)
+                self.backend.stats['failed'] += 1
+
+    def run(self, name, kwargs):
+        if not has_app_context():
+            with self.app.app_context():
+                return self.run(name, kwargs)
+        try:
+            return self.registry[name](**kwargs)
+        except Exception:
+            if self.db is not None:
+                self.db.session.rollback()
+            raise
+
+    def metrics(self):
+        data = dict(self.backend.stats)
+        data['backend'] = self.backend.name
+        data['depth'] = self.backend.depth()
+        return data
+
+
+class Backend(object):
+    name = None
+
+    def __init__(self, tasks, max_retries=3, retry_delay=1.0, queue_size=1000):
+        self.tasks = tasks
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue_size = queue_size
+        self.stats = dict(submitted=0, completed=0, failed=0, retried=0,
+                          rejected=0, inline_fallbacks=0)
+
+    def backoff(self, attempt):
+        return self.retry_delay * (2 ** attempt)
+
+    def depth(self):
+        return 0
+
+
+class InlineBackend(Backend):
+    name = 'inline'
+
+    def submit(self, name, kwargs):
+        self.stats['submitted'] += 1
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.tasks.run(name, kwargs)
+                self.stats['completed'] += 1
+                return
+            except Exception:
+                self.tasks.app.logger.exception('Task %s failed', name)
+                if attempt < self.max_retries:
+                    self.stats['retried'] += 1
+        self.stats['failed'] += 1
+
+
+class ThreadPoolBackend(Backend):
+    name = 'thread'
+
+    def __init__(self, tasks, workers=2, put_timeout=0.05, **options):
+        super(ThreadPoolBackend, self).__init__(tasks, **options)
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.lock = threading.Lock()
+        self.threads = []
+        self.pid = None
+
+    def start(self):
+        # Threads are started lazily so that a preloaded master process never
+        # owns them; each forked worker starts its own pool on first use.
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.work, name='fyyur-task-%d' % i)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, name, kwargs, attempt=0):
+        self.start()
+        try:
+            self.queue.put((name, kwargs, attempt), timeout=self.put_timeout)
+        except queue.Full:
+            self.stats['rejected'] += 1
+            raise QueueFull(name)
+        if attempt == 0:
+            self.stats['submitted'] += 1
+
+    def retry(self, name, kwargs, attempt):
+        try:
+            self.queue.put_nowait((name, kwargs, attempt))
+        except queue.Full:
+            self.stats['failed'] += 1
+
+    def work(self):
+        while True:
+            name, kwargs, attempt = self.queue.get()
+            try:
+                self.tasks.run(name, kwargs)
+                self.stats['completed'] += 1
+            except Exception:
+                self.tasks.app.logger.exception('Task %s failed (attempt %d)', name, attempt + 1)
+                if attempt < self.max_retries:
+                    self.stats['retried'] += 1
+                    timer = threading.Timer(self.backoff(attempt), self.retry, (name, kwargs, attempt + 1))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    self.stats['failed'] += 1
+            finally:
+                self.queue.task_done()
+
+    def depth(self):
+        return self.queue.qsize()
+
+
+class DatabaseBackend(Backend):
+    name = 'database'
+
+    def __init__(self, tasks, db, job_model, lease=300, **options):
+        super(DatabaseBackend, self).__init__(tasks, **options)
+        if db is None or job_model is None:
+            raise ValueError('The database task backend needs db and job_model')
+        self.db = db
+        self.Job = job_model
+        self.lease = lease
+        self.stats['reclaimed'] = 0
+
+    def submit(self, name, kwargs):
+        # Jobs are written on their own connection so enqueueing never
+        # commits, or is rolled back with, the caller's session.
+        table = self.Job.__table__
+        with self.db.engine.begin() as connection:
+            if self.queue_size:
+                queued = connection.execute(
+                    self.db.select([self.db.func.count()]).select_from(table)
+                    .where(table.c.status == 'queued')).scalar()
+                if queued >= self.queue_size:
+                    self.stats['rejected'] += 1
+                    raise QueueFull(name)
+            connection.execute(table.insert().values(
+                name=name, payload=json.dumps(kwargs), status='queued', attempts=0,
+                run_after=datetime.now(), created_at=datetime.now()))
+        self.stats['submitted'] += 1
+
+    def claim(self):
+        # A running job whose lease (TASK_LEASE_SECONDS) ran out belongs to a
+        # worker that died, and is taken over as another attempt.
+        session = self.db.session
+        Job = self.Job
+        now = datetime.now()
+        while True:
+            job = session.query(Job) \
+                .filter(self.db.or_(
+                    self.db.and_(Job.status == 'queued', Job.run_after <= now),
+                    self.db.and_(Job.status == 'running', Job.claimed_at < now - timedelta(seconds=self.lease)))) \
+                .order_by(Job.id) \
+                .with_for_update(skip_locked=True) \
+                .first()
+            if job is None or job.status == 'queued' or job.attempts <= self.max_retries:
+                break
+            job.status = 'failed'
+            job.last_error = 'worker lost (lease expired)'
+            self.stats['failed'] += 1
+            session.commit()
+        if job is not None:
+            if job.status == 'running':
+                self.tasks.app.logger.warning('Job %s (%s) reclaimed after its lease expired', job.id, job.name)
+                self.stats['reclaimed'] += 1
+            job.status = 'running'
+            job.attempts += 1
+            job.claimed_at = now
+        session.commit()
+        return job
+
+    def run_once(self):
+        job = self.claim()
+        if job is None:
+            return False
+        job_id, name, kwargs, attempts = job.id, job.name, json.loads(job.payload), job.attempts
+        session = self.db.session
+        try:
+            self.tasks.run(name, kwargs)
+        except Exception as e:
+            self.tasks.app.logger.exception('Job %s (%s) failed', job_id, name)
+            job = session.query(self.Job).get(job_id)
+            job.last_error = str(e)[:500]
+            if attempts <= self.max_retries:
+                job.status = 'queued'
+                job.run_after = datetime.now() + timedelta(seconds=self.backoff(attempts - 1))
+                self.stats['retried'] += 1
+            else:
+                job.status = 'failed'
+                self.stats['failed'] += 1
+        else:
+            session.query(self.Job).filter(self.Job.id == job_id).delete(synchronize_session=False)
+            self.stats['completed'] += 1
+        session.commit()
+        return True
+
+    def work(self, poll_interval=1.0, burst=False):
+        while True:
+            if not self.run_once():
+                if burst:
+                    return
+                time.sleep(poll_interval)
+
+    def depth(self):
+        return self.db.session.query(self.Job).filter(self.Job.status == 'queued').count()
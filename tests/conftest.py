@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app configures itself on import, so the test settings go in first:
+# a scratch SQLite database, logs outside the tree and follow-up tasks run
+# in the request.
+SCRATCH = tempfile.mkdtemp(prefix='fyyur-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(SCRATCH, 'fyyur.db')
+
+import config
+
+config.TASK_BACKEND = 'inline'
+config.ADMISSION_ENABLED = False
+config.LOG_FILE = os.path.join(SCRATCH, 'error.log')
+config.REQUEST_LOG_FILE = os.path.join(SCRATCH, 'requests.log')
+config.SLOW_REQUEST_LOG_FILE = os.path.join(SCRATCH, 'slow.log')
+
+import app as fyyur
+
+
+@pytest.fixture
+def app():
+    fyyur.app.config['TESTING'] = True
+    with fyyur.app.app_context():
+        fyyur.db.drop_all()
+        fyyur.db.create_all()
+    fyyur.cache.clear()
+    yield fyyur.app
+    with fyyur.app.app_context():
+        fyyur.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        yield fyyur.db
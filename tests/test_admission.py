@@ -0,0 +1,31 @@
+from flask import Flask
+
+from admission import AdmissionControl
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config.update(ADMISSION_LIMITS={'search': {'rate': 0.001, 'burst': 2}}, **config)
+    app.add_url_rule('/search', 'search', lambda: 'ok')
+    AdmissionControl(app)
+    return app.test_client()
+
+
+def statuses(client, count, **kwargs):
+    return [client.get('/search', **kwargs).status_code for _ in range(count)]
+
+
+def test_clients_past_their_rate_get_429():
+    assert statuses(make_app(), 4) == [200, 200, 429, 429]
+
+
+def test_exempt_clients_are_not_rate_limited():
+    client = make_app(ADMISSION_EXEMPT=['127.0.0.1'])
+    assert statuses(client, 4) == [200] * 4
+    assert statuses(client, 3, environ_base={'REMOTE_ADDR': '10.0.0.1'}) == [200, 200, 429]
+
+
+def test_exemption_follows_the_client_header():
+    client = make_app(ADMISSION_EXEMPT=['10.0.0.9'], ADMISSION_CLIENT_HEADER='X-Forwarded-For')
+    assert statuses(client, 3, headers={'X-Forwarded-For': '10.0.0.9, 10.0.0.1'}) == [200] * 3
+    assert statuses(client, 3) == [200, 200, 429]
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import Artist, Show, ShowArchive, Venue, archive_shows
+
+
+def test_show_committed_between_archive_and_delete_is_kept(db):
+    db.session.add_all([Venue(id=1, name='Hop', city='San Francisco', state='CA'),
+                        Artist(id=1, name='Petals', city='San Francisco', state='CA')])
+    long_ago = datetime.now() - timedelta(days=400)
+    db.session.add(Show(id=1, artist_id=1, venue_id=1, start_time=long_ago))
+    db.session.commit()
+
+    def late_commit(conn, cursor, statement, parameters, context, executemany):
+        # another transaction commits an old show right after the INSERT
+        if statement.startswith('INSERT INTO "ShowArchive"'):
+            cursor.execute('INSERT INTO "Show" (id, artist_id, venue_id, start_time, created_at, updated_at) '
+                           "VALUES (2, 1, 1, ?, ?, ?)", (str(long_ago), str(long_ago), str(long_ago)))
+
+    event.listen(db.engine, 'after_cursor_execute', late_commit)
+    try:
+        assert archive_shows() == 1
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', late_commit)
+
+    assert [show.id for show in ShowArchive.query] == [1]
+    assert [show.id for show in Show.query] == [2]
+    assert archive_shows() == 1
+    assert Show.query.count() == 0
@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime
+from urllib.parse import urlencode
+
+import pytest
+
+pytest.importorskip('sqlalchemy.ext.asyncio')
+pytest.importorskip('aiosqlite')
+
+from app import Artist, Show, Venue, events
+
+
+@pytest.fixture
+def application(app, monkeypatch):
+    # the entry point sizes the event stream cap for its own thread pool
+    monkeypatch.setattr(events, 'max_subscribers', events.max_subscribers)
+    import asgi
+    application = asgi.FyyurASGI(app)
+    yield application
+    application.executor.shutdown()
+
+
+def add_catalogue(db):
+    db.session.add_all([Venue(id=1, name='The Musical Hop', city='San Francisco', state='CA', genres='Jazz'),
+                        Artist(id=1, name='Guns N Petals', city='San Francisco', state='CA', genres='Jazz')])
+    db.session.flush()
+    db.session.add(Show(venue_id=1, artist_id=1, start_time=datetime(2030, 1, 1, 20)))
+    db.session.commit()
+
+
+async def request(application, method, path, body=b'', headers=()):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'http_version': '1.1',
+             'headers': [(name.encode(), value.encode()) for name, value in headers]}
+    messages = [{'type': 'http.request', 'body': body}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await application(scope, receive, send)
+    return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def serve(application, *requests, lifespan=True):
+    # one event loop for startup, the requests and shutdown, as under uvicorn
+    async def main():
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        if lifespan:
+            running = asyncio.ensure_future(application({'type': 'lifespan'}, inbox.get, outbox.put))
+            await inbox.put({'type': 'lifespan.startup'})
+            assert (await outbox.get())['type'] == 'lifespan.startup.complete'
+        responses = [await request(application, *args) for args in requests]
+        if lifespan:
+            await inbox.put({'type': 'lifespan.shutdown'})
+            assert (await outbox.get())['type'] == 'lifespan.shutdown.complete'
+            await running
+        return responses
+    return asyncio.run(main())
+
+
+def test_async_url_swaps_in_the_async_driver():
+    import asgi
+    assert asgi.async_url('postgresql://fyyur@localhost/fyyur') == 'postgresql+asyncpg://fyyur@localhost/fyyur'
+    assert asgi.async_url('sqlite:////tmp/fyyur.db') == 'sqlite+aiosqlite:////tmp/fyyur.db'
+
+
+def test_read_pages_are_served_as_coroutines(client, db, application):
+    add_catalogue(db)
+    awaited = []
+    run_queries = application.run_queries
+
+    def spy(steps):
+        awaited.append(steps)
+        return run_queries(steps)
+    application.run_queries = spy
+
+    responses = serve(application, ('GET', '/venues'), ('GET', '/venues/1'), ('GET', '/artists/1'),
+                      ('GET', '/venues/99'))
+    assert len(awaited) == 4
+    assert [status for status, body in responses] == [200, 200, 200, 404]
+    assert responses[0][1] == client.get('/venues').data
+    assert b'Guns N Petals' in responses[1][1]
+    assert b'The Musical Hop' in responses[2][1]
+
+
+def test_other_requests_go_through_the_wsgi_app(db, application):
+    body = urlencode({'name': 'The Musical Hop', 'city': 'San Francisco', 'state': 'CA', 'genres': 'Jazz'}).encode()
+    headers = [('content-type', 'application/x-www-form-urlencoded'), ('content-length', str(len(body)))]
+    status, page = serve(application, ('POST', '/venues/create', body, headers))[0]
+    assert status == 200
+    assert b'successfully listed' in page
+    assert Venue.query.one().name == 'The Musical Hop'
+
+
+def test_without_startup_every_request_uses_the_wsgi_app(client, db, application):
+    add_catalogue(db)
+    status, page = serve(application, ('GET', '/venues'), lifespan=False)[0]
+    assert application.engine is None
+    assert (status, page) == (200, client.get('/venues').data)
@@ -0,0 +1,74 @@
+import gzip
+import zlib
+
+from flask import Flask, Response, flash, stream_with_context
+
+from cache_control import CachePolicy
+from compression import Compression
+
+PAGE = '<p>' + 'The Musical Hop ' * 100 + '</p>'
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.config.update(dict(COMPRESS_MIN_SIZE=500, CACHE_CONTROL={'venues': 'public, s-maxage=60'}), **config)
+    app.add_url_rule('/venues', 'venues', lambda: PAGE)
+    app.add_url_rule('/tiny', 'tiny', lambda: '<p>ok</p>')
+    app.add_url_rule('/stream', 'stream', lambda: Response(stream_with_context(iter([PAGE, PAGE]))))
+    app.add_url_rule('/events', 'events', lambda: Response(iter(['data: 1\n\n']), mimetype='text/event-stream'))
+    app.add_url_rule('/flashed', 'flashed', lambda: flash('Venue listed') or PAGE)
+    app.add_url_rule('/venues', 'create', lambda: PAGE, methods=['POST'])
+    Compression(app)
+    CachePolicy(app)
+    return app.test_client()
+
+
+def test_large_bodies_are_gzipped_for_clients_that_accept_it():
+    client = make_app()
+
+    response = client.get('/venues', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data).decode() == PAGE
+
+    assert 'Content-Encoding' not in client.get('/venues').headers
+    assert 'Content-Encoding' not in client.get('/tiny', headers={'Accept-Encoding': 'gzip'}).headers
+
+
+def test_streamed_bodies_are_compressed_chunk_by_chunk():
+    client = make_app()
+
+    response = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    assert zlib.decompress(response.data, 31).decode() == PAGE * 2
+
+    response = client.get('/events', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == b'data: 1\n\n'
+
+
+def test_cache_control_follows_the_endpoint():
+    client = make_app()
+
+    response = client.get('/venues')
+    assert response.headers['Cache-Control'] == 'public, s-maxage=60'
+    assert client.get('/venues', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/tiny').headers['Cache-Control'] == 'no-cache'
+    assert 'ETag' not in client.get('/tiny').headers
+
+
+def test_writes_errors_and_flashed_pages_are_never_stored():
+    client = make_app()
+
+    assert client.post('/venues').headers['Cache-Control'] == 'no-store'
+    assert client.get('/missing').headers['Cache-Control'] == 'no-store'
+    assert client.get('/flashed').headers['Cache-Control'] == 'private, no-store'
+
+
+def test_app_pages_are_compressed_and_cached(client, db):
+    response = client.get('/venues', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'].startswith('public')
+    assert 'no-store' in client.get('/venues/create').headers['Cache-Control']
@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from app import Artist, Match, OutboxEntry, Show, ShowArchive, Venue
+
+
+def add_catalogue(db):
+    venues = [Venue(id=id, name='Venue %d' % id, city='San Francisco', state='CA') for id in (1, 2)]
+    artists = [Artist(id=id, name='Artist %d' % id, city='San Francisco', state='CA') for id in (1, 2)]
+    db.session.add_all(venues + artists)
+    db.session.flush()
+    db.session.add_all([
+        Show(id=1, venue_id=1, artist_id=1, start_time=datetime(2030, 1, 1, 20)),
+        Show(id=2, venue_id=2, artist_id=2, start_time=datetime(2030, 1, 2, 20)),
+        ShowArchive(id=3, venue_id=1, artist_id=2, start_time=datetime(2020, 1, 1, 20), archived_at=datetime(2021, 1, 1)),
+        Match(venue_id=1, artist_id=1, score=1, genre_overlap=0, same_city=True),
+        Match(venue_id=2, artist_id=2, score=1, genre_overlap=0, same_city=True),
+    ])
+    db.session.commit()
+
+
+def test_deleting_a_venue_takes_its_shows_and_matches(client, db):
+    add_catalogue(db)
+
+    response = client.post('/venues/delete', data={'ids': '1'})
+    assert response.get_json() == {'deleted': 1, 'shows': 1, 'archived_shows': 1, 'matches': 1}
+
+    db.session.expire_all()
+    assert [show.id for show in Show.query] == [2]
+    assert ShowArchive.query.count() == 0
+    assert [(match.venue_id, match.artist_id) for match in Match.query] == [(2, 2)]
+    deletes = {(entry.entity, entry.entity_id) for entry in OutboxEntry.query.filter_by(action='delete')}
+    assert deletes == {('venue', 1), ('show', 1)}
+
+
+def test_deleting_an_artist_takes_its_shows_and_matches(client, db):
+    add_catalogue(db)
+
+    response = client.post('/artists/delete', data={'ids': '2'})
+    assert response.get_json()['deleted'] == 1
+
+    db.session.expire_all()
+    assert [show.id for show in Show.query] == [1]
+    assert ShowArchive.query.count() == 0
+    assert [(match.venue_id, match.artist_id) for match in Match.query] == [(1, 1)]
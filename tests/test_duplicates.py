@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from app import Artist, Show, ShowArchive, Venue, find_duplicates, name_key
+
+
+def add_venue(db, name, city='San Francisco', state='CA'):
+    venue = Venue(name=name, name_key=name_key(name), city=city, state=state, genres='Jazz')
+    db.session.add(venue)
+    db.session.commit()
+    return venue.id
+
+
+def test_name_keys_ignore_case_order_and_articles():
+    assert name_key('The Musical Hop') == name_key('musical hop, the') == name_key('Musical  HOP') == 'hop musical'
+    assert name_key('Café Nova') == 'cafe nova'
+
+
+def test_duplicates_are_only_looked_for_in_the_same_city(db):
+    hop = add_venue(db, 'The Musical Hop')
+    add_venue(db, 'The Musical Hop', city='Austin', state='TX')
+    add_venue(db, 'Park Square Live')
+
+    assert [duplicate['id'] for duplicate in find_duplicates(Venue, 'Musical Hop', 'San Francisco', 'CA')] == [hop]
+    assert find_duplicates(Venue, 'Musical Hop', 'San Francisco', 'CA', exclude_id=hop) == []
+    assert find_duplicates(Venue, 'The Dueling Pianos', 'San Francisco', 'CA') == []
+
+
+def test_a_likely_duplicate_needs_confirming(client, db):
+    add_venue(db, 'The Musical Hop')
+    form = {'name': 'Musical Hop', 'city': 'San Francisco', 'state': 'CA', 'genres': 'Jazz'}
+
+    response = client.post('/venues/create', data=form)
+    assert response.status_code == 409
+    assert b'looks like an existing venue: The Musical Hop' in response.data
+    assert Venue.query.count() == 1
+
+    response = client.post('/venues/create', data=dict(form, allow_duplicate='1'))
+    assert b'successfully listed' in response.data
+    assert Venue.query.count() == 2
+
+
+def test_merging_moves_the_shows_and_deletes_the_duplicate(app, db):
+    canonical = add_venue(db, 'The Musical Hop')
+    duplicate = add_venue(db, 'Musical Hop')
+    artist = Artist(name='Guns N Petals', city='San Francisco', state='CA', genres='Jazz')
+    db.session.add(artist)
+    db.session.flush()
+    db.session.add_all([
+        Show(venue_id=duplicate, artist_id=artist.id, start_time=datetime(2030, 1, 1, 20)),
+        Show(venue_id=canonical, artist_id=artist.id, start_time=datetime(2030, 1, 2, 20)),
+        ShowArchive(id=3, venue_id=duplicate, artist_id=artist.id, start_time=datetime(2020, 1, 1, 20),
+                    archived_at=datetime(2021, 1, 1)),
+    ])
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['merge-venues', str(duplicate), str(canonical)])
+    assert result.exit_code == 0
+    assert result.output.strip() == 'shows moved: 1, archived_shows moved: 1'
+
+    db.session.expire_all()
+    assert [venue.id for venue in Venue.query] == [canonical]
+    assert {show.venue_id for show in Show.query} == {canonical}
+    assert Show.query.count() == 2
+    assert ShowArchive.query.one().venue_id == canonical
+
+
+def test_merging_a_record_into_itself_or_a_missing_one_fails(app, db):
+    hop = add_venue(db, 'The Musical Hop')
+    runner = app.test_cli_runner()
+
+    assert 'into itself' in runner.invoke(args=['merge-venues', str(hop), str(hop)]).output
+    assert runner.invoke(args=['merge-venues', '99', str(hop)]).exit_code == 1
+    assert Venue.query.count() == 1
@@ -0,0 +1,53 @@
+import pytest
+
+from app import Artist, Venue
+
+
+@pytest.fixture
+def venue(db):
+    venue = Venue(name='The Musical Hop', city='San Francisco', state='CA', genres='Jazz')
+    db.session.add(venue)
+    db.session.commit()
+    return venue.id
+
+
+def form(**values):
+    data = {'name': 'The Musical Hop', 'city': 'San Francisco', 'state': 'CA', 'genres': 'Jazz',
+            'address': '', 'phone': '', 'website_link': '', 'facebook_link': '', 'image_link': '',
+            'seeking_description': ''}
+    data.update(values)
+    return data
+
+
+def test_stale_version_is_a_conflict(client, db, venue):
+    assert client.post(f'/venues/{venue}/edit', data=form(name='Hop One', version=1)).status_code == 302
+    response = client.post(f'/venues/{venue}/edit', data=form(name='Hop Two', version=1))
+    assert response.status_code == 409
+    assert db.session.query(Venue.name, Venue.version).filter(Venue.id == venue).one() == ('Hop One', 2)
+
+
+@pytest.mark.parametrize('version', [None, '', 'abc'])
+def test_missing_or_invalid_version_is_refused(client, db, venue, version):
+    data = form(name='Hop Two')
+    if version is not None:
+        data['version'] = version
+    assert client.post(f'/venues/{venue}/edit', data=data).status_code == 400
+    assert db.session.query(Venue.name).filter(Venue.id == venue).scalar() == 'The Musical Hop'
+
+
+def test_blank_fields_are_not_changes(client, db, venue):
+    assert client.post(f'/venues/{venue}/edit', data=form(version=1)).status_code == 302
+    venue = Venue.query.get(venue)
+    assert venue.version == 1
+    assert venue.website_link is None
+
+
+def test_stale_artist_version_is_a_conflict(client, db):
+    artist = Artist(name='Guns N Petals', city='San Francisco', state='CA', genres='Jazz')
+    db.session.add(artist)
+    db.session.commit()
+    artist_id = artist.id
+    data = {'name': 'Petals', 'city': 'San Francisco', 'state': 'CA', 'genres': 'Jazz'}
+    assert client.post(f'/artists/{artist_id}/edit', data=dict(data, version=1)).status_code == 302
+    assert client.post(f'/artists/{artist_id}/edit', data=dict(data, name='Guns', version=1)).status_code == 409
+    assert client.post(f'/artists/{artist_id}/edit', data=data).status_code == 400
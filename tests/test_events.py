@@ -0,0 +1,104 @@
+from datetime import datetime
+import os
+import queue
+import runpy
+
+import pytest
+
+from app import Artist, Show, Venue, events
+
+
+@pytest.fixture
+def hub():
+    limit = events.max_subscribers
+    yield events
+    events.max_subscribers = limit
+    events.subscriptions.clear()
+
+
+def test_listeners_are_capped_below_the_threads(hub):
+    hub.fit_threads(16)
+    assert hub.max_subscribers == 8
+    hub.fit_threads(1)
+    assert hub.max_subscribers == 0
+
+
+def test_full_stream_sends_clients_to_poll(client, db, hub):
+    venue = Venue(name='The Musical Hop', city='San Francisco', state='CA')
+    artist = Artist(name='Guns N Petals', city='San Francisco', state='CA')
+    db.session.add_all([venue, artist])
+    db.session.flush()
+    db.session.add_all([Show(venue_id=venue.id, artist_id=artist.id, start_time=datetime(2030, 1, day, 20))
+                        for day in (1, 2, 3)])
+    db.session.commit()
+    hub.fit_threads(1)
+
+    response = client.get('/shows/stream?city=san francisco')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    poll = response.get_json()['poll']
+    assert poll.startswith('/shows/latest')
+
+    body = client.get(poll + '&after=1').get_json()
+    assert [show['id'] for show in body['data']] == [2, 3]
+    assert body['data'][0]['venue_city'] == 'San Francisco'
+    assert body['last_id'] == 3
+    assert client.get('/shows/latest?after=3').get_json() == dict(body, data=[], last_id=3)
+    assert client.get('/shows/latest?city=Austin').get_json()['data'] == []
+
+
+def test_shows_page_knows_where_polling_starts(client, db):
+    response = client.get('/shows')
+    assert b'var lastId = 0;' in response.data
+
+
+def test_failed_follow_ups_do_not_fail_a_committed_show(client, db, monkeypatch):
+    venue = Venue(name='The Musical Hop', city='San Francisco', state='CA')
+    artist = Artist(name='Guns N Petals', city='San Francisco', state='CA')
+    db.session.add_all([venue, artist])
+    db.session.commit()
+
+    def publish(*args, **kwargs):
+        raise RuntimeError('broker down')
+    monkeypatch.setattr(events, 'publish', publish)
+
+    response = client.post('/shows/create', data={'venue_id': venue.id, 'artist_id': artist.id,
+                                                  'start_time': '2030-01-01 20:00:00'})
+    assert b'successfully listed' in response.data
+    assert b'could not be listed' not in response.data
+    assert Show.query.count() == 1
+
+
+class RacingQueue(queue.Queue):
+    """Refilled once, right after it is drained, as by a deliver() that
+    listed the subscription before it was dropped."""
+
+    raced = False
+
+    def get_nowait(self):
+        if self.empty() and not self.raced:
+            self.raced = True
+            while not self.full():
+                self.put({'channel': 'show', 'id': 1, 'data': {}})
+            raise queue.Empty
+        return super().get_nowait()
+
+
+def test_dropping_a_refilled_subscription_still_ends_its_stream(hub):
+    subscription = hub.subscribe('show')
+    subscription.queue = RacingQueue(maxsize=2)
+    stream = hub.stream(subscription)
+    next(stream)
+
+    hub.drop(subscription)
+
+    assert subscription.queue.full()
+    assert next(stream).startswith('event: dropped')
+
+
+def test_gunicorn_runs_one_worker_with_the_local_broker(monkeypatch):
+    import config
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+    assert runpy.run_path(path)['workers'] == 1
+    monkeypatch.setattr(config, 'EVENTS_BROKER', 'brokers:RedisBroker')
+    assert runpy.run_path(path)['workers'] == 4
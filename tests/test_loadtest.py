@@ -0,0 +1,37 @@
+import json
+import os
+
+from app import Artist, Show, Venue
+from loadtest import Window
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_rejections_and_failed_forms_count_as_errors():
+    window = Window()
+    for status in (200, 302, 429, 503, 404, 0):
+        window.add(0.01, status)
+    window.add(0.01, 200, expected=False)
+
+    summary = window.summary(1.0)
+    assert window.errors == 5
+    assert summary['unexpected'] == 1
+    assert summary['statuses'] == {0: 1, 200: 2, 302: 1, 404: 1, 429: 1, 503: 1}
+
+
+def test_write_scenario_forms_create_records(client, db):
+    with open(os.path.join(ROOT, 'loadtest_scenarios', 'writes.json')) as f:
+        requests = {request['path']: request for request in json.load(f)['requests']}
+
+    for path in ('/venues/create', '/artists/create'):
+        form = {key: value.format(n=1, city='Austin', state='TX') for key, value in requests[path]['form'].items()}
+        response = client.post(path, data=form)
+        assert requests[path]['expect'].encode() in response.data
+
+    form = dict(requests['/shows/create']['form'], artist_id='1', venue_id='1')
+    response = client.post('/shows/create', data=form)
+    assert requests['/shows/create']['expect'].encode() in response.data
+
+    assert Venue.query.one().looking_for_talent == 'y'
+    assert Artist.query.one().looking_for_venues == 'y'
+    assert Show.query.one().start_time.year == 2030
@@ -0,0 +1,32 @@
+import json
+import os
+
+import pytest
+
+import app as fyyur
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork()')
+def test_forked_processes_write_their_logs(app, tmp_path):
+    # a forked child (gunicorn or prerender worker) restarts the writer
+    done = tmp_path / 'done'
+    pid = os.fork()
+    if pid == 0:
+        try:
+            fyyur.request_logging.after_fork()
+            app.logger.error('from the child %d', os.getpid())
+            fyyur.request_logging.listener.stop()
+            done.write_text('ok')
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert done.read_text() == 'ok'
+    with open(app.config['LOG_FILE']) as log:
+        messages = [json.loads(line)['message'] for line in log]
+    assert f'from the child {pid}' in messages
+
+
+def test_after_fork_keeps_a_running_writer(app):
+    listener = fyyur.request_logging.listener
+    fyyur.request_logging.after_fork()
+    assert fyyur.request_logging.listener is listener
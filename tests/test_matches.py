@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from app import Artist, Match, Show, Venue, refresh_matches
+
+
+def test_seekers_created_through_the_forms_are_matched(client, db):
+    client.post('/venues/create', data={
+        'name': 'The Musical Hop', 'city': 'San Francisco', 'state': 'CA',
+        'genres': 'Jazz', 'seeking_talent': 'y',
+    })
+    client.post('/artists/create', data={
+        'name': 'Guns N Petals', 'city': 'San Francisco', 'state': 'CA',
+        'genres': 'Jazz', 'seeking_venue': 'y',
+    })
+
+    venue = Venue.query.one()
+    artist = Artist.query.one()
+    assert venue.looking_for_talent == 'y'
+    assert artist.looking_for_venues == 'y'
+
+    match = Match.query.one()
+    assert (match.venue_id, match.artist_id) == (venue.id, artist.id)
+    assert match.genre_overlap == 1 and match.same_city
+
+
+def add_seekers(db):
+    venue = Venue(id=1, name='The Musical Hop', city='San Francisco', state='CA',
+                  genres='Jazz', looking_for_talent='y')
+    local = Artist(id=1, name='Local', city='San Francisco', state='CA', genres='Jazz', looking_for_venues='y')
+    busy = Artist(id=2, name='Busy', city='Oakland', state='CA', genres='Jazz', looking_for_venues='y')
+    db.session.add_all([venue, local, busy])
+    db.session.commit()
+
+
+def test_show_create_refreshes_matches_without_identity_conflicts(client, db, recwarn):
+    add_seekers(db)
+    client.post('/shows/create', data={'venue_id': 1, 'artist_id': 2, 'start_time': '2030-01-01 20:00:00'})
+
+    assert not [w for w in recwarn if 'conflicts with persistent instance' in str(w.message)]
+    match = Match.query.filter_by(venue_id=1, artist_id=2).one()
+    assert (match.artist_recent_shows, match.venue_recent_shows) == (1, 1)
+
+
+def test_recent_activity_weighs_into_the_score(client, db):
+    add_seekers(db)
+    soon = datetime.now() - timedelta(days=1)
+    db.session.add_all([Show(venue_id=1, artist_id=2, start_time=soon - timedelta(hours=n)) for n in range(10)])
+    db.session.commit()
+    refresh_matches(venue_id=1)
+
+    ranked = client.get('/venues/1/matches').get_json()['matches']
+    # the busy artist across the bay outranks the idle local one
+    assert [match['artist_id'] for match in ranked] == [2, 1]
+    assert ranked[0]['score'] > ranked[1]['score']
@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+from app import db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def flask_db(database, *args):
+    # in a process of its own, as the app binds its database on import
+    env = dict(os.environ, FLASK_APP='app.py', DATABASE_URL='sqlite:///' + database)
+    subprocess.check_call([sys.executable, '-m', 'flask', 'db'] + list(args), cwd=ROOT, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def columns(connection, table):
+    return {row[1]: row for row in connection.execute('PRAGMA table_info("%s")' % table)}
+
+
+def test_timestamps_migration_upgrades_sqlite(tmp_path):
+    database = str(tmp_path / 'fyyur.db')
+    flask_db(database, 'upgrade', '9a2c5e7f1b36')
+    connection = sqlite3.connect(database)
+    connection.execute('INSERT INTO "Venue" (id, name, state) VALUES (1, \'The Musical Hop\', \'CA\')')
+    connection.execute('INSERT INTO "Artist" (id, name) VALUES (1, \'Guns N Petals\')')
+    connection.execute('INSERT INTO "Show" (id, venue_id, artist_id, start_time) VALUES (1, 1, 1, \'2030-01-01\')')
+    connection.commit()
+
+    flask_db(database, 'upgrade')
+    venue = columns(connection, 'Venue')
+    assert venue['created_at'][3] == 1 and venue['created_at'][4] == 'CURRENT_TIMESTAMP'
+    assert connection.execute('SELECT created_at, updated_at FROM "Venue"').fetchone()[0] is not None
+    # rebuilding Venue must not cascade into its shows
+    assert connection.execute('SELECT count(*) FROM "Show"').fetchone() == (1,)
+    indexes = {row[1] for row in connection.execute('PRAGMA index_list("Venue")')}
+    assert 'ix_Venue_state_city_name_key' in indexes
+
+    flask_db(database, 'downgrade', '9a2c5e7f1b36')
+    assert 'created_at' not in columns(connection, 'Venue')
+    assert connection.execute('SELECT name FROM "Venue"').fetchone() == ('The Musical Hop',)
+
+
+def test_sqlite_foreign_keys_cascade(tmp_path):
+    database = str(tmp_path / 'fyyur.db')
+    flask_db(database, 'upgrade')
+    connection = sqlite3.connect(database)
+    for table in ('Show', 'ShowArchive', 'Match'):
+        # (id, seq, table, from, to, on_update, on_delete, match)
+        assert {(row[2], row[6]) for row in connection.execute('PRAGMA foreign_key_list("%s")' % table)} == \
+            {('Venue', 'CASCADE'), ('Artist', 'CASCADE')}
+
+
+def test_upgraded_sqlite_indexes_match_the_models(tmp_path):
+    database = str(tmp_path / 'fyyur.db')
+    flask_db(database, 'upgrade')
+    connection = sqlite3.connect(database)
+    for table in ('Venue', 'Artist', 'Show'):
+        created = {row[1] for row in connection.execute('PRAGMA index_list("%s")' % table)
+                   if not row[1].startswith('sqlite_')}
+        assert created == {index.name for index in db.metadata.tables[table].indexes}
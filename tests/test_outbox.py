@@ -0,0 +1,21 @@
+import pytest
+
+from app import OutboxEntry, Venue, check_outbox, shards
+
+
+def test_outbox_refuses_to_run_with_shards(app, monkeypatch):
+    monkeypatch.setattr(shards, 'enabled', True)
+    with pytest.raises(ValueError):
+        check_outbox(app, shards)
+    monkeypatch.setitem(app.config, 'OUTBOX_ENABLED', False)
+    check_outbox(app, shards)
+
+
+def test_disabled_outbox_records_and_serves_nothing(client, db, monkeypatch):
+    monkeypatch.setitem(client.application.config, 'OUTBOX_ENABLED', False)
+    client.post('/venues/create', data={'name': 'The Musical Hop', 'city': 'San Francisco', 'state': 'CA'})
+
+    assert Venue.query.count() == 1
+    assert OutboxEntry.query.count() == 0
+    assert client.get('/changes').status_code == 404
+    assert client.post('/changes/search/ack', data={'cursor': 1}).status_code == 404
@@ -0,0 +1,68 @@
+from datetime import datetime
+import os
+
+import prerender
+from app import Artist, Show, StalePage, Venue
+
+
+def add_catalogue(db):
+    db.session.add_all([Venue(id=1, name='The Musical Hop', city='San Francisco', state='CA', genres='Jazz'),
+                        Artist(id=1, name='Guns N Petals', city='San Francisco', state='CA', genres='Jazz')])
+    db.session.flush()
+    db.session.add(Show(id=1, venue_id=1, artist_id=1, start_time=datetime(2030, 1, 1, 20)))
+    db.session.commit()
+
+
+def stale(db):
+    db.session.expire_all()
+    return {page.path for page in StalePage.query}
+
+
+def page(out, path):
+    with open(prerender.output_file(str(out), path), 'rb') as f:
+        return f.read()
+
+
+def test_full_build_renders_every_page(db, tmp_path):
+    add_catalogue(db)
+
+    result = prerender.build(str(tmp_path), full=True, workers=1)
+    assert (result['rendered'], result['removed'], result['failed']) == (5, 0, 0)
+    assert b'The Musical Hop' in page(tmp_path, '/venues/1')
+    assert b'Guns N Petals' in page(tmp_path, '/artists/1')
+    assert os.path.isdir(os.path.join(str(tmp_path), 'static'))
+
+
+def test_writes_mark_pages_that_an_incremental_build_refreshes(client, db, tmp_path):
+    add_catalogue(db)
+    prerender.build(str(tmp_path), full=True, workers=1)
+    assert stale(db) == set()
+
+    response = client.post('/venues/1/edit', data={'name': 'The Hop', 'city': 'San Francisco', 'state': 'CA',
+                                                   'genres': 'Jazz', 'version': 1})
+    assert response.status_code == 302
+    assert stale(db) == {'/venues', '/venues/1', '/artists/1', '/shows'}
+
+    result = prerender.build(str(tmp_path), workers=1)
+    assert (result['rendered'], result['failed']) == (4, 0)
+    assert b'The Hop' in page(tmp_path, '/venues/1')
+    assert stale(db) == set()
+
+
+def test_deleted_records_lose_their_pages(client, db, tmp_path):
+    add_catalogue(db)
+    prerender.build(str(tmp_path), full=True, workers=1)
+
+    client.post('/venues/delete', data={'ids': '1'})
+    result = prerender.build(str(tmp_path), workers=1)
+    assert result['removed'] == 1
+    assert not os.path.exists(prerender.output_file(str(tmp_path), '/venues/1'))
+    assert b'Guns N Petals' in page(tmp_path, '/artists/1')
+
+
+def test_prerender_command(app, db, tmp_path):
+    add_catalogue(db)
+
+    result = app.test_cli_runner().invoke(args=['prerender', '--full', '--workers', '1', '--out', str(tmp_path)])
+    assert result.exit_code == 0
+    assert result.output.startswith('5 pages rendered, 0 removed, 0 failed')
@@ -0,0 +1,66 @@
+import os
+
+from flask import Flask
+
+from profiling import RequestProfiler
+
+
+def make_app(directory, **config):
+    app = Flask(__name__)
+    app.config.update(dict(PROFILE_DIR=str(directory), PROFILE_TOKEN='secret', PROFILE_KEEP=2), **config)
+    app.add_url_rule('/venues', 'venues', lambda: 'ok')
+
+    def broken():
+        raise RuntimeError('boom')
+    app.add_url_rule('/broken', 'broken', broken)
+    profiler = RequestProfiler(app)
+    return app, profiler
+
+
+def captures(directory, endpoint):
+    folder = os.path.join(str(directory), endpoint)
+    return sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+
+def test_only_requests_with_the_token_are_profiled(tmp_path):
+    app, profiler = make_app(tmp_path)
+    client = app.test_client()
+
+    assert 'X-Profile-Capture' not in client.get('/venues').headers
+    assert 'X-Profile-Capture' not in client.get('/venues', headers={'X-Profile': 'guess'}).headers
+    assert captures(tmp_path, 'venues') == []
+
+    response = client.get('/venues', headers={'X-Profile': 'secret'})
+    assert response.headers['X-Profile-Capture'].startswith('venues' + os.sep)
+    assert os.path.isfile(os.path.join(str(tmp_path), response.headers['X-Profile-Capture']))
+
+
+def test_without_a_token_nothing_is_profiled(tmp_path):
+    app, profiler = make_app(tmp_path, PROFILE_TOKEN=None)
+    assert 'X-Profile-Capture' not in app.test_client().get('/venues', headers={'X-Profile': ''}).headers
+
+
+def test_only_the_newest_captures_are_kept_and_reported(tmp_path):
+    app, profiler = make_app(tmp_path)
+    client = app.test_client()
+    for _ in range(4):
+        client.get('/venues', headers={'X-Profile': 'secret'})
+
+    assert len(captures(tmp_path, 'venues')) == 2
+    report = profiler.report()
+    assert 'venues: 2 captures' in report
+    assert profiler.report(endpoint='broken') == ''
+
+
+def test_a_failed_view_releases_the_profiler(tmp_path):
+    app, profiler = make_app(tmp_path)
+    client = app.test_client()
+
+    assert client.get('/broken', headers={'X-Profile': 'secret'}).status_code == 500
+    assert not profiler.lock.locked()
+    assert 'X-Profile-Capture' in client.get('/venues', headers={'X-Profile': 'secret'}).headers
+
+
+def test_sampling_profiles_without_the_header(tmp_path):
+    app, profiler = make_app(tmp_path, PROFILE_TOKEN=None, PROFILE_SAMPLE_RATE=1.0)
+    assert 'X-Profile-Capture' in app.test_client().get('/venues').headers
@@ -0,0 +1,32 @@
+import app as fyyur
+
+
+def test_health_does_not_wait_for_warm_up(client, monkeypatch):
+    monkeypatch.setattr(fyyur, 'ready', False)
+    response = client.get('/healthz')
+    assert response.get_json() == {'status': 'ok'}
+    assert response.headers['Cache-Control'] == 'no-store'
+
+
+def test_readiness_warms_up_on_the_first_probe(client, db, monkeypatch):
+    monkeypatch.setattr(fyyur, 'ready', False)
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert response.get_json() == {'status': 'ready'}
+    assert fyyur.ready
+
+
+def test_a_failed_warm_up_keeps_readiness_down_until_it_succeeds(client, db, monkeypatch):
+    monkeypatch.setattr(fyyur, 'ready', False)
+
+    def broken():
+        raise RuntimeError('database down')
+    monkeypatch.setattr(fyyur, 'warm_pool', broken)
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.get_json() == {'status': 'warming up'}
+    assert not fyyur.ready
+
+    monkeypatch.undo()
+    monkeypatch.setattr(fyyur, 'ready', False)
+    assert client.get('/readyz').status_code == 200
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from app import Artist, Show, Venue
+
+
+def add_show(db, venue_genres, artist_genres):
+    venue = Venue(name='The Musical Hop', city='San Francisco', state='CA', genres=venue_genres)
+    artist = Artist(name='Guns N Petals', city='San Francisco', state='CA', genres=artist_genres)
+    db.session.add_all([venue, artist])
+    db.session.flush()
+    db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=datetime(2030, 1, 1, 20)))
+    db.session.commit()
+
+
+def search(client, genre):
+    return client.get('/shows/search', query_string={'genre': genre, 'format': 'json'}).get_json()['count']
+
+
+def test_genre_filter_matches_whole_genres(client, db):
+    add_show(db, '{Jazz,"Rock n Roll"}', 'Blues, Folk')
+
+    assert search(client, 'Rock') == 0
+    assert search(client, 'Rock n Roll') == 1
+    assert search(client, 'jazz') == 1
+    assert search(client, 'Folk') == 1
+    assert search(client, 'Jaz') == 0
+    assert search(client, '%') == 0
+
+
+def test_no_single_column_indexes_shadowed_by_composites(db):
+    indexes = {index.name for model in (Venue, Artist, Show) for index in model.__table__.indexes}
+    assert {'ix_Show_start_time_id', 'ix_Show_venue_start_time', 'ix_Show_artist_start_time',
+            'ix_Venue_state_city_name_key', 'ix_Artist_state_city_name_key'} <= indexes
+    assert not indexes & {'ix_Show_start_time', 'ix_Show_venue_id', 'ix_Show_artist_id',
+                          'ix_Venue_state', 'ix_Venue_city', 'ix_Venue_state_city',
+                          'ix_Artist_state', 'ix_Artist_city'}
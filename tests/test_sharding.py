@@ -0,0 +1,95 @@
+import pytest
+
+import app as fyyur
+from app import SHARDED_MODELS, Artist, ShardMap, ShardSequence, Show, Venue, VenueShard
+from sharding import PRIMARY, ShardRouter
+
+
+@pytest.fixture
+def shards(app, db, tmp_path, monkeypatch):
+    # the app is imported unsharded; route it through a router with a
+    # second SQLite shard, 'west', for the length of a test
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', {'west': 'sqlite:///' + str(tmp_path / 'west.db')})
+    monkeypatch.setitem(app.config, 'SHARDS', ['west'])
+    monkeypatch.setitem(app.config, 'SHARD_MAP_SECONDS', 0)
+    monkeypatch.setitem(app.config, 'OUTBOX_ENABLED', False)
+    # the router registers a teardown, which debug mode refuses once the
+    # app has served a request
+    monkeypatch.setitem(app.config, 'DEBUG', False)
+    monkeypatch.setattr(app, 'teardown_appcontext_funcs', list(app.teardown_appcontext_funcs))
+    router = ShardRouter(app, db, ShardMap, ShardSequence)
+    db.Model.metadata.create_all(router.engine('west'), tables=[model.__table__ for model in SHARDED_MODELS])
+    monkeypatch.setattr(fyyur, 'shards', router)
+    # move-state waits for every process to re-read the shard map
+    monkeypatch.setattr(fyyur.time, 'sleep', lambda seconds: None)
+    yield router
+    router.remove()
+    router.executor.shutdown()
+    router.engine('west').dispose()
+
+
+def assign(db, state, shard, moving=False):
+    db.session.merge(ShardMap(state=state, shard=shard, moving=moving, updated_at=fyyur.datetime.now()))
+    db.session.commit()
+
+
+def create(client, kind, **form):
+    response = client.post(f'/{kind}/create', data=dict(allow_duplicate='1', **form))
+    assert b'successfully listed' in response.data
+
+
+def venues_on(shards, name):
+    return sorted((venue.name, venue.state) for venue in shards.session(name).query(Venue))
+
+
+def add_catalogue(client, db):
+    assign(db, 'TX', 'west')
+    create(client, 'venues', name='The Musical Hop', city='San Francisco', state='CA', genres='Jazz')
+    create(client, 'venues', name='Park Square Live', city='Austin', state='TX', genres='Folk')
+    create(client, 'artists', name='Guns N Petals', city='San Francisco', state='CA', genres='Jazz')
+    create(client, 'shows', venue_id='1', artist_id='1', start_time='2030-01-01 20:00:00')
+    create(client, 'shows', venue_id='2', artist_id='1', start_time='2030-01-02 20:00:00')
+
+
+def test_venues_and_their_shows_live_on_the_shard_of_their_state(client, db, shards):
+    add_catalogue(client, db)
+
+    assert venues_on(shards, PRIMARY) == [('The Musical Hop', 'CA')]
+    assert venues_on(shards, 'west') == [('Park Square Live', 'TX')]
+    assert sorted((row.venue_id, row.state) for row in VenueShard.query) == [(1, 'CA'), (2, 'TX')]
+    assert [show.venue_id for show in shards.session('west').query(Show)] == [2]
+    # artists are copied to every shard so that shows can join them there
+    assert [artist.name for artist in shards.session('west').query(Artist)] == ['Guns N Petals']
+
+    page = client.get('/venues').data
+    assert b'The Musical Hop' in page and b'Park Square Live' in page
+    assert b'Park Square Live' in client.get('/artists/1').data
+    assert b'Guns N Petals' in client.get('/venues/2').data
+    search = client.get('/shows/search', query_string={'format': 'json'}).get_json()
+    assert search['count'] == 2
+
+
+def test_move_state_takes_the_venues_and_shows_along(app, client, db, shards):
+    add_catalogue(client, db)
+
+    result = app.test_cli_runner().invoke(args=['move-state', 'CA', 'west'])
+    assert result.exit_code == 0, result.output
+    assert 'CA is now on west' in result.output
+
+    assert venues_on(shards, PRIMARY) == []
+    assert venues_on(shards, 'west') == [('Park Square Live', 'TX'), ('The Musical Hop', 'CA')]
+    assert sorted(show.venue_id for show in shards.session('west').query(Show)) == [1, 2]
+    assert shards.assignments()['CA'] == ('west', False)
+    assert b'Guns N Petals' in client.get('/venues/1').data
+
+
+def test_writes_to_a_moving_state_are_refused(client, db, shards):
+    add_catalogue(client, db)
+    assign(db, 'CA', PRIMARY, moving=True)
+
+    response = client.post('/venues/create', data={'name': 'The Dueling Pianos', 'city': 'San Francisco',
+                                                   'state': 'CA', 'genres': 'Jazz', 'allow_duplicate': '1'})
+    assert b'could not be listed' in response.data
+    assert client.post('/venues/delete', data={'ids': '1'}).status_code == 503
+    assert venues_on(shards, PRIMARY) == [('The Musical Hop', 'CA')]
+    assert shards.metrics()['moving'] == ['CA']
@@ -0,0 +1,74 @@
+from app import CatalogueStat, StatsDelta, fold_stats, rebuild_stats
+
+
+def create(client, kind, **form):
+    response = client.post(f'/{kind}/create', data=dict(allow_duplicate='1', **form))
+    assert b'successfully listed' in response.data
+
+
+def add_catalogue(client):
+    create(client, 'venues', name='The Musical Hop', city='San Francisco', state='CA', genres='Jazz')
+    create(client, 'venues', name='Park Square Live', city='Austin', state='TX', genres='Folk')
+    create(client, 'artists', name='Guns N Petals', city='San Francisco', state='CA', genres='Rock n Roll')
+    create(client, 'shows', venue_id='1', artist_id='1', start_time='2030-01-01 20:00:00')
+    create(client, 'shows', venue_id='2', artist_id='1', start_time='2030-02-01 20:00:00')
+
+
+def rows(stats, dimension):
+    return {row['key']: (row['venues'], row['artists'], row['shows']) for row in stats[dimension]}
+
+
+def rollup(db):
+    db.session.expire_all()
+    return sorted((stat.dimension, stat.key, stat.venues, stat.artists, stat.shows)
+                  for stat in CatalogueStat.query
+                  if stat.venues or stat.artists or stat.shows)
+
+
+def test_writes_are_folded_into_the_rollup(client, db):
+    add_catalogue(client)
+
+    stats = client.get('/stats.json').get_json()
+    assert stats['totals'] == {'venues': 2, 'artists': 1, 'shows': 2}
+    assert rows(stats, 'state') == {'CA': (1, 1, 1), 'TX': (1, 0, 1)}
+    assert rows(stats, 'city') == {'San Francisco, CA': (1, 1, 1), 'Austin, TX': (1, 0, 1)}
+    # shows count under their artist's genres and their venue's location
+    assert rows(stats, 'genre') == {'Jazz': (1, 0, 0), 'Folk': (1, 0, 0), 'Rock n Roll': (0, 1, 2)}
+    assert rows(stats, 'month') == {'2030-01': (0, 0, 1), '2030-02': (0, 0, 1)}
+    assert StatsDelta.query.count() == 0
+
+
+def test_edits_and_deletes_move_the_counts(client, db):
+    add_catalogue(client)
+
+    response = client.post('/venues/2/edit', data={'name': 'Park Square Live', 'city': 'Dallas', 'state': 'TX',
+                                                   'genres': 'Folk', 'version': 1})
+    assert response.status_code == 302
+    stats = client.get('/stats.json').get_json()
+    assert rows(stats, 'city') == {'San Francisco, CA': (1, 1, 1), 'Dallas, TX': (1, 0, 1)}
+
+    client.post('/venues/delete', data={'ids': '1'})
+    stats = client.get('/stats.json').get_json()
+    assert stats['totals'] == {'venues': 1, 'artists': 1, 'shows': 1}
+    assert rows(stats, 'state') == {'CA': (0, 1, 0), 'TX': (1, 0, 1)}
+    assert rows(stats, 'month') == {'2030-02': (0, 0, 1)}
+
+
+def test_rebuild_matches_the_incremental_rollup(client, db):
+    add_catalogue(client)
+    client.post('/artists/delete', data={'ids': '1'})
+    incremental = rollup(db)
+
+    rebuild_stats()
+    assert rollup(db) == incremental
+    assert fold_stats() == 0
+
+
+def test_rebuild_stats_command(app, client, db):
+    add_catalogue(client)
+    db.session.query(CatalogueStat).delete()
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['rebuild-stats'])
+    assert result.exit_code == 0
+    assert client.get('/stats.json').get_json()['totals'] == {'venues': 2, 'artists': 1, 'shows': 2}
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import Job
+from tasks import QueueFull, TaskQueue
+
+
+@pytest.fixture
+def queue(app, db, monkeypatch):
+    def make(backend):
+        monkeypatch.setitem(app.config, 'TASK_BACKEND', backend)
+        tasks = TaskQueue()
+        tasks.init_app(app, db, Job)
+        return tasks
+    return make
+
+
+def test_failing_inline_fallback_does_not_reach_the_caller(queue, monkeypatch):
+    tasks = queue('thread')
+    calls = []
+
+    @tasks.task
+    def broken():
+        calls.append(1)
+        raise RuntimeError('boom')
+
+    def full(name, kwargs):
+        raise QueueFull(name)
+    monkeypatch.setattr(tasks.backend, 'submit', full)
+
+    tasks.enqueue(broken)
+    assert calls == [1]
+    assert tasks.backend.stats['inline_fallbacks'] == 1
+    assert tasks.backend.stats['failed'] == 1
+
+
+def test_jobs_of_dead_workers_are_reclaimed(queue, db):
+    tasks = queue('database')
+    done = []
+
+    @tasks.task
+    def work(n):
+        done.append(n)
+
+    tasks.enqueue(work, n=1)
+    job = tasks.backend.claim()
+    assert job.status == 'running'
+    # the worker dies without finishing the job
+    assert tasks.backend.run_once() is False
+
+    job.claimed_at = datetime.now() - timedelta(seconds=tasks.backend.lease + 1)
+    db.session.commit()
+    assert tasks.backend.run_once() is True
+    assert done == [1]
+    assert tasks.backend.stats['reclaimed'] == 1
+    assert Job.query.count() == 0
+
+
+def test_jobs_out_of_attempts_are_not_reclaimed(queue, db):
+    tasks = queue('database')
+
+    @tasks.task
+    def work():
+        pass
+
+    tasks.enqueue(work)
+    job = tasks.backend.claim()
+    job.attempts = tasks.backend.max_retries + 1
+    job.claimed_at = datetime.now() - timedelta(seconds=tasks.backend.lease + 1)
+    db.session.commit()
+    assert tasks.backend.run_once() is False
+    assert Job.query.one().status == 'failed'
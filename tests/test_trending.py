@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+from app import Artist, Show, TrendingRollup, Venue, merge_records, update_trending
+
+
+def add_show(db, id, created_at=None):
+    db.session.add(Show(id=id, artist_id=1, venue_id=1, start_time=datetime.now() + timedelta(days=1),
+                        created_at=created_at or datetime.now()))
+    db.session.commit()
+
+
+def venue_shows(db):
+    return sum(rollup.shows for rollup in TrendingRollup.query.filter_by(kind='venue'))
+
+
+def test_shows_committed_late_are_not_skipped(db):
+    db.session.add_all([Venue(id=1, name='Hop', city='San Francisco', state='CA'),
+                        Artist(id=1, name='Petals', city='San Francisco', state='CA')])
+    db.session.commit()
+    add_show(db, 1)
+    # show 2 is still in an open transaction when show 3 commits
+    add_show(db, 3)
+    assert update_trending() == 1
+
+    add_show(db, 2)
+    assert update_trending() == 2
+    assert venue_shows(db) == 3
+
+
+def test_old_gaps_do_not_hold_shows_back(db):
+    db.session.add_all([Venue(id=1, name='Hop', city='San Francisco', state='CA'),
+                        Artist(id=1, name='Petals', city='San Francisco', state='CA')])
+    db.session.commit()
+    # show 1 was rolled back long ago
+    add_show(db, 2, created_at=datetime.now() - timedelta(minutes=5))
+    add_show(db, 3)
+    assert update_trending() == 2
+    assert venue_shows(db) == 2
+
+
+def rollup(db, kind):
+    counts = {}
+    for row in TrendingRollup.query.filter_by(kind=kind):
+        counts[row.key] = counts.get(row.key, 0) + row.shows
+    return counts
+
+
+def add_two_venues(db):
+    db.session.add_all([Venue(id=1, name='Hop', city='San Francisco', state='CA'),
+                        Venue(id=2, name='The Hop', city='Oakland', state='CA'),
+                        Artist(id=1, name='Petals', city='San Francisco', state='CA')])
+    db.session.flush()
+    db.session.add_all([Show(id=id, artist_id=1, venue_id=venue_id, start_time=datetime.now() + timedelta(days=1))
+                        for id, venue_id in ((1, 1), (2, 2), (3, 2))])
+    db.session.commit()
+    update_trending()
+    assert rollup(db, 'venue') == {'1': 1, '2': 2}
+
+
+def test_deleted_venues_leave_the_rollup(client, db):
+    add_two_venues(db)
+    client.post('/venues/delete', data={'ids': '2'})
+
+    db.session.expire_all()
+    assert rollup(db, 'venue') == {'1': 1}
+    assert rollup(db, 'city') == {'San Francisco, CA': 1}
+    assert rollup(db, 'artist') == {'1': 1}
+
+
+def test_merged_venues_count_for_the_canonical_one(db):
+    add_two_venues(db)
+    merge_records(Venue, 2, 1)
+    db.session.commit()
+
+    assert rollup(db, 'venue') == {'1': 3}
+    assert rollup(db, 'city') == {'San Francisco, CA': 3}
+    assert rollup(db, 'artist') == {'1': 3}
+
+
+def test_shows_follow_their_venue_to_its_new_city(client, db):
+    add_two_venues(db)
+    client.post('/venues/2/edit', data={'name': 'The Hop', 'city': 'Berkeley', 'state': 'CA', 'version': 1})
+
+    db.session.expire_all()
+    assert rollup(db, 'city') == {'San Francisco, CA': 1, 'Berkeley, CA': 2}
+    assert rollup(db, 'venue') == {'1': 1, '2': 2}
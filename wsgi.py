@@ -0,0 +1,8 @@
+# Entry point for WSGI servers, e.g.
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# Unlike importing app directly (as the flask CLI does), this warms the app
+# up before it starts taking traffic.
+
+from app import app, warm_up
+
+warm_up()